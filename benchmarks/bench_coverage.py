@@ -0,0 +1,81 @@
+"""Coverage resolution against the length of the mutation history.
+
+    python benchmarks/bench_coverage.py [MUTATIONS ...]
+
+Fills one schedule of 10 shifts with MUTATIONS mutations spread over the
+past years, then times get_cover for one (shift, date), list_covers for a
+week, and the naive approach of walking Shift.mutations in Python.
+"""
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from rabbot import api
+from rabbot.models import BASE, Mutation, Schedule, Shift, User
+
+SHIFTS = 10
+USERS = 20
+REPEAT = 20
+EPOCH = datetime(2010, 1, 1)
+
+
+def build(mutations: int):
+    """Return an engine holding one schedule with `mutations` mutations."""
+    engine = create_engine('sqlite:///:memory:')
+    BASE.metadata.create_all(engine)
+    days = max(1, mutations // (SHIFTS * 3))
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {'user_id': i, 'telegram_user_id': i}
+            for i in range(1, USERS + 1)])
+        connection.execute(insert(Schedule), [
+            {'schedule_id': 1, 'telegram_group_id': 1}])
+        connection.execute(insert(Shift), [
+            {'shift_id': i, 'schedule_id': 1, 'name': str(i), 'ordering': i}
+            for i in range(1, SHIFTS + 1)])
+        connection.execute(insert(Mutation), [
+            {'schedule_id': 1,
+             'shift_id': random.randint(1, SHIFTS),
+             'shift_date': EPOCH + timedelta(days=random.randrange(days)),
+             'mutator_id': random.randint(1, USERS),
+             'new_user_id': random.choice([None, random.randint(1, USERS)])}
+            for _ in range(mutations)])
+    return engine, days
+
+
+def naive_cover(session, shift_id, shift_date):
+    """Walk every mutation the shift ever had."""
+    latest = None
+    for mutation in session.get(Shift, shift_id).mutations:
+        if mutation.shift_date == shift_date:
+            if latest is None or mutation.mutation_id > latest.mutation_id:
+                latest = mutation
+    return latest
+
+
+def main(sizes):
+    print("{:>9} {:>14} {:>16} {:>14}".format(
+        "mutations", "get_cover", "list_covers(7d)", "naive walk"))
+    for size in sizes:
+        engine, days = build(size)
+        day = EPOCH + timedelta(days=days // 2)
+        week = (day, day + timedelta(days=7))
+
+        def timed(call):
+            def run():
+                with Session(engine) as session:
+                    call(session)
+            return timeit.timeit(run, number=REPEAT) / REPEAT
+        print("{:>9} {:>12.2f}ms {:>14.2f}ms {:>12.2f}ms".format(
+            size,
+            timed(lambda s: api.get_cover(s, 1, day)) * 1e3,
+            timed(lambda s: api.list_covers(s, 1, *week)) * 1e3,
+            timed(lambda s: naive_cover(s, 1, day)) * 1e3))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 300000])
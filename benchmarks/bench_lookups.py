@@ -0,0 +1,79 @@
+"""Lookup latency against table size, with and without indexes.
+
+    python benchmarks/bench_lookups.py [SIZE ...]
+
+For every table size, fill a fresh in-memory database with that many
+schedules, users and shifts, then time get_schedule, get_user and
+get_shift_by_name once on the indexed schema and once with every index
+dropped (which is what databases created before rabbot shipped indexes
+look like).
+"""
+import random
+import sys
+import timeit
+
+from sqlalchemy import create_engine, inspect, insert, text
+from sqlalchemy.orm import Session
+
+from rabbot import api
+from rabbot.models import BASE, Schedule, Shift, User
+
+LOOKUPS = 200
+
+
+def build(size: int, indexed: bool):
+    """Return an engine holding `size` schedules, users and shifts."""
+    engine = create_engine('sqlite:///:memory:')
+    BASE.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if not indexed:
+            for table in BASE.metadata.sorted_tables:
+                for index in inspect(connection).get_indexes(table.name):
+                    connection.execute(
+                        text('DROP INDEX {}'.format(index['name'])))
+        connection.execute(insert(User), [
+            {'user_id': i, 'telegram_user_id': i} for i in range(1, size + 1)])
+        connection.execute(insert(Schedule), [
+            {'schedule_id': i, 'telegram_group_id': i}
+            for i in range(1, size + 1)])
+        connection.execute(insert(Shift), [
+            {'schedule_id': i, 'name': 'shift {}'.format(i), 'ordering': 0}
+            for i in range(1, size + 1)])
+    return engine
+
+
+def time_lookups(engine, size: int) -> dict:
+    """Return mean seconds per call for each lookup."""
+    ids = [random.randint(1, size) for _ in range(LOOKUPS)]
+    calls = {
+        'get_schedule': lambda s, i: api.get_schedule(s, i),
+        'get_user': lambda s, i: api.get_user(s, i),
+        'get_shift_by_name':
+            lambda s, i: api.get_shift_by_name(s, i, 'shift {}'.format(i)),
+    }
+    timings = {}
+    for name, call in calls.items():
+        with Session(engine) as session:
+            def run():
+                for i in ids:
+                    assert call(session, i).success
+                    # Every lookup should hit the database, not the
+                    # identity map.
+                    session.expunge_all()
+            timings[name] = timeit.timeit(run, number=1) / LOOKUPS
+    return timings
+
+
+def main(sizes):
+    print("{:>8} {:>18} {:>12} {:>12}".format(
+        "rows", "lookup", "indexed", "no index"))
+    for size in sizes:
+        indexed = time_lookups(build(size, True), size)
+        unindexed = time_lookups(build(size, False), size)
+        for name in indexed:
+            print("{:>8} {:>18} {:>10.1f}us {:>10.1f}us".format(
+                size, name, indexed[name] * 1e6, unindexed[name] * 1e6))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000, 100000])
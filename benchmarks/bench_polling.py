@@ -0,0 +1,54 @@
+"""Update throughput of the polling pipeline against a local stub server.
+
+    python benchmarks/bench_polling.py [UPDATES] [CHATS] [HANDLER_MS]
+
+Serves UPDATES updates spread over CHATS chats from a StubBotAPI and
+measures how fast the dispatcher gets through them with handlers that
+block for HANDLER_MS milliseconds (a stand-in for a database call), for
+several worker counts. One worker is what the old telepot message_loop
+amounted to.
+"""
+import asyncio
+import sys
+import time
+
+from rabbot.bot_api import BotAPI
+from rabbot.dispatch import Dispatcher
+from rabbot.polling import poll
+from rabbot.stub_bot_api import StubBotAPI
+
+
+async def measure(updates: int, chats: int, handler_ms: float,
+                  workers: int) -> float:
+    stub = StubBotAPI([
+        {'update_id': i, 'message': {'chat': {'id': i % chats}, 'text': ''}}
+        for i in range(1, updates + 1)])
+    bot_api = BotAPI('token', await stub.start())
+    dispatcher = Dispatcher(
+        lambda update: time.sleep(handler_ms / 1000), workers=workers)
+    dispatcher.start()
+    stop = asyncio.Event()
+    started = time.perf_counter()
+    polling = asyncio.ensure_future(
+        poll(bot_api, dispatcher, timeout=0, stop=stop))
+    while dispatcher.handled < updates:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await polling
+    await dispatcher.stop()
+    await bot_api.close()
+    await stub.stop()
+    return updates / elapsed
+
+
+def main(updates=2000, chats=50, handler_ms=2.0):
+    print("{:>8} {:>14}".format("workers", "updates/sec"))
+    for workers in (1, 4, 16, 64):
+        rate = asyncio.run(measure(updates, chats, handler_ms, workers))
+        print("{:>8} {:>14.0f}".format(workers, rate))
+
+
+if __name__ == '__main__':
+    ARGS = sys.argv[1:]
+    main(*[int(ARGS[0]), int(ARGS[1]), float(ARGS[2])][:len(ARGS)])
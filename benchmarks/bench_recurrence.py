@@ -0,0 +1,60 @@
+"""Peak memory of iter_shifts against the width of the window.
+
+    python benchmarks/bench_recurrence.py [DAYS ...]
+
+Streams every occurrence of a 10-shift schedule with a year of mutations
+and reports the peak memory allocated while consuming the stream. The
+peak should not grow with the window.
+"""
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from rabbot import api
+from rabbot.models import BASE, Mutation, Schedule, Shift
+
+EPOCH = datetime(2016, 1, 1)
+
+
+def build():
+    engine = create_engine('sqlite:///:memory:')
+    BASE.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Schedule), [
+            {'schedule_id': 1, 'telegram_group_id': 1}])
+        connection.execute(insert(Shift), [
+            {'shift_id': i, 'schedule_id': 1, 'name': str(i), 'ordering': i,
+             'recurrence': random.choice(['daily', 'mon,wed,fri', 'sat'])}
+            for i in range(1, 11)])
+        connection.execute(insert(Mutation), [
+            {'schedule_id': 1, 'shift_id': random.randint(1, 10),
+             'shift_date': EPOCH + timedelta(days=random.randrange(365))}
+            for _ in range(20000)])
+    return engine
+
+
+def main(widths):
+    engine = build()
+    print("{:>7} {:>12} {:>10} {:>10}".format(
+        "days", "occurrences", "peak", "time"))
+    for width in widths:
+        with Session(engine) as session:
+            tracemalloc.start()
+            started = time.perf_counter()
+            result = api.iter_shifts(
+                session, 1, EPOCH, EPOCH + timedelta(days=width))
+            count = sum(1 for _ in result.value)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        print("{:>7} {:>12} {:>8.0f}kB {:>8.2f}s".format(
+            width, count, peak / 1024, elapsed))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [7, 365, 3650, 36500])
@@ -0,0 +1,59 @@
+"""Allocations made by the API layer per add_shift call.
+
+    python benchmarks/bench_results.py [CALLS]
+
+Calls add_shift CALLS times with valid input and CALLS times with input
+that fails every validator, keeping the returned Results alive. Reports
+the memory blocks and bytes allocated by rabbot/api per call, as traced
+by tracemalloc, and the time per call.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from rabbot import api
+from rabbot.models import BASE, Schedule
+
+API_FILES = os.path.join('rabbot', 'api', '*')
+
+
+def measure(session, calls: int, make_args) -> tuple:
+    """Return (blocks per call, bytes per call, seconds per call)."""
+    results = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    for number in range(calls):
+        results.append(api.add_shift(session, *make_args(number)))
+    seconds = time.perf_counter() - started
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    filters = [tracemalloc.Filter(True, '*' + API_FILES)]
+    stats = after.filter_traces(filters).compare_to(
+        before.filter_traces(filters), 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    return blocks / calls, size / calls, seconds / calls
+
+
+def main(calls: int=2000):
+    engine = create_engine('sqlite:///:memory:')
+    BASE.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Schedule(telegram_group_id=1))
+        session.commit()
+        for label, make_args in (
+                ('valid', lambda n: (1, 'shift {}'.format(n), n)),
+                ('invalid', lambda n: (2, '', 'first'))):
+            blocks, size, seconds = measure(session, calls, make_args)
+            print("{:>8}: {:6.1f} blocks {:8.1f} bytes {:8.1f}us per call"
+                  .format(label, blocks, size, seconds * 1e6))
+            session.rollback()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,75 @@
+"""Update throughput of the Supervisor against the number of processes.
+
+    python benchmarks/bench_supervisor.py [UPDATES] [WORKERS ...]
+
+Fills a file-backed SQLite database with a synthetic roster (see
+generators.py) and replays UPDATES updates spread over its groups through
+a Supervisor with each number of worker processes. Every update renders
+a week of its group's roster through rabbot.api. The number of cores is
+printed with the results, which are only comparable between machines
+with the same count.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from rabbot import api
+from rabbot.database import make_engine
+from rabbot.models import SessionScope
+from rabbot.supervisor import Supervisor
+
+import generators
+
+GROUPS = 50
+
+
+def render_week(update):
+    """Handler: list a week of the chat's roster, as a bot command would."""
+    start = generators.START + timedelta(days=update['update_id'] % 300)
+    with SessionScope() as session:
+        lines = []
+        for day, shift, mutation in api.iter_shifts(
+                session, update['message']['chat']['id'], start,
+                start + timedelta(days=7)).value:
+            cover = mutation.new_user.name if mutation and \
+                mutation.new_user else 'open'
+            lines.append('{} {}: {}'.format(day, shift.name, cover))
+    return lines
+
+
+async def replay(url: str, updates: int, workers: int) -> float:
+    supervisor = Supervisor(render_week, workers=workers, database_url=url,
+                            threads=2)
+    supervisor.start()
+    # Let the workers start before the clock runs.
+    await supervisor.submit({'update_id': 0, 'message': {'chat': {'id': 1}}})
+    await supervisor.join()
+    started = time.perf_counter()
+    for update_id in range(1, updates + 1):
+        await supervisor.submit({
+            'update_id': update_id,
+            'message': {'chat': {'id': 1 + update_id % GROUPS}}})
+    await supervisor.join()
+    seconds = time.perf_counter() - started
+    await supervisor.stop()
+    return updates / seconds
+
+
+def main(updates: int=2000, *workers):
+    with tempfile.TemporaryDirectory() as directory:
+        url = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        engine = make_engine(url)
+        generators.generate(engine, groups=GROUPS, members=20, shifts=8,
+                            years=1)
+        engine.dispose()
+        print("{} cores".format(os.cpu_count()))
+        for count in workers or (1, 2, 4):
+            rate = asyncio.run(replay(url, updates, count))
+            print("{:>3} workers: {:8.0f} updates/s".format(count, rate))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,62 @@
+"""Acknowledgement latency of the webhook receiver under load.
+
+    python benchmarks/bench_webhook.py [UPDATES] [CONCURRENCY]
+
+POSTs UPDATES recorded-style updates to a local WebhookReceiver from
+CONCURRENCY concurrent clients and reports throughput and the p50/p99
+time until each POST was acknowledged, plus how many were rejected
+with 429 because the queue was full.
+"""
+import asyncio
+import sys
+import time
+
+import aiohttp
+
+from rabbot.dispatch import Dispatcher
+from rabbot.webhook import WebhookReceiver
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def measure(updates: int, concurrency: int):
+    dispatcher = Dispatcher(lambda update: time.sleep(0.001), workers=16)
+    dispatcher.start()
+    receiver = WebhookReceiver(dispatcher)
+    url = await receiver.start(port=0) + '/webhook'
+    pending = iter(range(1, updates + 1))
+    latencies, statuses = [], []
+
+    async def client(session):
+        for update_id in pending:
+            update = {'update_id': update_id, 'message': {
+                'chat': {'id': update_id % 100}, 'text': 'hello'}}
+            started = time.perf_counter()
+            async with session.post(url, json=update) as reply:
+                await reply.read()
+            latencies.append(time.perf_counter() - started)
+            statuses.append(reply.status)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    await receiver.stop()
+    await dispatcher.stop()
+    return elapsed, latencies, statuses
+
+
+def main(updates=5000, concurrency=50):
+    elapsed, latencies, statuses = asyncio.run(measure(updates, concurrency))
+    print("updates      {}".format(updates))
+    print("requests/sec {:.0f}".format(updates / elapsed))
+    print("p50          {:.2f}ms".format(percentile(latencies, 0.50) * 1e3))
+    print("p99          {:.2f}ms".format(percentile(latencies, 0.99) * 1e3))
+    print("rejected     {}".format(statuses.count(429)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,46 @@
+"""Compare two benchmark result files written by suite.py.
+
+    python benchmarks/compare.py BASELINE.json CANDIDATE.json [--threshold 1.2]
+
+Prints the mean time of every benchmark in both files and their ratio,
+and exits with status 1 if any benchmark got slower than threshold times
+the baseline.
+"""
+import argparse
+import json
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args(argv)
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.candidate) as candidate_file:
+        candidate = json.load(candidate_file)
+    print("{:<32} {:>10} {:>10} {:>7}".format(
+        "benchmark", baseline['commit'], candidate['commit'], "ratio"))
+    regressions = 0
+    for name in sorted(set(baseline['results']) | set(candidate['results'])):
+        before = baseline['results'].get(name, {}).get('mean_ms')
+        after = candidate['results'].get(name, {}).get('mean_ms')
+        if before is None or after is None:
+            print("{:<32} {:>10} {:>10}".format(
+                name, '-' if before is None else '{:.3f}'.format(before),
+                '-' if after is None else '{:.3f}'.format(after)))
+            continue
+        ratio = after / before
+        flag = ''
+        if ratio > args.threshold:
+            regressions += 1
+            flag = '  slower'
+        print("{:<32} {:>10.3f} {:>10.3f} {:>6.2f}x{}".format(
+            name, before, after, ratio, flag))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
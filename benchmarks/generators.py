@@ -0,0 +1,89 @@
+"""Synthetic rosters for benchmarks.
+
+generate() fills a database with `groups` schedules, each with `members`
+users and `shifts` shifts, and `years` of mutations: on every day, each
+shift is mutated with probability `churn`, sometimes several times
+("empty", "Oskar takes it", "empty again"). Rows are written with bulk
+Core inserts, so even millions of mutations take seconds.
+"""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from rabbot.api.roster import rebuild_roster
+from rabbot.models import (
+    association_table, BASE, Mutation, Schedule, Shift, User)
+
+BATCH = 10000
+START = datetime(2014, 1, 1)
+RECURRENCES = ['daily', 'daily', 'mon,tue,wed,thu,fri', 'sat,sun']
+
+
+def _batched(connection, table, rows) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            connection.execute(insert(table), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(table), batch)
+
+
+def generate(engine, groups: int=10, members: int=20, shifts: int=5,
+             years: float=1, churn: float=0.1, seed: int=1) -> dict:
+    """Fill engine's database; return the sizes that were generated.
+
+    Telegram IDs equal the row IDs: group g has telegram_group_id g, and
+    its members are the users with telegram_user_id (g-1)*members+1 and up.
+    Shift names are 'shift 0', 'shift 1', ... within every group.
+    """
+    rng = random.Random(seed)
+    days = int(365 * years)
+    BASE.metadata.create_all(engine)
+    with engine.begin() as connection:
+        _batched(connection, User.__table__, (
+            {'user_id': i, 'telegram_user_id': i, 'name': 'user {}'.format(i)}
+            for i in range(1, groups * members + 1)))
+        _batched(connection, Schedule.__table__, (
+            {'schedule_id': g, 'telegram_group_id': g,
+             'admin_id': (g - 1) * members + 1}
+            for g in range(1, groups + 1)))
+        _batched(connection, association_table, (
+            {'schedule_id': g, 'user_id': (g - 1) * members + m}
+            for g in range(1, groups + 1) for m in range(1, members + 1)))
+        _batched(connection, Shift.__table__, (
+            {'shift_id': (g - 1) * shifts + s + 1, 'schedule_id': g,
+             'name': 'shift {}'.format(s), 'ordering': s,
+             'recurrence': rng.choice(RECURRENCES)}
+            for g in range(1, groups + 1) for s in range(shifts)))
+
+        def mutations():
+            for day in range(days):
+                shift_date = START + timedelta(days=day)
+                for g in range(1, groups + 1):
+                    first_member = (g - 1) * members + 1
+                    for s in range(shifts):
+                        if rng.random() >= churn:
+                            continue
+                        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                            new_user = rng.choice([None, rng.randrange(
+                                first_member, first_member + members)])
+                            yield {
+                                'schedule_id': g,
+                                'shift_id': (g - 1) * shifts + s + 1,
+                                'shift_date': shift_date,
+                                'mutator_id': rng.randrange(
+                                    first_member, first_member + members),
+                                'new_user_id': new_user}
+        _batched(connection, Mutation.__table__, mutations())
+    with Session(engine) as session:
+        roster = rebuild_roster(session)
+        session.commit()
+        mutation_count = session.scalar(
+            select(func.count()).select_from(Mutation))
+    return {'groups': groups, 'members': members, 'shifts': shifts,
+            'days': days, 'mutations': mutation_count,
+            'roster_entries': roster}
@@ -0,0 +1,47 @@
+"""Statements executed and objects loaded per API call.
+
+    python benchmarks/profile_requests.py [SHIFTS]
+
+Fills an in-memory database with one schedule holding SHIFTS shifts and
+prints, for each API call, how many SQL statements it ran and how many
+ORM objects it loaded from the database.
+"""
+import sys
+
+from rabbot import api
+from rabbot.dummydb import DummyDB, QueryCounter
+from rabbot.models import Schedule, Shift, User
+
+
+def main(shifts: int):
+    with DummyDB() as session:
+        user = User(telegram_user_id=1)
+        schedule = Schedule(telegram_group_id=1, admin=user)
+        session.add_all([user, schedule] + [
+            Shift(schedule=schedule, name='shift {}'.format(i), ordering=i)
+            for i in range(shifts)])
+        session.commit()
+        calls = [
+            ('get_shift_by_id', lambda: api.get_shift_by_id(session, 1)),
+            ('get_schedule_by_id', lambda: api.get_schedule_by_id(session, 1)),
+            ('get_schedule', lambda: api.get_schedule(session, 1)),
+            ('get_user', lambda: api.get_user(session, 1)),
+            ('get_shift_by_name',
+             lambda: api.get_shift_by_name(session, 1, 'shift 1')),
+            ('list_shifts', lambda: api.list_shifts(session, 1)),
+            ('add_shift', lambda: api.add_shift(session, 1, 'new', 0)),
+            ('add_user_to_schedule',
+             lambda: api.add_user_to_schedule(session, 1, 1)),
+        ]
+        print("{:>22} {:>11} {:>7}".format("call", "statements", "loaded"))
+        for name, call in calls:
+            session.expunge_all()
+            with QueryCounter(session) as counter:
+                call()
+            print("{:>22} {:>11} {:>7}".format(
+                name, counter.count, counter.loaded))
+            session.rollback()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
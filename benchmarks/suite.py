@@ -0,0 +1,156 @@
+"""Benchmark suite for the API and data layer.
+
+    python benchmarks/suite.py [--size small|medium|large] [--output FILE]
+
+Generates a synthetic roster (see generators.py) in an in-memory and in a
+file-backed SQLite database and times the API calls a busy bot makes.
+Results are written as JSON, by default to
+benchmarks/results/COMMIT-SIZE.json, so runs on different commits can be
+compared with compare.py.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from sqlalchemy.orm import Session
+
+from rabbot import api
+from rabbot.database import make_engine
+
+import generators
+
+SIZES = {
+    'small': {'groups': 10, 'members': 10, 'shifts': 5, 'years': 1},
+    'medium': {'groups': 200, 'members': 20, 'shifts': 8, 'years': 2},
+    'large': {'groups': 1000, 'members': 30, 'shifts': 10, 'years': 3},
+}
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def benchmarks(size: dict) -> dict:
+    """Name -> function(session, rng) making one API call."""
+    groups, members, shifts = size['groups'], size['members'], size['shifts']
+    days = int(365 * size['years'])
+
+    def group(rng):
+        return rng.randint(1, groups)
+
+    def week(rng):
+        start = generators.START + timedelta(days=rng.randrange(days))
+        return start, start + timedelta(days=7)
+
+    def add_shift(session, rng):
+        api.add_shift(session, group(rng), 'new {}'.format(rng.random()), 0)
+        session.rollback()
+
+    def add_user_to_schedule(session, rng):
+        # A member of the next schedule, so never already a member here.
+        gid = group(rng)
+        user = (gid % groups) * members + rng.randint(1, members)
+        api.add_user_to_schedule(session, user, gid)
+        session.flush()
+        session.rollback()
+
+    return {
+        'list_shifts': lambda session, rng: list(
+            api.list_shifts(session, group(rng)).value),
+        'get_shift_by_name': lambda session, rng: api.get_shift_by_name(
+            session, group(rng), 'shift {}'.format(rng.randrange(shifts))),
+        'add_shift': add_shift,
+        'add_user_to_schedule': add_user_to_schedule,
+        'get_cover': lambda session, rng: api.get_cover(
+            session, rng.randint(1, groups * shifts), week(rng)[0]),
+        'list_covers_week': lambda session, rng: api.list_covers(
+            session, group(rng), *week(rng)),
+        'list_open_shifts_week': lambda session, rng: api.list_open_shifts(
+            session, group(rng), *week(rng)),
+        'iter_shifts_week': lambda session, rng: list(
+            api.iter_shifts(session, group(rng), *week(rng)).value),
+    }
+
+
+def time_calls(engine, call, repeat: int) -> dict:
+    """Run call `repeat` times, each in a fresh session; return timings."""
+    rng = random.Random(0)
+    timings = []
+    for _ in range(repeat):
+        with Session(engine) as session:
+            started = time.perf_counter()
+            call(session, rng)
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'mean_ms': statistics.mean(timings) * 1e3,
+        'p50_ms': timings[len(timings) // 2] * 1e3,
+        'p95_ms': timings[int(len(timings) * 0.95)] * 1e3,
+    }
+
+
+def run(size_name: str, repeat: int) -> dict:
+    size = SIZES[size_name]
+    directory = tempfile.mkdtemp()
+    databases = {
+        'memory': 'sqlite://',
+        'file': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+    }
+    report = {
+        'commit': _commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'size': size_name,
+        'results': {},
+    }
+    for database, url in databases.items():
+        # The in-memory database lives in a single pooled connection.
+        engine = make_engine(url, pool_size=1)
+        started = time.perf_counter()
+        report['generated'] = generators.generate(engine, **size)
+        print("{}: generated {} in {:.1f}s".format(
+            database, report['generated'], time.perf_counter() - started),
+            file=sys.stderr)
+        for name, call in benchmarks(size).items():
+            result = time_calls(engine, call, repeat)
+            report['results']['{}/{}'.format(database, name)] = result
+            print("{:>6} {:<24} {:>8.3f}ms mean {:>8.3f}ms p95".format(
+                database, name, result['mean_ms'], result['p95_ms']),
+                file=sys.stderr)
+        engine.dispose()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+    report = run(args.size, args.repeat)
+    output = args.output or os.path.join(
+        RESULTS, '{}-{}.json'.format(report['commit'], args.size))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as result_file:
+        json.dump(report, result_file, indent=2, sort_keys=True)
+    print("wrote {}".format(output), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
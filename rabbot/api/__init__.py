@@ -1,2 +1,11 @@
 from .core import *
 from .helpers import Result
+from .context import RequestContext
+from .coverage import get_cover, list_covers
+from .roster import (
+    list_open_shifts, list_altered_shifts, list_user_shifts, rebuild_roster)
+from .bulk import add_shifts, edit_shifts
+from .cache import ScheduleCache, ScheduleSnapshot
+from . import loading
+from .archive import compact_mutations, list_mutation_history
+from .events import cover_at, roster_at
@@ -0,0 +1,125 @@
+"""Compact the mutation history of past dates into an archive table.
+
+Every swap back and forth ("empty", "Oskar takes it", "empty again") is a
+mutation row, and only the latest one per shift and date matters for
+coverage. Once a date is past, compact_mutations moves the earlier ones
+to mutations_archive; the latest stays, with the same ID, so the roster
+and coverage queries keep working and have fewer rows to skip.
+
+The job walks the mutations in ID order, in batches of batch_size IDs,
+and commits after every batch, so it never holds a write lock for long
+and can be interrupted and run again at any time:
+
+    python -m rabbot.api.archive DATABASE_URL [DAYS]
+
+list_mutation_history shows the full trail of a shift and date, archived
+or not.
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.orm import Session, aliased
+
+from rabbot.database import make_engine
+from rabbot.models import ArchivedMutation, Mutation, utcnow
+from .core import get_shift_by_id
+from .context import context_for
+from .helpers import Result
+from .instrument import instrumented
+
+ARCHIVED_COLUMNS = ['mutation_id', 'schedule_id', 'shift_date', 'shift_id',
+                    'mutator_id', 'new_user_id']
+
+
+def compact_batch(session, before: datetime, first_id: int,
+                  batch_size: int) -> int:
+    """Archive superseded mutations with IDs in [first_id, +batch_size).
+
+    Only mutations dated before `before` are touched. Returns the number
+    of mutations archived; the caller commits.
+    """
+    later = aliased(Mutation)
+    superseded = session.scalars(
+        select(Mutation.mutation_id).
+        where(Mutation.mutation_id >= first_id).
+        where(Mutation.mutation_id < first_id + batch_size).
+        where(Mutation.shift_date < before).
+        where(select(later.mutation_id).
+              where(later.shift_id == Mutation.shift_id).
+              where(later.shift_date == Mutation.shift_date).
+              where(later.mutation_id > Mutation.mutation_id).
+              exists())).all()
+    if not superseded:
+        return 0
+    session.execute(insert(ArchivedMutation).from_select(
+        ARCHIVED_COLUMNS + ['archived_at'],
+        select(*[getattr(Mutation, column) for column in ARCHIVED_COLUMNS],
+               literal(utcnow())).
+        where(Mutation.mutation_id.in_(superseded))))
+    session.execute(
+        delete(Mutation).where(Mutation.mutation_id.in_(superseded)),
+        execution_options={'synchronize_session': False})
+    return len(superseded)
+
+
+@instrumented
+def compact_mutations(session, before: datetime, batch_size: int=1000,
+                      pause: float=0.0) -> int:
+    """Archive every superseded mutation dated before `before`.
+
+    Commits after each batch and sleeps `pause` seconds in between, to
+    leave room for other writers. Returns the number archived.
+    """
+    session = context_for(session).session
+    first_id = session.scalar(select(func.min(Mutation.mutation_id)))
+    last_id = session.scalar(select(func.max(Mutation.mutation_id)))
+    archived = 0
+    while first_id is not None and first_id <= last_id:
+        archived += compact_batch(session, before, first_id, batch_size)
+        session.commit()
+        first_id += batch_size
+        if pause:
+            time.sleep(pause)
+    session.expire_all()
+    return archived
+
+
+@instrumented
+def list_mutation_history(session, shift_id, shift_date) -> Result:
+    """List every mutation of a shift on a date, oldest first.
+
+    Result.value mixes ArchivedMutations and the Mutations still in use;
+    both have the same columns.
+    """
+    context = context_for(session)
+    shift_result = get_shift_by_id(context, shift_id)
+    if not shift_result.success:
+        return shift_result
+    history = []
+    for model in (ArchivedMutation, Mutation):
+        history.extend(context.session.query(model).filter(
+            model.shift_id == shift_id, model.shift_date == shift_date))
+    history.sort(key=lambda mutation: mutation.mutation_id)
+    return Result(value=history)
+
+
+def main(argv=None):
+    """Compact the database given on the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) not in (1, 2):
+        print("usage: python -m rabbot.api.archive DATABASE_URL [DAYS]")
+        return 2
+    # Dates before today, or DAYS days before that.
+    days = int(argv[1]) if len(argv) == 2 else 0
+    before = datetime.combine(datetime.today(), datetime.min.time()) - \
+        timedelta(days=days)
+    with Session(make_engine(argv[0])) as session:
+        count = compact_mutations(session, before)
+    print("archived {} mutations".format(count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Add and edit many shifts at once.
+
+A batch is validated as a whole, name collisions are checked with one
+query, and all valid items are written in a single flush (two when shifts
+swap names). Items that fail validation are skipped; the others are still
+written. Result.value is a list with one Result per item, in the order of
+the input, and Result.success tells whether every item succeeded.
+"""
+from rabbot.models import Shift
+from rabbot.recurrence import DAILY
+from .helpers import Result, validate_ordering, validate_recurrence
+from .context import context_for
+from .signals import shifts_changed
+from .instrument import instrumented
+from .errors import AlreadyShiftWithNameError, NoShiftWithIdError
+
+
+def _validate(context, item: dict) -> list:
+    """Return the results of validating name, ordering and recurrence."""
+    return [
+        context.shift_name(item.get('name')),
+        validate_ordering(item.get('ordering')),
+        validate_recurrence(item.get('recurrence', DAILY)),
+    ]
+
+
+def _batch_result(results: list, message: str) -> Result:
+    return Result(
+        message=message,
+        success=all(result.success for result in results),
+        value=results)
+
+
+@instrumented
+def add_shifts(session, telegram_group_id, items: list) -> Result:
+    """Add shifts from dicts with name, ordering and optional recurrence."""
+    context = context_for(session)
+    schedule_result = context.schedule(telegram_group_id)
+    if not schedule_result.success:
+        return schedule_result
+    schedule = schedule_result.value
+    validations = [_validate(context, item) for item in items]
+    names = [checks[0].value for checks in validations if checks[0].success]
+    taken = set(name for name, in context.session.query(Shift.name).
+                filter(Shift.schedule_id == schedule.schedule_id).
+                filter(Shift.name.in_(names)))
+    results = []
+    shifts = []
+    for item, checks in zip(items, validations):
+        errors = sum((check.errors for check in checks), ())
+        name = checks[0].value
+        if checks[0].success and name in taken:
+            errors += (AlreadyShiftWithNameError(name),)
+        if errors:
+            results.append(Result(success=False, errors=errors))
+            continue
+        # Later items may not reuse the name of a shift added before them.
+        taken.add(name)
+        shift = Shift(
+            schedule_id=schedule.schedule_id, name=name,
+            ordering=checks[1].value, recurrence=checks[2].value)
+        shifts.append(shift)
+        results.append(Result(message="Shift successfully created",
+                              value=shift))
+    if shifts:
+        context.session.add_all(shifts)
+        context.session.flush()
+        shifts_changed.send_after_commit(
+            context.session, schedule.schedule_id)
+    return _batch_result(results, "Shifts added")
+
+
+def _drop_name_collisions(pending: dict, names: dict) -> dict:
+    """Reject renames until every schedule's names are unique again.
+
+    pending maps item index to (shift, new name); names maps the shift_id
+    of every shift in the affected schedules to its (schedule_id, name).
+    Returns the index and name of each rejected item. A rejected rename
+    keeps the old name, which may in turn collide with an earlier rename,
+    so this repeats until nothing collides.
+    """
+    rejected = {}
+    while True:
+        renamed = {shift.shift_id for shift, _ in pending.values()}
+        owners = {key for shift_id, key in names.items()
+                  if shift_id not in renamed}
+        for index, (shift, name) in sorted(pending.items()):
+            key = (shift.schedule_id, name)
+            if key in owners:
+                rejected[index] = name
+                del pending[index]
+                break
+            owners.add(key)
+        else:
+            return rejected
+
+
+@instrumented
+def edit_shifts(session, items: list) -> Result:
+    """Edit shifts from dicts with shift_id, name, ordering and optional
+    recurrence; a missing recurrence keeps the current rule.
+
+    Names may be swapped within one batch: renames that would collide
+    with another shift's old name go through a temporary name first.
+    """
+    context = context_for(session)
+    shift_ids = [item.get('shift_id') for item in items]
+    shifts = {shift.shift_id: shift for shift in
+              context.session.query(Shift).
+              filter(Shift.shift_id.in_(shift_ids))}
+    results = []
+    pending = {}
+    for index, item in enumerate(items):
+        checks = _validate(context, item)
+        if 'recurrence' not in item:
+            checks[2] = Result()
+        errors = sum((check.errors for check in checks), ())
+        shift = shifts.get(item.get('shift_id'))
+        if shift is None:
+            errors += (NoShiftWithIdError(item.get('shift_id')),)
+        results.append(Result(success=False, errors=errors) if errors else
+                       Result(message="Shift successfully edited",
+                              value=shift))
+        if not errors:
+            pending[index] = (shift, checks[0].value)
+    if not pending:
+        return _batch_result(results, "Shifts edited")
+    schedule_ids = {shift.schedule_id for shift, _ in pending.values()}
+    names = {shift_id: (schedule_id, name)
+             for shift_id, schedule_id, name in context.session.query(
+                 Shift.shift_id, Shift.schedule_id, Shift.name).
+             filter(Shift.schedule_id.in_(schedule_ids))}
+    for index, name in _drop_name_collisions(pending, names).items():
+        results[index] = Result(
+            success=False, errors=(AlreadyShiftWithNameError(name),))
+    if not pending:
+        return _batch_result(results, "Shifts edited")
+    renamed = [shift for shift, name in pending.values() if name != shift.name]
+    old_names = {(shift.schedule_id, shift.name) for shift in renamed}
+    if any((shift.schedule_id, name) in old_names
+           for shift, name in pending.values() if name != shift.name):
+        # Free the old names first; the unique index is checked per row.
+        for shift in renamed:
+            shift.name = '\0{}'.format(shift.shift_id)
+        context.session.flush()
+    for index, (shift, name) in pending.items():
+        shift.name = name
+        shift.ordering = items[index]['ordering']
+        if 'recurrence' in items[index]:
+            shift.recurrence = items[index]['recurrence']
+    context.session.flush()
+    for schedule_id in {shift.schedule_id for shift, _ in pending.values()}:
+        shifts_changed.send_after_commit(context.session, schedule_id)
+    return _batch_result(results, "Shifts edited")
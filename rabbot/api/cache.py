@@ -0,0 +1,196 @@
+"""Read-through cache of schedule snapshots keyed by telegram_group_id.
+
+Nearly every Telegram message resolves its group to a schedule and looks
+at its shifts or members, which rarely change. ScheduleCache keeps
+immutable snapshots of them in a bounded LRU whose entries also expire
+after a time to live. A miss costs one query, which returns a row for
+the schedule, each of its shifts and each member. A hit costs none. Pass a cache to
+RequestContext to have the read-only API functions use it.
+
+Entries are dropped after commit by the shifts_changed, members_changed
+and schedule_deleted signals, so add_shift, edit_shift, delete_shift,
+add_user_to_schedule and delete_schedule are visible on the next lookup.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import literal, null, select, union_all
+
+from rabbot.models import Schedule, Shift, User, association_table
+from .errors import (
+    NoScheduleWithTelegramGroupIdError,
+    MoreThan1ScheduleWithTelegramGroupIdError)
+from .helpers import Result
+from .signals import members_changed, schedule_deleted, shifts_changed
+
+ShiftSnapshot = namedtuple(
+    'ShiftSnapshot', ['shift_id', 'name', 'ordering', 'recurrence'])
+MemberSnapshot = namedtuple(
+    'MemberSnapshot', ['user_id', 'telegram_user_id', 'name'])
+
+
+class ScheduleSnapshot(namedtuple('ScheduleSnapshot', [
+        'schedule_id', 'telegram_group_id', 'admin_id', 'shifts',
+        'members'])):
+
+    """A schedule with its shifts (in order) and members, as tuples."""
+
+    __slots__ = ()
+
+    def shift_by_name(self, name) -> ShiftSnapshot:
+        """Return the shift called name, or None."""
+        for shift in self.shifts:
+            if shift.name == name:
+                return shift
+        return None
+
+    def has_member(self, telegram_user_id) -> bool:
+        """Is the Telegram user a member of the schedule?"""
+        return any(member.telegram_user_id == telegram_user_id
+                   for member in self.members)
+
+
+def _rows(telegram_group_id):
+    """Statement for the rows of a group's schedule, shifts and members.
+
+    Joining both collections would return a row per shift and member
+    pair; a union returns one per shift plus one per member.
+    """
+    in_group = Schedule.telegram_group_id == telegram_group_id
+    schedule = [Schedule.schedule_id, Schedule.telegram_group_id,
+                Schedule.admin_id]
+    return union_all(
+        select(literal('schedule').label('kind'), *schedule,
+               null().label('item_id'), null().label('name'),
+               null().label('ordering'), null().label('recurrence'),
+               null().label('telegram_user_id')).
+        where(in_group),
+        select(literal('shift'), *schedule, Shift.shift_id, Shift.name,
+               Shift.ordering, Shift.recurrence, null()).
+        join(Shift, Shift.schedule_id == Schedule.schedule_id).
+        where(in_group),
+        select(literal('member'), *schedule, User.user_id, User.name,
+               null(), null(), User.telegram_user_id).
+        join(association_table,
+             association_table.c.schedule_id == Schedule.schedule_id).
+        join(User, User.user_id == association_table.c.user_id).
+        where(in_group))
+
+
+def _shift_order(shift: ShiftSnapshot) -> tuple:
+    # As Schedule.shifts: by ordering, NULL first.
+    return (shift.ordering is not None, shift.ordering or 0, shift.shift_id)
+
+
+def snapshot(rows) -> ScheduleSnapshot:
+    """Build a ScheduleSnapshot from the rows of one schedule, see _rows."""
+    rows = list(rows)
+    first = rows[0]
+    return ScheduleSnapshot(
+        first.schedule_id, first.telegram_group_id, first.admin_id,
+        tuple(sorted((ShiftSnapshot(row.item_id, row.name, row.ordering,
+                                    row.recurrence)
+                      for row in rows if row.kind == 'shift'),
+                     key=_shift_order)),
+        tuple(sorted((MemberSnapshot(row.item_id, row.telegram_user_id,
+                                     row.name)
+                      for row in rows if row.kind == 'member'))))
+
+
+class ScheduleCache(object):
+
+    """LRU/TTL cache of ScheduleSnapshots by telegram_group_id."""
+
+    def __init__(self, session_factory, capacity: int=10000,
+                 ttl: float=300, clock=time.monotonic):
+        self._session_factory = session_factory
+        self._capacity = capacity
+        self._ttl = ttl
+        self._clock = clock
+        # telegram_group_id -> (expires, snapshot)
+        self._entries = OrderedDict()
+        # schedule_id -> telegram_group_id, to act on signals.
+        self._groups = {}
+        # Bumped on every invalidation, so a lookup that raced with one
+        # does not store what it read before the change.
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        for signal in (shifts_changed, members_changed, schedule_deleted):
+            signal.connect(self.invalidate)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self) -> None:
+        """Stop listening for changes."""
+        for signal in (shifts_changed, members_changed, schedule_deleted):
+            signal.disconnect(self.invalidate)
+
+    def invalidate(self, schedule_id) -> None:
+        """Forget the snapshot of a schedule."""
+        with self._lock:
+            self._generation += 1
+            telegram_group_id = self._groups.pop(schedule_id, None)
+            self._entries.pop(telegram_group_id, None)
+
+    def clear(self) -> None:
+        """Forget all snapshots."""
+        with self._lock:
+            self._generation += 1
+            self._groups.clear()
+            self._entries.clear()
+
+    def _load(self, telegram_group_id) -> Result:
+        session = self._session_factory()
+        try:
+            rows = session.execute(_rows(telegram_group_id)).all()
+        finally:
+            session.close()
+        schedule_ids = set(row.schedule_id for row in rows)
+        if not schedule_ids:
+            return Result(success=False, errors=(
+                NoScheduleWithTelegramGroupIdError(telegram_group_id),))
+        if len(schedule_ids) > 1:
+            return Result(success=False, errors=(
+                MoreThan1ScheduleWithTelegramGroupIdError(
+                    telegram_group_id),))
+        return Result(value=snapshot(rows))
+
+    def get(self, telegram_group_id) -> Result:
+        """Return a Result with the ScheduleSnapshot of a Telegram group."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(telegram_group_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self._entries.move_to_end(telegram_group_id)
+                return Result(value=entry[1])
+            self.misses += 1
+            generation = self._generation
+        result = self._load(telegram_group_id)
+        if not result.success:
+            # Not cached: the group may get a schedule any moment.
+            return result
+        with self._lock:
+            if generation == self._generation:
+                value = result.value
+                self._entries[telegram_group_id] = (now + self._ttl, value)
+                self._entries.move_to_end(telegram_group_id)
+                self._groups[value.schedule_id] = telegram_group_id
+                while len(self._entries) > self._capacity:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._groups.pop(evicted.schedule_id, None)
+        return result
+
+    def prometheus(self, prefix: str='rabbot_schedule_cache') -> str:
+        """Render the counters in the Prometheus text format."""
+        values = [
+            ('hits_total', self.hits),
+            ('misses_total', self.misses),
+            ('entries', len(self._entries)),
+        ]
+        return ''.join('{}_{} {}\n'.format(prefix, name, value)
+                       for name, value in values)
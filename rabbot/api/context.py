@@ -0,0 +1,110 @@
+"""Request-scoped memo of lookups and validated input.
+
+One Telegram update usually leads to several API calls about the same
+group and user. Every API function accepts either a session or a
+RequestContext wrapping one; passing the same RequestContext to all calls
+made for one update resolves the group's schedule, the user and the
+validated input only once.
+
+A RequestContext may also be given a ScheduleCache. The API functions that
+only read a group's schedule and shifts then take them from the cache;
+see RequestContext.schedule_view.
+"""
+from rabbot.models import Schedule, User
+from .helpers import Result, validate_shift_name
+from .errors import (
+    NoScheduleWithTelegramGroupIdError,
+    MoreThan1ScheduleWithTelegramGroupIdError,
+    NoUserWithTelegramUserIdError,
+    MoreThan1UserWithTelegramUserIdError)
+from . import lookups
+
+
+class RequestContext(object):
+    """Session plus memoized lookups for the duration of one update."""
+
+    def __init__(self, session, cache=None):
+        self.session = session
+        self.cache = cache
+        self._schedules = {}
+        self._users = {}
+        self._shift_names = {}
+
+    def schedule(self, telegram_group_id) -> Result:
+        """Fetch schedule by telegram group ID, once per context.
+
+        Only found schedules are memoized: a group without one may get
+        one later in the same update, see add_schedule.
+        """
+        try:
+            return self._schedules[telegram_group_id]
+        except KeyError:
+            pass
+        query = self.session.query(Schedule).filter_by(
+            telegram_group_id=telegram_group_id)
+        result = lookups.only_one(
+            query, telegram_group_id,
+            NoScheduleWithTelegramGroupIdError,
+            MoreThan1ScheduleWithTelegramGroupIdError)
+        if result.success:
+            self._schedules[telegram_group_id] = result
+        return result
+
+    def schedule_view(self, telegram_group_id) -> Result:
+        """Fetch schedule by telegram group ID, for reading only.
+
+        With a cache, and unless this context already loaded the
+        schedule, Result.value is a ScheduleSnapshot: it has the
+        schedule_id and shifts of a Schedule, as of the last commit.
+        Otherwise it is the Schedule from schedule().
+        """
+        if self.cache is None or telegram_group_id in self._schedules:
+            return self.schedule(telegram_group_id)
+        return self.cache.get(telegram_group_id)
+
+    def user(self, telegram_user_id) -> Result:
+        """Fetch user by telegram user ID, once per context.
+
+        Only found users are memoized, as in schedule().
+        """
+        try:
+            return self._users[telegram_user_id]
+        except KeyError:
+            pass
+        query = self.session.query(User).filter_by(
+            telegram_user_id=telegram_user_id)
+        result = lookups.only_one(
+            query, telegram_user_id,
+            NoUserWithTelegramUserIdError,
+            MoreThan1UserWithTelegramUserIdError)
+        if result.success:
+            self._users[telegram_user_id] = result
+        return result
+
+    def shift_name(self, us_name) -> Result:
+        """Validate a shift name, once per context."""
+        try:
+            return self._shift_names[us_name]
+        except KeyError:
+            result = self._shift_names[us_name] = validate_shift_name(us_name)
+            return result
+        except TypeError:
+            # Unhashable input is never a valid name; don't memoize it.
+            return validate_shift_name(us_name)
+
+    def remember_schedule(self, schedule) -> None:
+        """Memoize a schedule, e.g. after creating it."""
+        self._schedules[schedule.telegram_group_id] = Result(value=schedule)
+
+    def forget_schedule(self, schedule) -> None:
+        """Drop a schedule from the memo, e.g. after deleting it."""
+        for key, result in list(self._schedules.items()):
+            if result.value is schedule:
+                del self._schedules[key]
+
+
+def context_for(session_or_context) -> RequestContext:
+    """Return the given RequestContext, or a fresh one for a session."""
+    if isinstance(session_or_context, RequestContext):
+        return session_or_context
+    return RequestContext(session_or_context)
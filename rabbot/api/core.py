@@ -1,53 +1,71 @@
-"""API for interacting with database."""
-from rabbot.models import Schedule, Shift, User
-from .helpers import Result, validate_ordering, validate_shift_name
+"""API for interacting with database.
+
+Every function takes either a session or a RequestContext as its first
+argument; see rabbot.api.context.
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, func
+
+from rabbot.models import (
+    association_table, ArchivedMutation, Schedule, Shift, Mutation,
+    MutationEvent, RosterEntry, RosterSnapshot)
+from rabbot.recurrence import DAILY, occurrences, with_mutations
+from .helpers import (
+    Result, validate_ordering, validate_recurrence, validate_date_range)
+from .context import context_for
+from .roster import record_mutation
+from .events import record_event
+from . import loading, lookups
+from .signals import (
+    members_changed, schedule_deleted, shift_mutated, shifts_changed,
+    ShiftEvent)
+from .instrument import instrumented
 from .errors import *
 
 
+def _bulk_delete(session, model, criterion) -> None:
+    """Delete matching rows with one statement, without loading them.
+
+    Matching objects that are already in the session are marked deleted.
+    """
+    session.execute(
+        delete(model).where(criterion).
+        execution_options(synchronize_session='evaluate'))
+
+
+@instrumented
 def get_shift_by_id(session, shift_id: int) -> Result:
     """Fetch shift by id."""
-    result = Result()
-    query = session.query(Shift).filter_by(shift_id=shift_id).all()
-    if len(query) == 0:
-        result.success = False
-        result.errors.append(NoShiftWithIdError(shift_id))
-    elif len(query) == 1:
-        result.value = query[0]
-    else:
-        result.success = False
-        result.errors.append(MoreThan1ShiftWithIdError(shift_id))
-    return result
+    return lookups.by_primary_key(
+        context_for(session).session, Shift, shift_id, NoShiftWithIdError)
 
 
+@instrumented
 def get_shift_by_name(session, telegram_group_id, us_shift_name: str) -> Result:
     """Fetch shift by name."""
-    schedule_result = get_schedule(session, telegram_group_id)
-    shift_name_result = validate_shift_name(us_shift_name)
+    context = context_for(session)
+    schedule_result = context.schedule_view(telegram_group_id)
+    shift_name_result = context.shift_name(us_shift_name)
     if not all((shift_name_result.success, schedule_result.success)):
         return Result(
             success=False,
             errors=shift_name_result.errors + schedule_result.errors)
-    shifts = session.query(Shift).\
+    query = context.session.query(Shift).\
         filter_by(name=shift_name_result.value).\
-        filter_by(schedule_id=schedule_result.value.schedule_id).all()
-    if len(shifts) == 0:
-        return Result(
-            success=False,
-            errors=[NoShiftWithNameError(shift_name_result.value)])
-    elif len(shifts) == 1:
-        return Result(
-            success=True,
-            value=shifts[0])
-    else:
-        # More than 1 result
-        return Result(
-            success=False,
-            errors=[MoreThan1ShiftWithNameError(shift_name_result.value)])
+        filter_by(schedule_id=schedule_result.value.schedule_id)
+    return lookups.only_one(
+        query, shift_name_result.value,
+        NoShiftWithNameError, MoreThan1ShiftWithNameError)
 
 
+@instrumented
 def list_shifts(session, telegram_group_id) -> Result:
-    """List all shifts belonging to the telegram group."""
-    schedule_result = get_schedule(session, telegram_group_id)
+    """List all shifts belonging to the telegram group.
+
+    With a ScheduleCache in the context, they are ShiftSnapshots.
+    """
+    schedule_result = context_for(session).schedule_view(telegram_group_id)
     result = Result()
     if schedule_result.success:
         # pylint: disable=no-member
@@ -59,7 +77,41 @@ def list_shifts(session, telegram_group_id) -> Result:
     return result
 
 
-def add_shift(session, telegram_group_id, us_name: str, us_ordering: int) -> Result:
+@instrumented
+def iter_shifts(session, telegram_group_id, start, end) -> Result:
+    """Stream the shift occurrences of the telegram group in [start, end).
+
+    Result.value is a generator of (day, shift, mutation) tuples, ordered by
+    day and shift ordering; mutation is the latest mutation of the shift on
+    that day, or None. Occurrences and mutations are produced as the
+    generator is consumed, so a window of any width uses constant memory.
+    With a ScheduleCache in the context, shift is a ShiftSnapshot.
+    """
+    context = context_for(session)
+    range_result = validate_date_range(start, end)
+    schedule_result = context.schedule_view(telegram_group_id)
+    if not (range_result.success and schedule_result.success):
+        return Result(
+            success=False,
+            errors=range_result.errors + schedule_result.errors)
+    schedule = schedule_result.value
+    mutations = context.session.query(Mutation).\
+        join(Mutation.shift).\
+        filter(Mutation.schedule_id == schedule.schedule_id).\
+        filter(Mutation.shift_date >= start).\
+        filter(Mutation.shift_date < end).\
+        order_by(
+            Mutation.shift_date, func.coalesce(Shift.ordering, 0),
+            Shift.shift_id, Mutation.mutation_id).\
+        options(*loading.options(Mutation)).\
+        yield_per(500)
+    return Result(value=with_mutations(
+        occurrences(schedule.shifts, start, end), mutations))
+
+
+@instrumented
+def add_shift(session, telegram_group_id, us_name: str, us_ordering: int,
+              us_recurrence: str=DAILY) -> Result:
     """Add a new shift to the session."""
     # scenarios
     # - name already exists for this group_id
@@ -73,13 +125,16 @@ def add_shift(session, telegram_group_id, us_name: str, us_ordering: int) -> Res
     # - everything is fine and dandy
     #   -> return added shift
 
+    context = context_for(session)
     ordering_result = validate_ordering(us_ordering)
-    shift_name_result = validate_shift_name(us_name)
-    schedule_result = get_schedule(session, telegram_group_id)
-    shift_exists_result = get_shift_by_name(session, telegram_group_id, us_name)
+    recurrence_result = validate_recurrence(us_recurrence)
+    shift_name_result = context.shift_name(us_name)
+    schedule_result = context.schedule(telegram_group_id)
+    shift_exists_result = get_shift_by_name(context, telegram_group_id, us_name)
     result = Result(message="Shift successfully created")
     result.success = all([
         ordering_result.success,
+        recurrence_result.success,
         shift_name_result.success,
         schedule_result.success,
         not shift_exists_result.success])
@@ -87,131 +142,209 @@ def add_shift(session, telegram_group_id, us_name: str, us_ordering: int) -> Res
         shift = Shift(
             schedule=schedule_result.value,
             name=shift_name_result.value,
-            ordering=ordering_result.value)
-        session.add(shift)
-        session.flush()
+            ordering=ordering_result.value,
+            recurrence=recurrence_result.value)
+        context.session.add(shift)
+        context.session.flush()
+        shifts_changed.send_after_commit(context.session, shift.schedule_id)
         result.value = shift
     else:
         result.errors = (
-            ordering_result.errors + shift_name_result.errors + schedule_result.errors)
+            ordering_result.errors + recurrence_result.errors +
+            shift_name_result.errors + schedule_result.errors)
         if shift_exists_result.success:
-            result.errors.append(
-                "There is already a shift with the name {} in this group".format(
-                    shift_name_result.value))
+            result.errors += (
+                AlreadyShiftWithNameError(shift_name_result.value),)
     return result
 
 
+@instrumented
 def delete_shift(session, shift_id) -> Result:
     """Delete shift."""
-    shift_result = get_shift_by_id(session, shift_id)
+    context = context_for(session)
+    shift_result = get_shift_by_id(context, shift_id)
     result = Result(message="Shift deleted")
     if shift_result.success:
-        session.delete(shift_result.value)
-        session.flush()
+        shift = shift_result.value
+        for model in (RosterEntry, ArchivedMutation, Mutation, Shift):
+            _bulk_delete(context.session, model,
+                         model.shift_id == shift.shift_id)
+        shifts_changed.send_after_commit(context.session, shift.schedule_id)
     else:
         result.success = False
         result.errors = shift_result.errors
     return result
 
 
-def edit_shift(session, shift_id, us_name, us_ordering) -> Result:
-    """Edit existing shift."""
-    name_result = validate_shift_name(us_name)
+@instrumented
+def edit_shift(session, shift_id, us_name, us_ordering,
+               us_recurrence: str=None) -> Result:
+    """Edit existing shift; us_recurrence None keeps the current rule."""
+    context = context_for(session)
+    name_result = context.shift_name(us_name)
     ordering_result = validate_ordering(us_ordering)
-    shift_result = get_shift_by_id(session, shift_id)
+    recurrence_result = Result()
+    if us_recurrence is not None:
+        recurrence_result = validate_recurrence(us_recurrence)
+    shift_result = get_shift_by_id(context, shift_id)
+    name_taken = False
+    if name_result.success and shift_result.success:
+        # The unique index on (schedule_id, name) would raise on flush.
+        name_taken = context.session.query(Shift.shift_id).\
+            filter(Shift.schedule_id == shift_result.value.schedule_id).\
+            filter(Shift.name == name_result.value).\
+            filter(Shift.shift_id != shift_result.value.shift_id).\
+            first() is not None
     result = Result(message="Shift successfully edited")
-    result.success = all([name_result.success, ordering_result.success, shift_result.success])
+    result.success = all([
+        name_result.success, ordering_result.success,
+        recurrence_result.success, shift_result.success, not name_taken])
     if result.success:
         shift_result.value.name = us_name
         shift_result.value.ordering = us_ordering
+        if us_recurrence is not None:
+            shift_result.value.recurrence = us_recurrence
+        shifts_changed.send_after_commit(
+            context.session, shift_result.value.schedule_id)
         result.value = shift_result.value
     else:
-        result.errors = name_result.errors + ordering_result.errors + shift_result.errors
+        result.errors = (
+            name_result.errors + ordering_result.errors +
+            recurrence_result.errors + shift_result.errors)
+        if name_taken:
+            result.errors += (AlreadyShiftWithNameError(name_result.value),)
     return result
 
 
+@instrumented
 def get_user(session, telegram_user_id) -> Result:
     """Fetch user by telegram user id."""
-    users = session.query(User).filter_by(
-        telegram_user_id=telegram_user_id).all()
-    if len(users) == 0:
-        return Result(success=False, errors=[
-            NoUserWithTelegramUserIdError(telegram_user_id)])
-    elif len(users) == 1:
-        return Result(value=users[0])
-    else:
-        return Result(success=False, errors=[
-            MoreThan1UserWithTelegramUserIdError(telegram_user_id)])
+    return context_for(session).user(telegram_user_id)
 
 
+@instrumented
 def get_schedule_by_id(session, schedule_id) -> Result:
     """Fetch schedule by id."""
-    result = Result()
-    schedules = session.query(Schedule).filter_by(
-        schedule_id=schedule_id).all()
-    if len(schedules) == 0:
-        result.success = False
-        result.errors.append(NoScheduleWithIdError(schedule_id))
-    elif len(schedules) == 1:
-        result.value = schedules[0]
-    else:
-        result.success = False
-        result.errors.append(MoreThan1ScheduleWithIdError(schedule_id))
-    return result
+    return lookups.by_primary_key(
+        context_for(session).session, Schedule, schedule_id,
+        NoScheduleWithIdError)
 
 
+@instrumented
 def get_schedule(session, telegram_group_id) -> Result:
     """Fetch schedule by telegram group ID."""
-    result = Result()
-    schedules = session.query(Schedule).filter_by(
-        telegram_group_id=telegram_group_id).all()
-    if len(schedules) == 0:
-        result.success = False
-        result.errors.append(NoScheduleWithTelegramGroupIdError(telegram_group_id))
-    elif len(schedules) == 1:
-        result.value = schedules[0]
-    else:
-        result.success = False
-        result.errors.append(
-            MoreThan1ScheduleWithTelegramGroupIdError(telegram_group_id))
-    return result
+    return context_for(session).schedule(telegram_group_id)
 
 
+@instrumented
 def add_schedule(session, telegram_group_id, telegram_admin_id) -> Result:
     """Create schedule."""
-    admin_result = get_user(session, telegram_admin_id)
+    context = context_for(session)
+    admin_result = context.user(telegram_admin_id)
+    if context.schedule(telegram_group_id).success:
+        return Result(
+            success=False,
+            errors=admin_result.errors + (
+                AlreadyScheduleForTelegramGroupIdError(telegram_group_id),))
     if admin_result.success:
         schedule = Schedule(
             telegram_group_id=telegram_group_id,
             admin_id=admin_result.value.user_id)
-        session.add(schedule)
-        session.flush()
+        context.session.add(schedule)
+        context.session.flush()
+        context.remember_schedule(schedule)
         return Result(value=schedule)
     return Result(success=False, errors=admin_result.errors)
 
 
+@instrumented
 def delete_schedule(session, schedule_id) -> Result:
     """Delete schedule."""
-    schedule_result = get_schedule_by_id(session, schedule_id)
+    context = context_for(session)
+    schedule_result = get_schedule_by_id(context, schedule_id)
     result = Result(message="Schedule deleted")
     if schedule_result.success:
-        session.delete(schedule_result.value)
-        # TODO: delete shifts and mutations belonging to schedule
-        session.flush()
+        schedule = schedule_result.value
+        context.session.execute(delete(association_table).where(
+            association_table.c.schedule_id == schedule.schedule_id))
+        for model in (RosterEntry, ArchivedMutation, MutationEvent,
+                      RosterSnapshot, Mutation, Shift, Schedule):
+            _bulk_delete(context.session, model,
+                         model.schedule_id == schedule.schedule_id)
+        # Membership lists of loaded users still mention the schedule.
+        for user in schedule.__dict__.get('users', []):
+            context.session.expire(user, ['schedules'])
+        shifts_changed.send_after_commit(
+            context.session, schedule.schedule_id)
+        schedule_deleted.send_after_commit(
+            context.session, schedule.schedule_id)
+        context.forget_schedule(schedule)
     else:
         result.success = False
         result.errors = schedule_result.errors
     return result
 
 
+@instrumented
 def add_user_to_schedule(session, telegram_user_id, telegram_group_id) -> Result:
     """Add user to schedule."""
-    user_result = get_user(session, telegram_user_id)
-    schedule_result = get_schedule(session, telegram_group_id)
+    context = context_for(session)
+    user_result = context.user(telegram_user_id)
+    schedule_result = context.schedule(telegram_group_id)
     if user_result.success and schedule_result.success:
         schedule_result.value.users.append(user_result.value)
+        members_changed.send_after_commit(
+            context.session, schedule_result.value.schedule_id)
         return Result(message="User added to schedule.")
     else:
         return Result(
             success=False,
             errors=user_result.errors + schedule_result.errors)
+
+
+@instrumented
+def add_mutation(session, telegram_group_id, telegram_user_id, shift_id,
+                 shift_date, new_telegram_user_id=None) -> Result:
+    """Record that a shift on a date is now covered by someone else.
+
+    new_telegram_user_id None means the shift is opened: nobody covers it.
+    Only the day of shift_date counts; it is stored as midnight, like the
+    days of rabbot.recurrence. The roster is updated in the same
+    transaction.
+    """
+    context = context_for(session)
+    schedule_result = context.schedule(telegram_group_id)
+    mutator_result = context.user(telegram_user_id)
+    shift_result = get_shift_by_id(context, shift_id)
+    new_user_result = Result()
+    if new_telegram_user_id is not None:
+        new_user_result = context.user(new_telegram_user_id)
+    errors = (schedule_result.errors + mutator_result.errors +
+              shift_result.errors + new_user_result.errors)
+    if not isinstance(shift_date, datetime):
+        errors += (ShiftDateIsNotADatetimeError(shift_date),)
+    if (schedule_result.success and shift_result.success and
+            shift_result.value.schedule_id !=
+            schedule_result.value.schedule_id):
+        errors += (ShiftNotInScheduleError(shift_id),)
+    if errors:
+        return Result(success=False, errors=errors)
+    # Occurrences and lookups match on the midnight of the day.
+    shift_date = shift_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    mutation = Mutation(
+        schedule=schedule_result.value,
+        shift=shift_result.value,
+        shift_date=shift_date,
+        mutator=mutator_result.value,
+        new_user=new_user_result.value)
+    context.session.add(mutation)
+    context.session.flush()
+    record_mutation(context.session, mutation)
+    event = record_event(context.session, mutation)
+    new_user = new_user_result.value
+    shift_mutated.send_after_commit(context.session, ShiftEvent(
+        'opened' if new_user is None else 'covered',
+        telegram_group_id, shift_id, shift_result.value.name, shift_date,
+        telegram_user_id, None if new_user is None else new_telegram_user_id,
+        event.sequence, event.recorded_at))
+    return Result(message="Mutation added", value=mutation)
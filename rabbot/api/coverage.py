@@ -0,0 +1,71 @@
+"""Who covers a shift once mutations are applied.
+
+The effective cover of a shift on a date is the `new_user` of the latest
+Mutation for that (shift_id, shift_date); mutation IDs only ever grow, so
+the latest mutation is the one with the highest ID. If a shift has no
+mutation on a date, the regular schedule applies.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from rabbot.models import Mutation
+from .helpers import Result, validate_date_range
+from .context import context_for
+from .core import get_shift_by_id
+from .errors import ShiftDateIsNotADatetimeError
+from .instrument import instrumented
+from . import loading
+
+
+@instrumented
+def get_cover(session, shift_id: int, shift_date) -> Result:
+    """Fetch the latest mutation of a shift on a date.
+
+    Result.value is the Mutation whose new_user covers the shift (None
+    when the shift was opened), or None when the shift was never mutated
+    on that date. Only the day of shift_date counts, as in add_mutation.
+    """
+    context = context_for(session)
+    shift_result = get_shift_by_id(context, shift_id)
+    errors = shift_result.errors
+    if not isinstance(shift_date, datetime):
+        errors += (ShiftDateIsNotADatetimeError(shift_date),)
+    if errors:
+        return Result(success=False, errors=errors)
+    # Mutations are stored at the midnight of their day.
+    shift_date = shift_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    mutation = context.session.query(Mutation).\
+        filter_by(shift_id=shift_id, shift_date=shift_date).\
+        order_by(Mutation.mutation_id.desc()).\
+        options(*loading.options(Mutation)).\
+        first()
+    return Result(value=mutation)
+
+
+@instrumented
+def list_covers(session, telegram_group_id, start, end) -> Result:
+    """Fetch the latest mutation per shift and date in [start, end).
+
+    Result.value maps (shift_id, shift_date) to the latest Mutation.
+    Pairs without mutations are left out: the regular schedule applies.
+    """
+    context = context_for(session)
+    range_result = validate_date_range(start, end)
+    schedule_result = context.schedule_view(telegram_group_id)
+    if not (range_result.success and schedule_result.success):
+        return Result(
+            success=False,
+            errors=range_result.errors + schedule_result.errors)
+    latest = select(func.max(Mutation.mutation_id).label('mutation_id')).\
+        where(Mutation.schedule_id == schedule_result.value.schedule_id).\
+        where(Mutation.shift_date >= start).\
+        where(Mutation.shift_date < end).\
+        group_by(Mutation.shift_id, Mutation.shift_date).\
+        subquery()
+    mutations = context.session.query(Mutation).\
+        join(latest, Mutation.mutation_id == latest.c.mutation_id).\
+        options(*loading.options(Mutation))
+    return Result(value={
+        (mutation.shift_id, mutation.shift_date): mutation
+        for mutation in mutations})
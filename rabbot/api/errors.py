@@ -2,9 +2,16 @@ from typing import Any
 
 
 # This class does not inherit from Exception because these errors are
-# not raised, but returned as part of Result's error list.
+# not raised, but returned as part of Result's error list. Most callers
+# only look at Result.success, so the message is formatted on first use.
 class APIError():
 
+    __slots__ = ('_args', '_message')
+
+    def __init__(self, *args) -> None:
+        self._args = args
+        self._message = None
+
     @property
     def code(self):
         raise NotImplementedError
@@ -13,6 +20,12 @@ class APIError():
     def message_template(self):
         raise NotImplementedError
 
+    @property
+    def message(self) -> str:
+        if self._message is None:
+            self._message = self.message_template.format(*self._args)
+        return self._message
+
     def __str__(self):
         return self.message
 
@@ -21,98 +34,152 @@ class APIError():
 
 
 class ShiftOrderingIsNotAnIntError(APIError):
+    __slots__ = ()
     code = 'shift-ordering-is-not-an-int'
-    message_template = "Ordering should be an integer and not {}"
+    message_template = "Ordering should be an integer and not {!r}"
     def __init__(self, ordering: Any) -> None:
-        self.message = self.message_template.format(repr(ordering))
+        super().__init__(ordering)
 
 
 class ShiftNameIsNotAStringError(APIError):
+    __slots__ = ()
     code = 'shift-name-is-not-a-string'
     message_template = "Shift name must be a string"
-    def __init__(self) -> None:
-        self.message = self.message_template
 
 
 class ShiftNameIsEmptyError(APIError):
+    __slots__ = ()
     code = 'shift-name-is-empty'
     message_template = "Shift name may not be empty"
-    def __init__(self) -> None:
-        self.message = self.message_template
 
 
 class NoShiftWithIdError(APIError):
+    __slots__ = ()
     code = 'no-shift-with-id'
     message_template = "No shifts with ID {}"
     def __init__(self, shift_id: int) -> None:
-        self.message = self.message_template.format(id)
+        super().__init__(shift_id)
 
 
 class MoreThan1ShiftWithIdError(APIError):
+    __slots__ = ()
     code = 'more-than-1-shift-with-id'
     message_template = "More than 1 shift with ID {}"
     def __init__(self, shift_id: int) -> None:
-        self.message = self.message_template.format(shift_id)
+        super().__init__(shift_id)
 
 
 class NoShiftWithNameError(APIError):
+    __slots__ = ()
     code = 'no-shift-with-name'
-    message_template = "No shifts named {} in this group"
+    message_template = "No shifts named {!r} in this group"
     def __init__(self, shift_name: str) -> None:
-        self.message = self.message_template.format(repr(shift_name))
+        super().__init__(shift_name)
 
 
 class MoreThan1ShiftWithNameError(APIError):
+    __slots__ = ()
     code = 'more-than-1-shift-with-name'
-    message_template = "More than 1 shift named {} in group"
+    message_template = "More than 1 shift named {!r} in group"
     def __init__(self, shift_name: str) -> None:
-        self.message = self.message_template.format(repr(shift_name))
+        super().__init__(shift_name)
 
 
 class AlreadyShiftWithNameError(APIError):
+    __slots__ = ()
     code = 'already-shift-with-name'
-    message_template = "There is already a shift named {} in this group"
+    message_template = "There is already a shift named {!r} in this group"
     def __init__(self, shift_name: str) -> None:
-        self.message = self.message_template.format(repr(shift_name))
+        super().__init__(shift_name)
 
 
 class NoUserWithTelegramUserIdError(APIError):
+    __slots__ = ()
     code = 'no-users-with-telegram-user-id'
     message_template = "No users with telegram user ID {}"
     def __init__(self, telegram_user_id: int) -> None:
-        self.message = self.message_template.format(telegram_user_id)
+        super().__init__(telegram_user_id)
 
 
 class MoreThan1UserWithTelegramUserIdError(APIError):
+    __slots__ = ()
     code = 'more-than-1-user-with-telegram-user-id'
     message_template = "More than 1 user with telegram user ID {}"
     def __init__(self, telegram_user_id: int) -> None:
-        self.message = self.message_template.format(telegram_user_id)
+        super().__init__(telegram_user_id)
 
 
 class NoScheduleWithIdError(APIError):
+    __slots__ = ()
     code = 'no-schedule-with-id'
     message_template = "No schedule with ID {}"
     def __init__(self, schedule_id: int) -> None:
-        self.message = self.message_template.format(schedule_id)
+        super().__init__(schedule_id)
 
 
 class MoreThan1ScheduleWithIdError(APIError):
+    __slots__ = ()
     code = 'more-than-1-schedule-with-id'
     message_template = "More than one schedule with ID {}"
     def __init__(self, schedule_id: int) -> None:
-        self.message = self.message_template.format(schedule_id)
+        super().__init__(schedule_id)
 
 
 class NoScheduleWithTelegramGroupIdError(APIError):
+    __slots__ = ()
     code = 'no-schedule-with-telegram-group-id'
     message_template = "No schedule for Telegram group ID {}"
     def __init__(self, telegram_group_id: int) -> None:
-        self.message = self.message_template.format(telegram_group_id)
+        super().__init__(telegram_group_id)
 
 
-class MoreThan1ScheduleWithTelegramGroupId(APIError):
+class MoreThan1ScheduleWithTelegramGroupIdError(APIError):
+    __slots__ = ()
     code = 'more-than-1-schedule-with-telegram-group-id'
     message_template = "More than one schedule for Telegram group ID {}"
     def __init__(self, telegram_group_id: int) -> None:
-        self.message = self.message_template.format(telegram_group_id)
+        super().__init__(telegram_group_id)
+
+
+class AlreadyScheduleForTelegramGroupIdError(APIError):
+    __slots__ = ()
+    code = 'already-schedule-for-telegram-group-id'
+    message_template = "There is already a schedule for Telegram group ID {}"
+    def __init__(self, telegram_group_id: int) -> None:
+        super().__init__(telegram_group_id)
+
+
+class ShiftDateIsNotADatetimeError(APIError):
+    __slots__ = ()
+    code = 'shift-date-is-not-a-datetime'
+    message_template = "Shift date should be a datetime and not {!r}"
+    def __init__(self, shift_date: Any) -> None:
+        super().__init__(shift_date)
+
+
+class ShiftNotInScheduleError(APIError):
+    __slots__ = ()
+    code = 'shift-not-in-schedule'
+    message_template = "Shift {} does not belong to this group"
+    def __init__(self, shift_id: int) -> None:
+        super().__init__(shift_id)
+
+
+class DateRangeIsNotDatetimesError(APIError):
+    __slots__ = ()
+    code = 'date-range-is-not-datetimes'
+    message_template = "Start and end must be datetimes"
+
+
+class DateRangeEndsBeforeStartError(APIError):
+    __slots__ = ()
+    code = 'date-range-ends-before-start'
+    message_template = "End may not be before start"
+
+
+class InvalidRecurrenceError(APIError):
+    __slots__ = ()
+    code = 'invalid-recurrence'
+    message_template = "{}"
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
@@ -0,0 +1,252 @@
+"""Append-only log of mutation events, with periodic roster snapshots.
+
+add_mutation appends a MutationEvent for every mutation, numbered by a
+sequence that only ever grows and stamped with the time it was recorded.
+Mutation rows may later be compacted (see rabbot.api.archive); the log
+is never changed.
+
+Every SNAPSHOT_INTERVAL events of a schedule, the state of its roster is
+stored as a RosterSnapshot: the cover of every mutated shift and date,
+and the event that decided it. The roster as it was at any moment is the
+last snapshot before that moment plus the events recorded after it, at
+most SNAPSHOT_INTERVAL of them, so "who covered shift X last March"
+never scans the whole history.
+
+For databases that had mutations before the log existed:
+
+    python -m rabbot.api.events DATABASE_URL [RECORDED_AT]
+
+The database does not know when those mutations were made, so their
+events all get one timestamp: the time of the backfill, or RECORDED_AT
+(e.g. 2000-01-01). With the default, roster_at knows nothing about them
+for moments before the backfill. With an early RECORDED_AT, it answers
+with their final state for any moment after it.
+
+Events are replayed in sequence order, so a schedule is only backfilled
+if its new events come after the ones it has: none of its logged
+mutations may be newer than the oldest unlogged one, nor recorded after
+RECORDED_AT. Other schedules are skipped with a warning.
+"""
+import heapq
+import json
+import logging
+import sys
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from rabbot.database import make_engine
+from rabbot.models import (
+    ArchivedMutation, Mutation, MutationEvent, RosterSnapshot, utcnow)
+from .context import context_for
+from .helpers import Result, validate_date_range
+from .instrument import instrumented
+
+LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = 500
+
+# Source of recorded_at and taken_at, in UTC; replaceable in tests.
+clock = utcnow  # pylint: disable=invalid-name
+
+
+def _encode(state: dict) -> str:
+    return json.dumps([
+        [shift_id, shift_date.isoformat(), new_user_id, sequence]
+        for (shift_id, shift_date), (new_user_id, sequence)
+        in sorted(state.items())])
+
+
+def _decode(data: str) -> dict:
+    return {
+        (shift_id, datetime.fromisoformat(shift_date)): (new_user_id, sequence)
+        for shift_id, shift_date, new_user_id, sequence in json.loads(data)}
+
+
+def _apply(state: dict, events) -> dict:
+    for event in events:
+        state[(event.shift_id, event.shift_date)] = (
+            event.new_user_id, event.sequence)
+    return state
+
+
+def record_event(session, mutation: Mutation,
+                 recorded_at: datetime=None) -> MutationEvent:
+    """Append the event of a new mutation; snapshot when one is due.
+
+    The snapshot is stamped like the event, as the roster at that time.
+    """
+    event = MutationEvent(
+        schedule_id=mutation.schedule_id,
+        shift_id=mutation.shift_id,
+        shift_date=mutation.shift_date,
+        mutation_id=mutation.mutation_id,
+        mutator_id=mutation.mutator_id,
+        new_user_id=mutation.new_user_id,
+        recorded_at=recorded_at or clock())
+    session.add(event)
+    session.flush()
+    if _events_since_snapshot(session, mutation.schedule_id) >= \
+            SNAPSHOT_INTERVAL:
+        take_snapshot(session, mutation.schedule_id, event.recorded_at)
+    return event
+
+
+def _last_snapshot(session, schedule_id, moment: datetime=None):
+    query = session.query(RosterSnapshot).\
+        filter(RosterSnapshot.schedule_id == schedule_id)
+    if moment is not None:
+        query = query.filter(RosterSnapshot.taken_at <= moment)
+    return query.order_by(RosterSnapshot.sequence.desc()).first()
+
+
+def _events_since_snapshot(session, schedule_id) -> int:
+    last = select(func.coalesce(func.max(RosterSnapshot.sequence), 0)).\
+        where(RosterSnapshot.schedule_id == schedule_id).scalar_subquery()
+    return session.scalar(
+        select(func.count()).select_from(MutationEvent).
+        where(MutationEvent.schedule_id == schedule_id).
+        where(MutationEvent.sequence > last))
+
+
+def take_snapshot(session, schedule_id,
+                  taken_at: datetime=None) -> RosterSnapshot:
+    """Store the schedule's roster as of its latest event.
+
+    Starts from the previous snapshot, so only the events since are read.
+    """
+    previous = _last_snapshot(session, schedule_id)
+    state, after = ({}, 0) if previous is None else \
+        (_decode(previous.data), previous.sequence)
+    events = session.query(MutationEvent).\
+        filter(MutationEvent.schedule_id == schedule_id).\
+        filter(MutationEvent.sequence > after).\
+        order_by(MutationEvent.sequence).all()
+    snapshot = RosterSnapshot(
+        schedule_id=schedule_id,
+        sequence=events[-1].sequence if events else after,
+        taken_at=taken_at or clock(),
+        data=_encode(_apply(state, events)))
+    session.add(snapshot)
+    session.flush()
+    return snapshot
+
+
+def _state_at(session, schedule_id, moment: datetime) -> dict:
+    snapshot = _last_snapshot(session, schedule_id, moment)
+    state, after = ({}, 0) if snapshot is None else \
+        (_decode(snapshot.data), snapshot.sequence)
+    events = session.query(MutationEvent).\
+        filter(MutationEvent.schedule_id == schedule_id).\
+        filter(MutationEvent.sequence > after).\
+        filter(MutationEvent.recorded_at <= moment)
+    # Events up to the next snapshot at most: it was taken after moment.
+    following = session.scalar(
+        select(func.min(RosterSnapshot.sequence)).
+        where(RosterSnapshot.schedule_id == schedule_id).
+        where(RosterSnapshot.sequence > after))
+    if following is not None:
+        events = events.filter(MutationEvent.sequence <= following)
+    return _apply(state, events.order_by(MutationEvent.sequence))
+
+
+@instrumented
+def roster_at(session, telegram_group_id, moment: datetime) -> Result:
+    """The roster of a group as it was known at `moment`.
+
+    Result.value maps (shift_id, shift_date) to (new_user_id, sequence):
+    the cover (None when open) and the MutationEvent that decided it.
+    Shifts and dates without events follow the regular schedule.
+    """
+    context = context_for(session)
+    range_result = validate_date_range(moment, moment)
+    schedule_result = context.schedule_view(telegram_group_id)
+    if not (range_result.success and schedule_result.success):
+        return Result(
+            success=False,
+            errors=range_result.errors + schedule_result.errors)
+    return Result(value=_state_at(
+        context.session, schedule_result.value.schedule_id, moment))
+
+
+@instrumented
+def cover_at(session, telegram_group_id, shift_id, shift_date,
+             moment: datetime) -> Result:
+    """The MutationEvent in effect for a shift and date at `moment`.
+
+    Result.value is None if the shift had no mutation on that date yet:
+    the regular schedule applied.
+    """
+    result = roster_at(session, telegram_group_id, moment)
+    if not result.success:
+        return result
+    decided = result.value.get((shift_id, shift_date))
+    if decided is None:
+        return Result(value=None)
+    return Result(value=context_for(session).session.get(
+        MutationEvent, decided[1]))
+
+
+def backfill(session, recorded_at: datetime=None) -> int:
+    """Log mutations that predate the event log; return how many.
+
+    Archived mutations are logged as well, all in mutation ID order. Their
+    events, and the snapshots taken per SNAPSHOT_INTERVAL events as usual,
+    are stamped with recorded_at, by default the time of the backfill.
+    Schedules whose log already has later events are skipped; see the
+    module documentation.
+    """
+    recorded_at = recorded_at or clock()
+    logged = select(MutationEvent.mutation_id).\
+        where(MutationEvent.mutation_id.isnot(None))
+    # Archived mutations and those still in use have the same columns.
+    streams = [session.query(model).
+               filter(model.mutation_id.notin_(logged)).
+               order_by(model.mutation_id).all()
+               for model in (ArchivedMutation, Mutation)]
+    pending = list(heapq.merge(
+        *streams, key=lambda mutation: mutation.mutation_id))
+    oldest = {}
+    for mutation in pending:
+        oldest.setdefault(mutation.schedule_id, mutation.mutation_id)
+    skipped = set()
+    for schedule_id, last_mutation_id, last_recorded_at in session.execute(
+            select(MutationEvent.schedule_id,
+                   func.max(MutationEvent.mutation_id),
+                   func.max(MutationEvent.recorded_at)).
+            group_by(MutationEvent.schedule_id)):
+        if schedule_id not in oldest:
+            continue
+        if last_recorded_at > recorded_at or (
+                last_mutation_id is not None and
+                last_mutation_id > oldest[schedule_id]):
+            LOGGER.warning(
+                "Not backfilling schedule %d: its log has events of "
+                "later mutations, or recorded after %s", schedule_id,
+                recorded_at)
+            skipped.add(schedule_id)
+    count = 0
+    for mutation in pending:
+        if mutation.schedule_id not in skipped:
+            record_event(session, mutation, recorded_at)
+            count += 1
+    return count
+
+
+def main(argv=None):
+    """Backfill the event log of the database given on the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) not in (1, 2):
+        print("usage: python -m rabbot.api.events DATABASE_URL [RECORDED_AT]")
+        return 2
+    recorded_at = datetime.fromisoformat(argv[1]) if len(argv) == 2 else None
+    with Session(make_engine(argv[0])) as session:
+        count = backfill(session, recorded_at)
+        session.commit()
+    print("logged {} mutations".format(count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
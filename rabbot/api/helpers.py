@@ -1,18 +1,44 @@
+from datetime import datetime
+
+from rabbot.recurrence import parse_rule
+from .errors import (
+    DateRangeEndsBeforeStartError,
+    DateRangeIsNotDatetimesError,
+    InvalidRecurrenceError,
+    ShiftNameIsEmptyError,
+    ShiftNameIsNotAStringError,
+    ShiftOrderingIsNotAnIntError)
+
+
+# Shared by every Result without errors; a tuple, so it can't be appended to.
+NO_ERRORS = ()
+
+
 class Result:
-    """Represent a result that can be either a value or an error"""
+    """Represent a result that can be either a value or an error
+
+    errors is a tuple of APIErrors. It used to be a list; code that
+    appended to it must add a tuple instead: `result.errors += (error,)`.
+    Lists passed to the constructor are converted.
+    """
+    __slots__ = ('success', 'message', 'value', 'errors')
+
     def __init__(self,
                  message: str="",
                  success: bool=True,
                  value=None,
-                 errors: list=None
+                 errors: tuple=NO_ERRORS
                 ):
         self.success = success
         self.message = message
         self.value = value
+        # Errors are a tuple, so Results can be merged with +.
         if errors is None:
-            self.errors = list()
-        else:
+            self.errors = NO_ERRORS
+        elif isinstance(errors, tuple):
             self.errors = errors
+        else:
+            self.errors = tuple(errors)
 
 
 def validate_ordering(us_ordering) -> Result:
@@ -20,22 +46,34 @@ def validate_ordering(us_ordering) -> Result:
     if not isinstance(us_ordering, int):
         return Result(
             success=False,
-            errors=['Ordering should be an integer, and not {}'
-                    .format(us_ordering)])
-    else:
-        return Result(value=us_ordering)
+            errors=(ShiftOrderingIsNotAnIntError(us_ordering),))
+    return Result(value=us_ordering)
 
 
 def validate_shift_name(us_name: str) -> Result:
     """Return Result with validated shift name, or with errors"""
-    result = Result()
     if not isinstance(us_name, str):
-        result.success = False
-        result.errors.append('Shift name must be a string')
-    elif len(us_name) < 1:
-        result.success = False
-        result.errors.append('Shift name may not be empty')
-    else:
-        result.value = us_name
-    return result
+        return Result(success=False, errors=(ShiftNameIsNotAStringError(),))
+    if len(us_name) < 1:
+        return Result(success=False, errors=(ShiftNameIsEmptyError(),))
+    return Result(value=us_name)
+
+
+def validate_date_range(us_start, us_end) -> Result:
+    """Return Result with a validated (start, end) tuple, or with errors"""
+    if not all(isinstance(moment, datetime) for moment in (us_start, us_end)):
+        return Result(
+            success=False, errors=(DateRangeIsNotDatetimesError(),))
+    if us_end < us_start:
+        return Result(
+            success=False, errors=(DateRangeEndsBeforeStartError(),))
+    return Result(value=(us_start, us_end))
+
 
+def validate_recurrence(us_rule) -> Result:
+    """Return Result with validated recurrence rule, or with errors"""
+    try:
+        parse_rule(us_rule)
+    except ValueError as error:
+        return Result(success=False, errors=(InvalidRecurrenceError(error),))
+    return Result(value=us_rule)
@@ -0,0 +1,217 @@
+"""Wall time, SQL statements and loaded rows per API function.
+
+Public API functions are wrapped with `instrumented`. Until `enable()` is
+called the wrapper only checks one flag and calls through; no SQLAlchemy
+listeners are installed. Once enabled, every call records its wall time,
+the SQL statements executed on its thread and the ORM objects loaded,
+into `STATS`. Nested calls count towards every API function on the call
+stack, like cumulative time in a profiler. When a function returns a
+Result whose value is a generator, such as iter_shifts, the generator is
+wrapped: the time and statements spent consuming it count towards the
+call, which is recorded once the generator is exhausted or closed. Calls
+slower than the slow threshold are logged with the statements they
+executed.
+
+    from rabbot.api import instrument
+    instrument.enable(slow_threshold=0.1)
+    ...
+    print(instrument.prometheus())
+"""
+import functools
+import logging
+import threading
+import time
+import types
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+LOGGER = logging.getLogger(__name__)
+
+_enabled = False
+_slow_threshold = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class CallStats(object):
+
+    """Totals for one API function."""
+
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'statements', 'rows',
+                 'slow_calls')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.slow_calls = 0
+
+
+class _Frame(object):
+
+    __slots__ = ('statements', 'rows')
+
+    def __init__(self):
+        self.statements = []
+        self.rows = 0
+
+
+# Function name -> CallStats.
+STATS = {}
+
+
+def _frames() -> list:
+    frames = getattr(_local, 'frames', None)
+    if frames is None:
+        frames = _local.frames = []
+    return frames
+
+
+# pylint: disable=unused-argument,too-many-arguments
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    for frame in getattr(_local, 'frames', ()):
+        frame.statements.append(statement)
+
+
+def _on_load(session, instance):
+    for frame in getattr(_local, 'frames', ()):
+        frame.rows += 1
+
+
+def enable(slow_threshold: float=None) -> None:
+    """Start recording; log calls slower than slow_threshold seconds."""
+    # pylint: disable=global-statement
+    global _enabled, _slow_threshold
+    _slow_threshold = slow_threshold
+    if not _enabled:
+        event.listen(Engine, 'before_cursor_execute', _on_execute)
+        event.listen(Session, 'loaded_as_persistent', _on_load)
+        _enabled = True
+
+
+def disable() -> None:
+    """Stop recording and remove the listeners; STATS are kept."""
+    # pylint: disable=global-statement
+    global _enabled
+    if _enabled:
+        event.remove(Engine, 'before_cursor_execute', _on_execute)
+        event.remove(Session, 'loaded_as_persistent', _on_load)
+        _enabled = False
+
+
+def reset() -> None:
+    """Forget all recorded STATS."""
+    with _lock:
+        STATS.clear()
+
+
+def _record(name: str, seconds: float, frame: _Frame) -> None:
+    slow = _slow_threshold is not None and seconds > _slow_threshold
+    with _lock:
+        stats = STATS.get(name)
+        if stats is None:
+            stats = STATS[name] = CallStats()
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.statements += len(frame.statements)
+        stats.rows += frame.rows
+        stats.slow_calls += slow
+    if slow:
+        LOGGER.warning(
+            "Slow call %s took %.3fs, %d statements:\n%s",
+            name, seconds, len(frame.statements),
+            '\n'.join(frame.statements))
+
+
+def _measured(name: str, generator, frame: _Frame, elapsed: float):
+    """Yield from generator, counting each step towards the call."""
+    try:
+        while True:
+            frames = _frames()
+            frames.append(frame)
+            started = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+                frames.pop()
+            yield item
+    finally:
+        generator.close()
+        _record(name, elapsed, frame)
+
+
+def instrumented(function):
+    """Record calls of function while instrumentation is enabled."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        frames = _frames()
+        frame = _Frame()
+        frames.append(frame)
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            frames.pop()
+            _record(name, time.perf_counter() - started, frame)
+            raise
+        elapsed = time.perf_counter() - started
+        frames.pop()
+        value = getattr(result, 'value', None)
+        if isinstance(value, types.GeneratorType):
+            result.value = _measured(name, value, frame, elapsed)
+        else:
+            _record(name, elapsed, frame)
+        return result
+    return wrapper
+
+
+def prometheus(prefix: str='rabbot_api') -> str:
+    """Render STATS in the Prometheus text format."""
+    lines = []
+    with _lock:
+        items = sorted(STATS.items())
+        for metric, attribute in [('calls_total', 'calls'),
+                                  ('seconds_total', 'seconds'),
+                                  ('seconds_max', 'max_seconds'),
+                                  ('statements_total', 'statements'),
+                                  ('rows_total', 'rows'),
+                                  ('slow_calls_total', 'slow_calls')]:
+            for name, stats in items:
+                lines.append('{}_{}{{function="{}"}} {}'.format(
+                    prefix, metric, name, getattr(stats, attribute)))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def summary() -> str:
+    """One line per function: calls, mean time, statements and rows."""
+    lines = []
+    with _lock:
+        for name, stats in sorted(STATS.items()):
+            lines.append(
+                "{}: {} calls, {:.2f}ms mean, {:.2f}ms max, "
+                "{:.1f} statements/call, {:.1f} rows/call".format(
+                    name, stats.calls,
+                    stats.seconds / stats.calls * 1e3,
+                    stats.max_seconds * 1e3,
+                    stats.statements / stats.calls,
+                    stats.rows / stats.calls))
+    return '\n'.join(lines)
+
+
+def log_summary(logger=LOGGER) -> None:
+    """Log summary(), e.g. periodically from the bot's event loop."""
+    text = summary()
+    if text:
+        logger.info("API call summary:\n%s", text)
@@ -0,0 +1,75 @@
+"""Named eager-loading profiles for API queries.
+
+Relationships in rabbot.models load lazily, one query per object the
+first time they are touched. Rendering a roster touches the shift, the
+new cover and the mutator of every entry, so the API queries of roster
+views take their loader options from the active profile:
+
+roster
+    Everything a roster view shows is loaded with the entries: a constant
+    number of queries however many shifts and users there are. Default.
+lazy
+    The models' own lazy loading.
+strict
+    As roster, but touching anything else raises instead of querying.
+    Meant for tests, to catch accidental lazy loads.
+
+    with loading.profile('strict'):
+        entries = api.list_altered_shifts(session, 1, start, end).value
+
+The active profile is kept per thread and per asyncio task, so a
+profile block in one handler does not affect the others.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy.orm import joinedload, raiseload
+
+from rabbot.models import Mutation, RosterEntry
+
+# Many-to-one relationships only, so joined loads work with yield_per.
+_ROSTER = {
+    RosterEntry: lambda: [
+        joinedload(RosterEntry.shift),
+        joinedload(RosterEntry.new_user),
+        joinedload(RosterEntry.mutation).joinedload(Mutation.mutator)],
+    Mutation: lambda: [
+        joinedload(Mutation.shift),
+        joinedload(Mutation.new_user),
+        joinedload(Mutation.mutator)],
+}
+
+
+def _strict(model):
+    def options():
+        loaded = _ROSTER[model]()
+        # A wildcard per loaded path, so nested objects raise as well.
+        nested = [option.raiseload('*') for option in loaded]
+        return loaded + nested + [raiseload('*')]
+    return options
+
+
+PROFILES = {
+    'roster': _ROSTER,
+    'lazy': {},
+    'strict': {model: _strict(model) for model in _ROSTER},
+}
+_active = ContextVar('rabbot_loading_profile', default='roster')
+
+
+def options(model) -> list:
+    """Loader options of the active profile for queries of model."""
+    loaders = PROFILES[_active.get()].get(model)
+    return loaders() if loaders is not None else []
+
+
+@contextmanager
+def profile(name: str):
+    """Use the named profile inside a with-block."""
+    if name not in PROFILES:
+        raise ValueError("No loading profile named {!r}".format(name))
+    token = _active.set(name)
+    try:
+        yield
+    finally:
+        _active.reset(token)
@@ -0,0 +1,30 @@
+"""Single-row lookups shared by the API functions.
+
+Primary key lookups go through `session.get`, which returns objects that
+are already in the session's identity map without emitting any SQL. Other
+lookups fetch at most two rows: one to return, and a second one only to
+tell "exactly one" apart from "more than one".
+"""
+from .helpers import Result
+
+
+def by_primary_key(session, model, primary_key, missing_error) -> Result:
+    """Fetch `model` by primary key, or return Result with missing_error."""
+    instance = session.get(model, primary_key)
+    if instance is None:
+        return Result(success=False, errors=(missing_error(primary_key),))
+    return Result(value=instance)
+
+
+def only_one(query, key, missing_error, duplicate_error) -> Result:
+    """Return Result with the single row of query, or with an error.
+
+    `key` is what the caller looked up by; it is passed to the error
+    constructors so the error message can mention it.
+    """
+    rows = query.limit(2).all()
+    if len(rows) == 0:
+        return Result(success=False, errors=(missing_error(key),))
+    elif len(rows) == 1:
+        return Result(value=rows[0])
+    return Result(success=False, errors=(duplicate_error(key),))
@@ -0,0 +1,126 @@
+"""The effective roster: current cover per (schedule, date, shift).
+
+The roster table holds, for every shift and date that has mutations, the
+outcome of the latest one. add_mutation keeps it up to date in the same
+transaction as the mutation itself, so the queries below are range scans
+over the roster's primary key instead of scans over the mutation history.
+
+If the roster ever drifts from the mutations (for instance after editing
+mutations by hand) it can be rebuilt:
+
+    python -m rabbot.api.roster DATABASE_URL
+"""
+import sys
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from rabbot.database import make_engine
+from rabbot.models import Mutation, RosterEntry
+from .helpers import Result, validate_date_range
+from .context import context_for
+from .instrument import instrumented
+from . import loading
+
+
+def record_mutation(session, mutation: Mutation) -> RosterEntry:
+    """Make `mutation` the current cover of its shift and date."""
+    key = (mutation.schedule_id, mutation.shift_date, mutation.shift_id)
+    entry = session.get(RosterEntry, key)
+    if entry is None:
+        entry = RosterEntry(
+            schedule_id=mutation.schedule_id,
+            shift_date=mutation.shift_date,
+            shift_id=mutation.shift_id)
+        session.add(entry)
+    entry.mutation_id = mutation.mutation_id
+    entry.new_user_id = mutation.new_user_id
+    return entry
+
+
+@instrumented
+def rebuild_roster(session, schedule_id: int=None) -> int:
+    """Regenerate the roster from the mutations; return the row count.
+
+    Rebuilds one schedule, or every schedule when schedule_id is None.
+    """
+    latest = select(func.max(Mutation.mutation_id).label('mutation_id')).\
+        group_by(Mutation.schedule_id, Mutation.shift_date, Mutation.shift_id)
+    clear = delete(RosterEntry)
+    if schedule_id is not None:
+        latest = latest.where(Mutation.schedule_id == schedule_id)
+        clear = clear.where(RosterEntry.schedule_id == schedule_id)
+    latest = latest.subquery()
+    rows = select(
+        Mutation.schedule_id, Mutation.shift_date, Mutation.shift_id,
+        Mutation.mutation_id, Mutation.new_user_id).\
+        join(latest, Mutation.mutation_id == latest.c.mutation_id)
+    session.execute(clear)
+    result = session.execute(insert(RosterEntry).from_select(
+        ['schedule_id', 'shift_date', 'shift_id', 'mutation_id',
+         'new_user_id'],
+        rows))
+    session.expire_all()
+    return result.rowcount
+
+
+def _roster(context, telegram_group_id, start, end, *criteria) -> Result:
+    """Roster entries of a group in [start, end) that match criteria."""
+    range_result = validate_date_range(start, end)
+    schedule_result = context.schedule_view(telegram_group_id)
+    if not (range_result.success and schedule_result.success):
+        return Result(
+            success=False,
+            errors=range_result.errors + schedule_result.errors)
+    entries = context.session.query(RosterEntry).\
+        filter(RosterEntry.schedule_id == schedule_result.value.schedule_id).\
+        filter(RosterEntry.shift_date >= start).\
+        filter(RosterEntry.shift_date < end).\
+        filter(*criteria).\
+        order_by(RosterEntry.shift_date, RosterEntry.shift_id).\
+        options(*loading.options(RosterEntry))
+    return Result(value=entries.all())
+
+
+@instrumented
+def list_open_shifts(session, telegram_group_id, start, end) -> Result:
+    """List roster entries in [start, end) that nobody covers."""
+    return _roster(
+        context_for(session), telegram_group_id, start, end,
+        RosterEntry.new_user_id.is_(None))
+
+
+@instrumented
+def list_altered_shifts(session, telegram_group_id, start, end) -> Result:
+    """List all roster entries in [start, end): every mutated shift."""
+    return _roster(context_for(session), telegram_group_id, start, end)
+
+
+@instrumented
+def list_user_shifts(session, telegram_group_id, telegram_user_id,
+                     start, end) -> Result:
+    """List roster entries in [start, end) the user took over."""
+    context = context_for(session)
+    user_result = context.user(telegram_user_id)
+    if not user_result.success:
+        return user_result
+    return _roster(
+        context, telegram_group_id, start, end,
+        RosterEntry.new_user_id == user_result.value.user_id)
+
+
+def main(argv=None):
+    """Rebuild the roster of the database given on the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: python -m rabbot.api.roster DATABASE_URL")
+        return 2
+    with Session(make_engine(argv[0])) as session:
+        count = rebuild_roster(session)
+        session.commit()
+    print("rebuilt {} roster entries".format(count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
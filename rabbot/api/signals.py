@@ -0,0 +1,106 @@
+"""Notifications about changes made through the API.
+
+API functions announce changes with `signal.send_after_commit(session,
+...)`. Receivers are called once the session's transaction commits, and
+never if it rolls back, so caches that listen can not be refilled with
+data that was never committed. Rolling back a SAVEPOINT (begin_nested)
+drops only the signals sent inside it.
+"""
+import logging
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+LOGGER = logging.getLogger(__name__)
+
+_PENDING = 'rabbot.signals.pending'
+
+
+class Signal(object):
+
+    """A list of receivers to call with the same arguments."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._receivers = []
+
+    def connect(self, receiver):
+        """Call receiver on every send; returns receiver for decorator use."""
+        self._receivers.append(receiver)
+        return receiver
+
+    def disconnect(self, receiver) -> None:
+        """Stop calling receiver."""
+        self._receivers.remove(receiver)
+
+    def send(self, *args) -> None:
+        """Call every receiver now."""
+        for receiver in list(self._receivers):
+            receiver(*args)
+
+    def send_robust(self, *args) -> None:
+        """Call every receiver now; log their exceptions instead of raising."""
+        for receiver in list(self._receivers):
+            try:
+                receiver(*args)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Receiver %r of %r failed", receiver, self)
+
+    def send_after_commit(self, session, *args) -> None:
+        """Call every receiver when the session's transaction commits."""
+        session.info.setdefault(_PENDING, []).append(
+            (session.get_nested_transaction(), self, args))
+
+    def __repr__(self):
+        return '<Signal {}>'.format(self.name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _deliver(session):
+    if session.in_nested_transaction():
+        # A SAVEPOINT was released; nothing is committed yet.
+        return
+    # The data is committed whatever a receiver does, so its exceptions
+    # must not escape from session.commit() or keep other receivers and
+    # signals from being called.
+    for _, signal, args in session.info.pop(_PENDING, []):
+        signal.send_robust(*args)
+
+
+def _inside(transaction, ended) -> bool:
+    """Was transaction (None: outside any SAVEPOINT) part of ended?"""
+    while transaction is not None:
+        if transaction is ended:
+            return True
+        transaction = transaction.parent
+    return not ended.nested
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard(session, previous_transaction):
+    pending = [entry for entry in session.info.pop(_PENDING, [])
+               if not _inside(entry[0], previous_transaction)]
+    if pending:
+        session.info[_PENDING] = pending
+
+
+# Sent with the schedule_id of a schedule whose shifts were added,
+# renamed, reordered or deleted.
+shifts_changed = Signal('shifts_changed')
+
+# Sent with the schedule_id of a schedule that gained members.
+members_changed = Signal('members_changed')
+
+# Sent with the schedule_id of a deleted schedule.
+schedule_deleted = Signal('schedule_deleted')
+
+# What add_mutation did, in Telegram terms. kind is 'opened' when nobody
+# covers the shift any more, 'covered' when new_user (a telegram_user_id)
+# does. sequence is that of the MutationEvent, see rabbot.api.events.
+ShiftEvent = namedtuple('ShiftEvent', [
+    'kind', 'telegram_group_id', 'shift_id', 'shift_name', 'shift_date',
+    'mutator', 'new_user', 'sequence', 'recorded_at'])
+
+# Sent with a ShiftEvent for every mutation; see rabbot.bus.
+shift_mutated = Signal('shift_mutated')
@@ -1,13 +1,18 @@
 """Tests for the API's public functions."""
 # pylint: disable=missing-docstring, invalid-name
-from nose.tools import assert_equals
+import threading
+from datetime import datetime
+
+from nose.tools import assert_equals, assert_raises, assert_true
+from sqlalchemy.exc import InvalidRequestError
 
 # Instead of `from rabbot import api`, we could also do `from . import core`.
 # We don't: this test suite is aimed at the API module's public API, regardless
 # of how it is implemented.
 from rabbot import api
-from rabbot.dummydb import DummyDB
-from rabbot.models import Schedule, Shift, User
+from rabbot.dummydb import DummyDB, QueryCounter
+from rabbot.models import (
+    ArchivedMutation, Schedule, Shift, User, Mutation, RosterEntry)
 
 
 def test_list_shifts():
@@ -124,6 +129,18 @@ class Test_edit_shift():
             result = api.edit_shift(session, 1, "test2", None)
             assert_equals(result.success, False)
 
+    def test_name_taken(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            api.add_shift(session, 1, 'a', 0)
+            shift = api.add_shift(session, 1, 'b', 1).value
+            result = api.edit_shift(session, shift.shift_id, 'a', 1)
+            assert_equals(result.success, False)
+            assert_equals(result.errors[0].code, 'already-shift-with-name')
+            assert_equals(
+                api.edit_shift(session, shift.shift_id, 'b', 2).success, True)
+
 
 class Test_get_schedule():
 
@@ -253,6 +270,16 @@ class Test_add_schedule():
             result = api.add_schedule(session, 1, 1)
             assert_equals(result.success, False)
 
+    def test_group_with_schedule(self):
+        with DummyDB() as session:
+            session.add_all([User(telegram_user_id=1),
+                             Schedule(telegram_group_id=1)])
+            session.flush()
+            result = api.add_schedule(session, 1, 1)
+            assert_equals(result.success, False)
+            assert_equals(result.errors[0].code,
+                          'already-schedule-for-telegram-group-id')
+
 
 class Test_delete_schedule():
 
@@ -298,3 +325,683 @@ class Test_add_user_to_schedule():
             session.flush()
             result = api.add_user_to_schedule(session, 1, 1)
             assert_equals(result.success, False)
+
+
+class Test_lookup_costs():
+
+    def test_get_shift_by_id_uses_identity_map(self):
+        with DummyDB() as session:
+            shift = Shift(name="test")
+            session.add(shift)
+            session.flush()
+            with QueryCounter(session) as counter:
+                result = api.get_shift_by_id(session, shift.shift_id)
+            assert_equals(result.value, shift)
+            assert_equals(counter.count, 0)
+
+    def test_get_schedule_by_id_uses_identity_map(self):
+        with DummyDB() as session:
+            schedule = Schedule()
+            session.add(schedule)
+            session.flush()
+            with QueryCounter(session) as counter:
+                api.get_schedule_by_id(session, schedule.schedule_id)
+            assert_equals(counter.count, 0)
+
+    def test_get_shift_by_name_loads_one_shift(self):
+        with DummyDB() as session:
+            schedule = Schedule(telegram_group_id=1)
+            session.add_all([schedule] + [
+                Shift(schedule=schedule, name=str(i)) for i in range(10)])
+            session.commit()
+            session.expunge_all()
+            with QueryCounter(session) as counter:
+                result = api.get_shift_by_name(session, 1, "3")
+            assert_equals(result.value.name, "3")
+            assert_equals(counter.count, 2)
+            assert_equals(counter.loaded, 2)
+
+
+class Test_request_context():
+
+    def test_add_shift_resolves_schedule_once(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.commit()
+            with QueryCounter(session) as counter:
+                result = api.add_shift(session, 1, 'Evening shift', 0)
+            assert_equals(result.success, True)
+            # Schedule, name collision check, insert.
+            assert_equals(counter.count, 3)
+
+    def test_one_update_resolves_group_and_user_once(self):
+        with DummyDB() as session:
+            session.add_all([Schedule(telegram_group_id=1),
+                             User(telegram_user_id=1)])
+            session.commit()
+            with QueryCounter(session) as counter:
+                context = api.RequestContext(session)
+                api.add_user_to_schedule(context, 1, 1)
+                api.add_shift(context, 1, 'Evening shift', 0)
+                result = api.list_shifts(context, 1)
+                api.get_user(context, 1)
+            assert_equals(len(result.value), 1)
+            # User, schedule, schedule.users, membership insert, shift
+            # collision check, shift insert, schedule.shifts.
+            assert_equals(counter.count, 7)
+
+    def test_deleted_schedule_is_forgotten(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            context = api.RequestContext(session)
+            schedule = api.get_schedule(context, 1).value
+            api.delete_schedule(context, schedule.schedule_id)
+            assert_equals(api.get_schedule(context, 1).success, False)
+
+    def test_added_schedule_is_found(self):
+        with DummyDB() as session:
+            session.add(User(telegram_user_id=1))
+            session.flush()
+            context = api.RequestContext(session)
+            assert_equals(api.get_schedule(context, 5).success, False)
+            schedule = api.add_schedule(context, 5, 1).value
+            assert_true(api.get_schedule(context, 5).value is schedule)
+            assert_equals(api.add_shift(context, 5, 'Evening', 0).success,
+                          True)
+
+    def test_added_user_is_found(self):
+        with DummyDB() as session:
+            context = api.RequestContext(session)
+            assert_equals(api.get_user(context, 7).success, False)
+            session.add(User(telegram_user_id=7))
+            session.flush()
+            assert_equals(api.get_user(context, 7).value.telegram_user_id, 7)
+
+
+def _mutated_schedule(session):
+    """Schedule 1 with two shifts; shift1 is opened, taken, opened again."""
+    oskar = User(telegram_user_id=1, name="Oskar")
+    wimpje = User(telegram_user_id=2, name="Wimpje")
+    schedule = Schedule(telegram_group_id=1)
+    shift1 = Shift(schedule=schedule, name="shift1", ordering=1)
+    shift2 = Shift(schedule=schedule, name="shift2", ordering=2)
+    day = datetime(2016, 6, 15)
+    session.add_all([oskar, wimpje, schedule, shift1, shift2])
+    for shift, user in [(shift1, None), (shift1, oskar), (shift1, None),
+                        (shift2, wimpje)]:
+        session.add(Mutation(
+            schedule=schedule, shift=shift, shift_date=day,
+            mutator=oskar, new_user=user))
+    session.flush()
+    return shift1, shift2, day
+
+
+class Test_get_cover():
+
+    def test_latest_mutation_wins(self):
+        with DummyDB() as session:
+            shift1, shift2, day = _mutated_schedule(session)
+            result = api.get_cover(session, shift1.shift_id, day)
+            assert_equals(result.success, True)
+            assert_equals(result.value.new_user, None)
+            result = api.get_cover(session, shift2.shift_id, day)
+            assert_equals(result.value.new_user.name, "Wimpje")
+
+    def test_unmutated_date(self):
+        with DummyDB() as session:
+            shift1, _, _ = _mutated_schedule(session)
+            result = api.get_cover(session, shift1.shift_id, datetime(2016, 1, 1))
+            assert_equals(result.success, True)
+            assert_equals(result.value, None)
+
+    def test_time_of_day_is_dropped(self):
+        with DummyDB() as session:
+            _, shift2, day = _mutated_schedule(session)
+            result = api.get_cover(session, shift2.shift_id,
+                                   day.replace(hour=18, minute=30))
+            assert_equals(result.value.new_user.name, "Wimpje")
+
+    def test_not_a_datetime(self):
+        with DummyDB() as session:
+            shift1, _, _ = _mutated_schedule(session)
+            result = api.get_cover(session, shift1.shift_id, '2016-06-15')
+            assert_equals(result.success, False)
+            assert_equals(result.errors[0].code,
+                          'shift-date-is-not-a-datetime')
+
+    def test_non_existent_shift(self):
+        with DummyDB() as session:
+            result = api.get_cover(session, 1, datetime(2016, 1, 1))
+            assert_equals(result.success, False)
+
+
+class Test_list_covers():
+
+    def test_valid_data(self):
+        with DummyDB() as session:
+            shift1, shift2, day = _mutated_schedule(session)
+            result = api.list_covers(
+                session, 1, datetime(2016, 6, 1), datetime(2016, 7, 1))
+            assert_equals(result.success, True)
+            assert_equals(len(result.value), 2)
+            assert_equals(result.value[shift1.shift_id, day].new_user, None)
+            assert_equals(
+                result.value[shift2.shift_id, day].new_user.name, "Wimpje")
+
+    def test_outside_window(self):
+        with DummyDB() as session:
+            _mutated_schedule(session)
+            result = api.list_covers(
+                session, 1, datetime(2016, 7, 1), datetime(2016, 8, 1))
+            assert_equals(result.value, {})
+
+    def test_one_query(self):
+        with DummyDB() as session:
+            _mutated_schedule(session)
+            context = api.RequestContext(session)
+            api.get_schedule(context, 1)
+            with QueryCounter(session) as counter:
+                api.list_covers(
+                    context, 1, datetime(2016, 6, 1), datetime(2016, 7, 1))
+            assert_equals(counter.count, 1)
+
+    def test_non_existent_schedule(self):
+        with DummyDB() as session:
+            result = api.list_covers(
+                session, 1, datetime(2016, 6, 1), datetime(2016, 7, 1))
+            assert_equals(result.success, False)
+
+
+def _members_schedule(session):
+    """Schedule 1 with shift1 and members Oskar (1) and Wimpje (2)."""
+    oskar = User(telegram_user_id=1, name="Oskar")
+    wimpje = User(telegram_user_id=2, name="Wimpje")
+    schedule = Schedule(telegram_group_id=1, users=[oskar, wimpje])
+    shift = Shift(schedule=schedule, name="shift1", ordering=1)
+    session.add_all([oskar, wimpje, schedule, shift])
+    session.flush()
+    return shift
+
+
+JUNE = (datetime(2016, 6, 1), datetime(2016, 7, 1))
+
+
+class Test_add_mutation():
+
+    def test_valid_data(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            day = datetime(2016, 6, 15)
+            result = api.add_mutation(session, 1, 1, shift.shift_id, day, 2)
+            assert_equals(result.success, True)
+            assert_equals(result.value.new_user.name, "Wimpje")
+            cover = api.get_cover(session, shift.shift_id, day)
+            assert_equals(cover.value, result.value)
+
+    def test_time_of_day_is_dropped(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            day = datetime(2016, 6, 15)
+            api.add_mutation(session, 1, 1, shift.shift_id,
+                             datetime(2016, 6, 15, 18, 30), 2)
+            assert_equals(api.get_cover(session, shift.shift_id, day).
+                          value.shift_date, day)
+            occurrences = list(api.iter_shifts(
+                session, 1, day, datetime(2016, 6, 16)).value)
+            assert_equals(occurrences[0][2].new_user.name, "Wimpje")
+
+    def test_open_shift(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            result = api.add_mutation(
+                session, 1, 1, shift.shift_id, datetime(2016, 6, 15))
+            assert_equals(result.success, True)
+            assert_equals(result.value.new_user, None)
+
+    def test_shift_of_other_group(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            session.add(Schedule(telegram_group_id=2))
+            session.flush()
+            result = api.add_mutation(
+                session, 2, 1, shift.shift_id, datetime(2016, 6, 15))
+            assert_equals(result.success, False)
+
+    def test_invalid_date(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            result = api.add_mutation(session, 1, 1, shift.shift_id, "June")
+            assert_equals(result.success, False)
+
+    def test_non_existent_new_user(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            result = api.add_mutation(
+                session, 1, 1, shift.shift_id, datetime(2016, 6, 15), 3)
+            assert_equals(result.success, False)
+
+
+class Test_roster():
+
+    def test_roster_follows_mutations(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            day = datetime(2016, 6, 15)
+            other_day = datetime(2016, 6, 16)
+            api.add_mutation(session, 1, 1, shift.shift_id, day)
+            api.add_mutation(session, 1, 1, shift.shift_id, other_day)
+            assert_equals(len(api.list_open_shifts(session, 1, *JUNE).value), 2)
+            api.add_mutation(session, 1, 2, shift.shift_id, day, 2)
+            open_shifts = api.list_open_shifts(session, 1, *JUNE).value
+            assert_equals([entry.shift_date for entry in open_shifts],
+                          [other_day])
+            assert_equals(
+                len(api.list_altered_shifts(session, 1, *JUNE).value), 2)
+            mine = api.list_user_shifts(session, 1, 2, *JUNE).value
+            assert_equals([entry.shift_date for entry in mine], [day])
+
+    def test_rebuild(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            day = datetime(2016, 6, 15)
+            api.add_mutation(session, 1, 1, shift.shift_id, day)
+            # Bypass add_mutation, so the roster falls behind.
+            session.add(Mutation(
+                schedule_id=shift.schedule_id, shift=shift, shift_date=day,
+                new_user_id=2))
+            session.flush()
+            assert_equals(len(api.list_open_shifts(session, 1, *JUNE).value), 1)
+            assert_equals(api.rebuild_roster(session), 1)
+            assert_equals(len(api.list_open_shifts(session, 1, *JUNE).value), 0)
+
+
+class Test_iter_shifts():
+
+    def test_valid_data(self):
+        with DummyDB() as session:
+            shift = _members_schedule(session)
+            api.add_shift(session, 1, 'weekend', 2, 'sat,sun')
+            monday = datetime(2016, 6, 13)
+            api.add_mutation(session, 1, 1, shift.shift_id, monday, 2)
+            result = api.iter_shifts(session, 1, monday, datetime(2016, 6, 20))
+            assert_equals(result.success, True)
+            found = [(day.day, shift.name, mutation and mutation.new_user.name)
+                     for day, shift, mutation in result.value]
+            assert_equals(len(found), 9)
+            assert_equals(found[0], (13, "shift1", "Wimpje"))
+            assert_equals(found[-2:], [(19, "shift1", None),
+                                       (19, "weekend", None)])
+
+    def test_invalid_range(self):
+        with DummyDB() as session:
+            _members_schedule(session)
+            result = api.iter_shifts(session, 1, None, datetime(2016, 6, 20))
+            assert_equals(result.success, False)
+
+
+def test_add_shift_rejects_invalid_recurrence():
+    with DummyDB() as session:
+        session.add(Schedule(telegram_group_id=1))
+        session.flush()
+        result = api.add_shift(session, 1, 'Evening', 0, 'someday')
+        assert_equals(result.success, False)
+
+
+def test_edit_shift_keeps_recurrence():
+    with DummyDB() as session:
+        shift = Shift(name="test", ordering=0, recurrence='mon')
+        session.add(shift)
+        session.flush()
+        api.edit_shift(session, shift.shift_id, "test", 1)
+        assert_equals(shift.recurrence, 'mon')
+        api.edit_shift(session, shift.shift_id, "test", 1, 'tue')
+        assert_equals(shift.recurrence, 'tue')
+
+
+class Test_add_shifts():
+
+    def test_valid_data(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.commit()
+            with QueryCounter(session) as counter:
+                result = api.add_shifts(session, 1, [
+                    {'name': 'shift{}'.format(i), 'ordering': i}
+                    for i in range(20)])
+            assert_equals(result.success, True)
+            assert_equals(len(api.list_shifts(session, 1).value), 20)
+            # Schedule, one collision check, then the inserts of a single
+            # flush; each row needs its own statement to learn its ID.
+            assert_equals(counter.count, 22)
+
+    def test_per_item_results(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            api.add_shift(session, 1, 'taken', 0)
+            result = api.add_shifts(session, 1, [
+                {'name': 'taken', 'ordering': 1},
+                {'name': 'new', 'ordering': 2},
+                {'name': 'new', 'ordering': 3},
+                {'name': '', 'ordering': 4},
+                {'name': 'weekend', 'ordering': 5, 'recurrence': 'sat,sun'}])
+            assert_equals(result.success, False)
+            assert_equals([item.success for item in result.value],
+                          [False, True, False, False, True])
+            assert_equals(result.value[0].errors[0].code,
+                          'already-shift-with-name')
+            assert_equals(len(api.list_shifts(session, 1).value), 3)
+
+    def test_invalid_item_does_not_take_its_name(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            result = api.add_shifts(session, 1, [
+                {'name': 'night', 'ordering': 'late'},
+                {'name': 'night', 'ordering': 2}])
+            assert_equals([item.success for item in result.value],
+                          [False, True])
+            assert_equals(result.value[0].errors[0].code, 'shift-ordering-is-not-an-int')
+            assert_equals([shift.name for shift in api.list_shifts(
+                session, 1).value], ['night'])
+
+    def test_non_existent_schedule(self):
+        with DummyDB() as session:
+            result = api.add_shifts(session, 1, [{'name': 'a', 'ordering': 1}])
+            assert_equals(result.success, False)
+
+
+class Test_edit_shifts():
+
+    def test_valid_data(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            shifts = api.add_shifts(session, 1, [
+                {'name': 'a', 'ordering': 1},
+                {'name': 'b', 'ordering': 2, 'recurrence': 'mon'}]).value
+            result = api.edit_shifts(session, [
+                {'shift_id': shifts[0].value.shift_id, 'name': 'c',
+                 'ordering': 3},
+                {'shift_id': shifts[1].value.shift_id, 'name': 'b',
+                 'ordering': 0}])
+            assert_equals(result.success, True)
+            assert_equals([shift.name for shift in
+                           api.list_shifts(session, 1).value], ['b', 'c'])
+            assert_equals(shifts[1].value.recurrence, 'mon')
+
+    def test_per_item_results(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            shifts = api.add_shifts(session, 1, [
+                {'name': 'a', 'ordering': 1},
+                {'name': 'b', 'ordering': 2}]).value
+            result = api.edit_shifts(session, [
+                {'shift_id': shifts[0].value.shift_id, 'name': 'b',
+                 'ordering': 1},
+                {'shift_id': 99, 'name': 'x', 'ordering': 1},
+                {'shift_id': shifts[1].value.shift_id, 'name': 'b',
+                 'ordering': None}])
+            assert_equals([item.success for item in result.value],
+                          [False, False, False])
+            assert_equals(shifts[0].value.name, 'a')
+
+    def test_swap_names(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            shifts = [item.value for item in api.add_shifts(session, 1, [
+                {'name': 'a', 'ordering': 1},
+                {'name': 'b', 'ordering': 2},
+                {'name': 'c', 'ordering': 3}]).value]
+            result = api.edit_shifts(session, [
+                {'shift_id': shifts[0].shift_id, 'name': 'b', 'ordering': 1},
+                {'shift_id': shifts[1].shift_id, 'name': 'c', 'ordering': 2},
+                {'shift_id': shifts[2].shift_id, 'name': 'a', 'ordering': 3}])
+            assert_equals(result.success, True)
+            session.flush()
+            assert_equals([shift.name for shift in shifts], ['b', 'c', 'a'])
+
+    def test_rejected_rename_keeps_old_name_taken(self):
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.flush()
+            shifts = [item.value for item in api.add_shifts(session, 1, [
+                {'name': 'a', 'ordering': 1},
+                {'name': 'b', 'ordering': 2},
+                {'name': 'c', 'ordering': 3}]).value]
+            result = api.edit_shifts(session, [
+                {'shift_id': shifts[2].shift_id, 'name': 'b', 'ordering': 3},
+                {'shift_id': shifts[1].shift_id, 'name': 'a', 'ordering': 2}])
+            assert_equals([item.success for item in result.value],
+                          [False, False])
+            assert_equals([shift.name for shift in shifts], ['a', 'b', 'c'])
+
+    def test_nothing_to_write(self):
+        with DummyDB() as session:
+            with QueryCounter(session) as counter:
+                result = api.edit_shifts(session, [
+                    {'shift_id': 99, 'name': 'x', 'ordering': 1}])
+            assert_equals(result.success, False)
+            # Only the shift lookup; no flush.
+            assert_equals(counter.count, 1)
+            assert_equals(session.info.get('rabbot.signals.pending'), None)
+
+
+class Test_signals():
+
+    def test_savepoint_rollback_keeps_outer_signals(self):
+        changed = []
+        api.shifts_changed.connect(changed.append)
+        try:
+            with DummyDB() as session:
+                session.add(Schedule(telegram_group_id=1))
+                session.commit()
+                api.add_shift(session, 1, 'a', 1)
+                with assert_raises(ValueError):
+                    with session.begin_nested():
+                        api.add_shift(session, 1, 'b', 2)
+                        raise ValueError('undo b')
+                with session.begin_nested():
+                    api.add_shift(session, 1, 'c', 3)
+                assert_equals(changed, [])
+                session.commit()
+                # Once for a, once for c; b was rolled back.
+                assert_equals(len(changed), 2)
+                api.add_shift(session, 1, 'd', 4)
+                session.rollback()
+                session.commit()
+                assert_equals(len(changed), 2)
+        finally:
+            api.shifts_changed.disconnect(changed.append)
+
+
+class Test_bulk_deletes():
+
+    def _fill(self, session, mutations):
+        shift = _members_schedule(session)
+        for day in range(mutations):
+            api.add_mutation(session, 1, 1, shift.shift_id,
+                             datetime(2016, 1, 1 + day % 28), 2)
+        session.commit()
+        return shift
+
+    def test_delete_schedule_removes_children(self):
+        with DummyDB() as session:
+            shift = self._fill(session, 5)
+            schedule_id = shift.schedule_id
+            result = api.delete_schedule(session, schedule_id)
+            assert_equals(result.success, True)
+            session.commit()
+            for model in (Schedule, Shift, Mutation, RosterEntry):
+                assert_equals(session.query(model).count(), 0)
+            assert_equals(session.query(User).count(), 2)
+            assert_equals(session.get(User, 1).schedules, [])
+
+    def test_delete_schedule_does_not_load_children(self):
+        for mutations in (1, 50):
+            with DummyDB() as session:
+                shift = self._fill(session, mutations)
+                schedule_id = shift.schedule_id
+                session.expunge_all()
+                with QueryCounter(session) as counter:
+                    api.delete_schedule(session, schedule_id)
+                # Lookup plus one delete each for members, roster,
+                # archived mutations, events, snapshots, mutations,
+                # shifts and the schedule.
+                assert_equals(counter.count, 9)
+                assert_equals(counter.loaded, 1)
+
+    def test_delete_shift_removes_mutations(self):
+        with DummyDB() as session:
+            shift = self._fill(session, 5)
+            result = api.delete_shift(session, shift.shift_id)
+            assert_equals(result.success, True)
+            session.commit()
+            for model in (Shift, Mutation, RosterEntry):
+                assert_equals(session.query(model).count(), 0)
+            assert_equals(session.query(Schedule).count(), 1)
+
+
+class Test_loading_profiles():
+
+    def _fill(self, session, shifts):
+        """A week of mutations of every shift, by different users."""
+        users = [User(telegram_user_id=i, name=str(i)) for i in range(1, 9)]
+        session.add_all(users + [Schedule(telegram_group_id=1, users=users)])
+        session.commit()
+        for number in range(shifts):
+            shift = api.add_shift(session, 1, str(number), number).value
+            for day in range(7):
+                api.add_mutation(session, 1, 1 + (number + day) % 8,
+                                 shift.shift_id, datetime(2016, 6, 6 + day),
+                                 1 + (number + day + 1) % 8)
+        session.commit()
+        session.expunge_all()
+
+    def _render(self, session):
+        entries = api.list_altered_shifts(
+            session, 1, datetime(2016, 6, 6), datetime(2016, 6, 13)).value
+        return ['{} {}: {} for {}'.format(
+            entry.shift_date.date(), entry.shift.name, entry.new_user.name,
+            entry.mutation.mutator.name) for entry in entries]
+
+    def test_week_roster_takes_constant_queries(self):
+        counts = []
+        for shifts in (2, 10):
+            with DummyDB() as session:
+                self._fill(session, shifts)
+                with api.loading.profile('strict'):
+                    with QueryCounter(session) as counter:
+                        lines = self._render(session)
+                assert_equals(len(lines), 7 * shifts)
+                counts.append(counter.count)
+        # Schedule lookup plus the entries with everything they show.
+        assert_equals(counts, [2, 2])
+
+    def test_lazy_profile_queries_per_object(self):
+        with DummyDB() as session:
+            self._fill(session, 10)
+            with api.loading.profile('lazy'):
+                with QueryCounter(session) as counter:
+                    self._render(session)
+            assert_true(counter.count > 10)
+
+    def test_strict_profile_raises_on_lazy_load(self):
+        with DummyDB() as session:
+            self._fill(session, 1)
+            with api.loading.profile('strict'):
+                entry = api.list_altered_shifts(
+                    session, 1, datetime(2016, 6, 6),
+                    datetime(2016, 6, 13)).value[0]
+                with assert_raises(InvalidRequestError):
+                    entry.shift.schedule  # pylint: disable=pointless-statement
+
+    def test_unknown_profile(self):
+        with assert_raises(ValueError):
+            with api.loading.profile('eager'):
+                pass
+
+    def test_profile_is_per_thread(self):
+        entered, checked = threading.Event(), threading.Event()
+
+        def other_thread():
+            with api.loading.profile('lazy'):
+                entered.set()
+                checked.wait(5)
+
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        entered.wait(5)
+        try:
+            assert_true(api.loading.options(Mutation))
+        finally:
+            checked.set()
+            thread.join()
+
+
+class Test_compact_mutations():
+
+    def _fill(self, session):
+        """June 1: empty, Oskar, empty. June 2: Wimpje. July 1: two swaps."""
+        shift = _members_schedule(session)
+        for shift_date, new_user in [
+                (datetime(2016, 6, 1), None), (datetime(2016, 6, 1), 1),
+                (datetime(2016, 7, 1), 1), (datetime(2016, 6, 2), 2),
+                (datetime(2016, 6, 1), None), (datetime(2016, 7, 1), 2)]:
+            api.add_mutation(session, 1, 1, shift.shift_id, shift_date,
+                             new_user)
+        session.commit()
+        return shift
+
+    def test_keeps_latest_of_past_dates(self):
+        with DummyDB() as session:
+            shift = self._fill(session)
+            covers = api.list_covers(session, 1, *JUNE).value
+            archived = api.compact_mutations(
+                session, datetime(2016, 6, 15), batch_size=2)
+            assert_equals(archived, 2)
+            assert_equals(session.query(ArchivedMutation).count(), 2)
+            # July 1 is not past yet, so both its mutations stay.
+            assert_equals(sorted(
+                mutation.mutation_id for mutation in session.query(Mutation)),
+                [3, 4, 5, 6])
+            assert_equals(api.list_covers(session, 1, *JUNE).value, covers)
+            assert_equals(api.list_open_shifts(
+                session, 1, *JUNE).value[0].mutation_id, 5)
+            # Nothing left to do.
+            assert_equals(api.compact_mutations(
+                session, datetime(2016, 6, 15)), 0)
+
+    def test_accepts_request_context(self):
+        with DummyDB() as session:
+            self._fill(session)
+            context = api.RequestContext(session)
+            assert_equals(api.compact_mutations(
+                context, datetime(2016, 6, 15)), 2)
+            archived_at = session.query(ArchivedMutation).first().archived_at
+            assert_equals(archived_at.tzinfo, None)
+
+    def test_history_stays_queryable(self):
+        with DummyDB() as session:
+            shift = self._fill(session)
+            api.compact_mutations(session, datetime(2016, 8, 1))
+            history = api.list_mutation_history(
+                session, shift.shift_id, datetime(2016, 6, 1)).value
+            assert_equals([mutation.mutation_id for mutation in history],
+                          [1, 2, 5])
+            assert_equals([mutation.new_user_id for mutation in history],
+                          [None, 1, None])
+            assert_equals(api.list_mutation_history(
+                session, 99, datetime(2016, 6, 1)).errors[0].code,
+                'no-shift-with-id')
+
+    def test_delete_shift_removes_archive(self):
+        with DummyDB() as session:
+            shift = self._fill(session)
+            api.compact_mutations(session, datetime(2016, 8, 1))
+            api.delete_shift(session, shift.shift_id)
+            session.commit()
+            assert_equals(session.query(ArchivedMutation).count(), 0)
@@ -0,0 +1,158 @@
+"""Tests for the schedule snapshot cache."""
+# pylint: disable=missing-docstring
+from datetime import datetime, timedelta
+
+from nose.tools import assert_equals, assert_false, assert_in, assert_true
+
+from rabbot import api
+from rabbot.dummydb import QueryCounter, group_database
+from rabbot.models import Schedule
+
+DAY = datetime(2016, 3, 7)
+
+
+def _fixture(**options):
+    """Session factory and cache of group 1, with 2 shifts and 2 members."""
+    factory = group_database([('Evening', 1), ('Morning', 0)],
+                             users=(1, 2, 3), members=(1, 2))
+    return factory, api.ScheduleCache(factory, **options)
+
+
+def test_cold_lookup_costs_one_query_warm_none():
+    factory, cache = _fixture()
+    try:
+        with QueryCounter(factory()) as counter:
+            snapshot = cache.get(1).value
+        assert_equals(counter.count, 1)
+        assert_equals([shift.name for shift in snapshot.shifts],
+                      ['Morning', 'Evening'])
+        assert_equals(sorted(m.telegram_user_id for m in snapshot.members),
+                      [1, 2])
+        assert_true(snapshot.has_member(2))
+        assert_equals(snapshot.shift_by_name('Evening').ordering, 1)
+        with QueryCounter(factory()) as counter:
+            assert_true(cache.get(1).value is snapshot)
+        assert_equals(counter.count, 0)
+        assert_equals((cache.hits, cache.misses), (1, 1))
+        assert_in('rabbot_schedule_cache_hits_total 1\n', cache.prometheus())
+    finally:
+        cache.close()
+
+
+def test_request_context_reads_from_cache():
+    factory, cache = _fixture()
+    try:
+        cache.get(1)
+        session = factory()
+        with QueryCounter(session) as counter:
+            context = api.RequestContext(session, cache)
+            days = list(api.iter_shifts(context, 1, DAY,
+                                        DAY + timedelta(days=1)).value)
+            shifts = api.list_shifts(context, 1).value
+            assert_true(api.list_open_shifts(
+                context, 1, DAY, DAY + timedelta(days=1)).success)
+        # The mutations and the roster; the schedule and its shifts
+        # come from the cache.
+        assert_equals(counter.count, 2)
+        assert_equals([shift.name for _, shift, _ in days],
+                      ['Morning', 'Evening'])
+        assert_equals([shift.name for shift in shifts], ['Morning', 'Evening'])
+        # The test engine has one connection; the cache's session needs it.
+        session.rollback()
+        missing = api.iter_shifts(api.RequestContext(session, cache), 2, DAY,
+                                  DAY + timedelta(days=1))
+        assert_equals([error.code for error in missing.errors],
+                      ['no-schedule-with-telegram-group-id'])
+        session.close()
+    finally:
+        cache.close()
+
+
+def test_context_prefers_its_own_schedule():
+    factory, cache = _fixture()
+    try:
+        cache.get(1)
+        session = factory()
+        context = api.RequestContext(session, cache)
+        api.add_shift(context, 1, 'Night', 2)
+        # Not committed, so not in the cache, but this context sees it.
+        assert_equals([shift.name for _, shift, _ in api.iter_shifts(
+            context, 1, DAY, DAY + timedelta(days=1)).value],
+                      ['Morning', 'Evening', 'Night'])
+        session.close()
+    finally:
+        cache.close()
+
+
+def test_unknown_group_is_not_cached():
+    _, cache = _fixture()
+    try:
+        result = cache.get(2)
+        assert_false(result.success)
+        assert_equals(result.errors[0].code,
+                      'no-schedule-with-telegram-group-id')
+        assert_equals(len(cache), 0)
+    finally:
+        cache.close()
+
+
+def test_changes_invalidate_after_commit():
+    factory, cache = _fixture()
+    try:
+        schedule_id = cache.get(1).value.schedule_id
+        session = factory()
+        shift_id = cache.get(1).value.shift_by_name('Evening').shift_id
+        changes = [
+            lambda: api.add_shift(session, 1, 'Night', 2),
+            lambda: api.edit_shift(session, shift_id, 'Late', 1),
+            lambda: api.delete_shift(session, shift_id),
+            lambda: api.add_user_to_schedule(session, 3, 1),
+        ]
+        for change in changes:
+            before = cache.get(1).value
+            assert_true(change().success)
+            # Nothing happens before the commit, nor after a rollback.
+            assert_true(cache.get(1).value is before)
+            session.commit()
+            assert_false(cache.get(1).value is before)
+        assert_equals([shift.name for shift in cache.get(1).value.shifts],
+                      ['Morning', 'Night'])
+        assert_true(cache.get(1).value.has_member(3))
+        api.delete_schedule(session, schedule_id)
+        session.commit()
+        assert_false(cache.get(1).success)
+        session.close()
+    finally:
+        cache.close()
+
+
+def test_rollback_does_not_invalidate():
+    factory, cache = _fixture()
+    try:
+        before = cache.get(1).value
+        session = factory()
+        api.add_shift(session, 1, 'Night', 2)
+        session.rollback()
+        session.close()
+        assert_true(cache.get(1).value is before)
+    finally:
+        cache.close()
+
+
+def test_capacity_and_ttl():
+    now = [0]
+    factory, cache = _fixture(capacity=1, ttl=10, clock=lambda: now[0])
+    try:
+        session = factory()
+        session.add(Schedule(telegram_group_id=2))
+        session.commit()
+        session.close()
+        first = cache.get(1).value
+        cache.get(2)
+        assert_equals(len(cache), 1)
+        assert_false(cache.get(1).value is first)
+        second = cache.get(1).value
+        now[0] = 11
+        assert_false(cache.get(1).value is second)
+    finally:
+        cache.close()
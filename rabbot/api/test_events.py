@@ -0,0 +1,146 @@
+"""Tests for the mutation event log and roster snapshots."""
+# pylint: disable=missing-docstring
+from datetime import datetime, timedelta
+
+from nose.tools import assert_equals, assert_true
+
+from rabbot import api
+from rabbot.api import events
+from rabbot.dummydb import DummyDB, QueryCounter
+from rabbot.models import MutationEvent, RosterSnapshot, Schedule, Shift, User
+
+EPOCH = datetime(2016, 3, 1)
+
+
+class _Clock(object):
+    """Advances an hour every time it is read."""
+
+    def __init__(self):
+        self.now = EPOCH
+
+    def __call__(self):
+        self.now += timedelta(hours=1)
+        return self.now
+
+
+def _with_log(test):
+    """Run test(session, clock) with a fake clock and snapshots every 3."""
+    def run():
+        clock, interval = events.clock, events.SNAPSHOT_INTERVAL
+        events.clock, events.SNAPSHOT_INTERVAL = _Clock(), 3
+        try:
+            with DummyDB() as session:
+                users = [User(telegram_user_id=i) for i in (1, 2)]
+                schedule = Schedule(telegram_group_id=1, users=users)
+                session.add_all(users + [
+                    schedule, Shift(schedule=schedule, name='a'),
+                    Shift(schedule=schedule, name='b')])
+                session.flush()
+                test(session, events.clock)
+        finally:
+            events.clock, events.SNAPSHOT_INTERVAL = clock, interval
+    run.__name__ = test.__name__
+    return run
+
+
+# (shift_id, shift_date, new telegram user) per mutation, in order.
+MUTATIONS = [(1, datetime(2016, 3, 1 + i % 3), [None, 1, 2][i % 3])
+             for i in range(10)] + [(2, datetime(2016, 3, 1), 2)]
+
+
+def _replayed(session, moment):
+    """The roster at moment by brute force over the whole log."""
+    state = {}
+    for event in session.query(MutationEvent).\
+            filter(MutationEvent.recorded_at <= moment).\
+            order_by(MutationEvent.sequence):
+        state[(event.shift_id, event.shift_date)] = (
+            event.new_user_id, event.sequence)
+    return state
+
+
+@_with_log
+def test_events_and_snapshots(session, clock):
+    for shift_id, shift_date, new_user in MUTATIONS:
+        api.add_mutation(session, 1, 1, shift_id, shift_date, new_user)
+    logged = session.query(MutationEvent).order_by(MutationEvent.sequence)
+    assert_equals([event.sequence for event in logged], list(range(1, 12)))
+    assert_true(all(earlier.recorded_at < later.recorded_at
+                    for earlier, later in zip(logged, logged[1:])))
+    assert_equals([snapshot.sequence for snapshot in session.query(
+        RosterSnapshot).order_by(RosterSnapshot.sequence)], [3, 6, 9])
+
+
+@_with_log
+def test_roster_at_matches_full_replay(session, clock):
+    for shift_id, shift_date, new_user in MUTATIONS:
+        api.add_mutation(session, 1, 1, shift_id, shift_date, new_user)
+    moment = EPOCH
+    while moment < clock.now + timedelta(hours=2):
+        session.expunge_all()
+        with QueryCounter(session) as counter:
+            state = api.roster_at(session, 1, moment).value
+        assert_equals(state, _replayed(session, moment))
+        # Schedule and snapshot, plus at most 3 events.
+        assert_true(counter.loaded <= 2 + 3)
+        moment += timedelta(minutes=30)
+
+
+@_with_log
+def test_cover_at(session, clock):
+    api.add_mutation(session, 1, 1, 1, datetime(2016, 3, 15), None)
+    opened = clock.now
+    api.add_mutation(session, 1, 2, 1, datetime(2016, 3, 15), 2)
+    event = api.cover_at(session, 1, 1, datetime(2016, 3, 15), opened).value
+    assert_equals((event.new_user_id, event.mutator_id), (None, 1))
+    event = api.cover_at(session, 1, 1, datetime(2016, 3, 15),
+                         clock.now).value
+    assert_equals((event.new_user_id, event.mutator_id), (2, 2))
+    assert_equals(api.cover_at(session, 1, 2, datetime(2016, 3, 15),
+                               clock.now).value, None)
+    assert_equals(api.cover_at(session, 1, 1, datetime(2016, 3, 15),
+                               EPOCH).value, None)
+
+
+@_with_log
+def test_backfill(session, clock):
+    for shift_id, shift_date, new_user in MUTATIONS[:4]:
+        api.add_mutation(session, 1, 1, shift_id, shift_date, new_user)
+    session.query(RosterSnapshot).delete()
+    session.query(MutationEvent).filter(MutationEvent.sequence > 1).delete()
+    assert_equals(events.backfill(session), 3)
+    assert_equals(events.backfill(session), 0)
+    assert_equals(session.query(MutationEvent).count(), 4)
+
+
+@_with_log
+def test_backfill_after_live_events(session, clock):
+    day = datetime(2016, 3, 1)
+    api.add_mutation(session, 1, 1, 1, day, 2)
+    api.add_mutation(session, 1, 1, 1, day, 1)
+    # The first mutation predates the log; the second was logged live.
+    session.query(MutationEvent).filter(MutationEvent.sequence == 1).delete()
+    assert_equals(events.backfill(session), 0)
+    assert_equals(session.query(MutationEvent).count(), 1)
+    cover = api.get_cover(session, 1, day).value
+    assert_equals(cover.new_user.telegram_user_id, 1)
+    assert_equals(api.roster_at(session, 1, clock.now).value[(1, day)][0],
+                  cover.new_user_id)
+
+
+@_with_log
+def test_backfill_includes_archive(session, clock):
+    for shift_id, shift_date, new_user in MUTATIONS:
+        api.add_mutation(session, 1, 1, shift_id, shift_date, new_user)
+    session.commit()
+    assert_equals(api.compact_mutations(session, datetime(2016, 4, 1)), 7)
+    session.query(RosterSnapshot).delete()
+    session.query(MutationEvent).delete()
+    assert_equals(events.backfill(session, datetime(2000, 1, 1)), 11)
+    assert_equals([event.mutation_id for event in session.query(
+        MutationEvent).order_by(MutationEvent.sequence)], list(range(1, 12)))
+    # Every moment after the backfill stamp sees the final roster.
+    state = api.roster_at(session, 1, datetime(2016, 3, 1)).value
+    assert_equals({key: new_user for key, (new_user, _) in state.items()},
+                  {(1, datetime(2016, 3, 1)): None, (1, datetime(2016, 3, 2)): 1,
+                   (1, datetime(2016, 3, 3)): 2, (2, datetime(2016, 3, 1)): 2})
@@ -1,4 +1,6 @@
-from nose.tools import assert_equals
+from datetime import datetime
+
+from nose.tools import assert_equals, assert_false, assert_true
 
 from . import helpers
 
@@ -29,3 +31,46 @@ class Test_validate_shift_name():
     def test_empty_str(self):
         result = helpers.validate_shift_name("")
         assert_equals(result.success, False)
+
+
+class Test_validate_date_range():
+
+    def test_valid_data(self):
+        start, end = datetime(2016, 6, 1), datetime(2016, 6, 8)
+        result = helpers.validate_date_range(start, end)
+        assert_equals(result.success, True)
+        assert_equals(result.value, (start, end))
+
+    def test_non_datetime(self):
+        result = helpers.validate_date_range("June 1", datetime(2016, 6, 8))
+        assert_equals(result.success, False)
+
+    def test_end_before_start(self):
+        result = helpers.validate_date_range(
+            datetime(2016, 6, 8), datetime(2016, 6, 1))
+        assert_equals(result.success, False)
+
+
+class Test_result():
+
+    def test_results_without_errors_share_one_tuple(self):
+        assert_equals(helpers.Result().errors, ())
+        assert_true(helpers.Result().errors is helpers.Result().errors)
+
+    def test_errors_merge(self):
+        result = helpers.Result(errors=[1])
+        assert_equals(result.errors + helpers.Result().errors, (1,))
+
+    def test_validator_errors_are_api_errors(self):
+        error = helpers.validate_ordering("first").errors[0]
+        assert_equals(error.code, 'shift-ordering-is-not-an-int')
+        assert_equals(error.message,
+                      "Ordering should be an integer and not 'first'")
+        assert_equals(str(error), error.message)
+        error = helpers.validate_recurrence("someday").errors[0]
+        assert_equals(error.code, 'invalid-recurrence')
+
+    def test_no_instance_dicts(self):
+        assert_false(hasattr(helpers.Result(), '__dict__'))
+        assert_false(hasattr(
+            helpers.validate_shift_name("").errors[0], '__dict__'))
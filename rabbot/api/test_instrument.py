@@ -0,0 +1,90 @@
+"""Tests for API call instrumentation."""
+# pylint: disable=missing-docstring
+import logging
+from datetime import datetime
+
+from nose.tools import assert_equals, assert_in, assert_not_in, assert_true
+
+from rabbot import api
+from rabbot.api import instrument
+from rabbot.dummydb import DummyDB
+from rabbot.models import Schedule
+
+
+class _Capture(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _add_shift():
+    with DummyDB() as session:
+        session.add(Schedule(telegram_group_id=1))
+        session.commit()
+        api.add_shift(session, 1, 'Evening', 0)
+
+
+def test_disabled_records_nothing():
+    instrument.reset()
+    _add_shift()
+    assert_equals(instrument.STATS, {})
+
+
+def test_records_time_statements_and_rows():
+    instrument.reset()
+    instrument.enable()
+    try:
+        _add_shift()
+    finally:
+        instrument.disable()
+    stats = instrument.STATS['add_shift']
+    assert_equals(stats.calls, 1)
+    # Schedule, collision check, insert.
+    assert_equals(stats.statements, 3)
+    assert_equals(stats.rows, 1)
+    assert_true(stats.seconds > 0)
+    # add_shift calls get_shift_by_name, which is counted on its own too.
+    assert_equals(instrument.STATS['get_shift_by_name'].statements, 1)
+    assert_in('rabbot_api_statements_total{function="add_shift"} 3\n',
+              instrument.prometheus())
+    assert_in('add_shift: 1 calls', instrument.summary())
+
+
+def test_slow_calls_are_logged_with_statements():
+    capture = _Capture()
+    instrument.LOGGER.addHandler(capture)
+    instrument.reset()
+    instrument.enable(slow_threshold=0)
+    try:
+        _add_shift()
+    finally:
+        instrument.disable()
+        instrument.LOGGER.removeHandler(capture)
+    assert_equals(instrument.STATS['add_shift'].slow_calls, 1)
+    messages = [record.getMessage() for record in capture.records]
+    assert_true(any('add_shift' in message and 'INSERT INTO shifts' in message
+                    for message in messages))
+
+
+def test_generator_is_measured_when_consumed():
+    instrument.reset()
+    instrument.enable()
+    try:
+        with DummyDB() as session:
+            session.add(Schedule(telegram_group_id=1))
+            session.commit()
+            api.add_shift(session, 1, 'Evening', 0)
+            result = api.iter_shifts(session, 1, datetime(2016, 6, 13),
+                                     datetime(2016, 6, 20))
+            assert_not_in('iter_shifts', instrument.STATS)
+            assert_equals(len(list(result.value)), 7)
+    finally:
+        instrument.disable()
+    stats = instrument.STATS['iter_shifts']
+    assert_equals(stats.calls, 1)
+    # Schedule, then shifts and mutations while the generator was consumed.
+    assert_equals(stats.statements, 3)
@@ -0,0 +1,64 @@
+"""Minimal asynchronous client for the Telegram Bot API.
+
+All requests of one BotAPI share a single aiohttp session, and therefore a
+single connection pool. `base_url` can point at a local stub server for
+tests and benchmarks.
+"""
+import aiohttp
+
+TELEGRAM_URL = 'https://api.telegram.org'
+
+
+class BotAPIError(Exception):
+    """Telegram answered a request with ok=false."""
+
+    def __init__(self, method: str, description: str, error_code=None,
+                 parameters=None):
+        super().__init__("{} failed: {}".format(method, description))
+        self.method = method
+        self.description = description
+        self.error_code = error_code
+        self.parameters = parameters or {}
+
+
+class BotAPI(object):
+
+    """Call Bot API methods for one bot token."""
+
+    def __init__(self, token: str, base_url: str=TELEGRAM_URL,
+                 session: aiohttp.ClientSession=None, connections: int=100):
+        self._url = '{}/bot{}/'.format(base_url.rstrip('/'), token)
+        self._session = session
+        self._owns_session = session is None
+        self._connections = connections
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared aiohttp session, created on first use."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._connections))
+        return self._session
+
+    async def call(self, method: str, **params):
+        """Call `method` and return its result, or raise BotAPIError."""
+        async with self.session.post(self._url + method, json=params) as reply:
+            body = await reply.json()
+        if not body.get('ok'):
+            raise BotAPIError(
+                method, body.get('description', ''),
+                body.get('error_code'), body.get('parameters'))
+        return body['result']
+
+    async def get_updates(self, offset: int=None, timeout: int=30) -> list:
+        """Long poll for updates with update_id >= offset."""
+        params = {'timeout': timeout}
+        if offset is not None:
+            params['offset'] = offset
+        return await self.call('getUpdates', **params)
+
+    async def close(self) -> None:
+        """Close the session if this client created it."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
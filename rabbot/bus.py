@@ -0,0 +1,292 @@
+"""In-process publish/subscribe of shift events, for notifications.
+
+"Jim is looking for someone to cover shift X" is only useful if the group
+hears it right away. add_mutation sends a ShiftEvent through the
+rabbot.api.signals.shift_mutated signal once its transaction commits; a
+Bus hands it to every Subscription on the event loop, from whichever
+thread committed.
+
+Each Subscription has a bounded buffer, so a slow subscriber can not make
+memory grow. When it is full, one of these policies applies:
+
+DROP_OLDEST
+    Forget the oldest event to make room.
+DROP_NEWEST
+    Forget the new event.
+MERGE
+    Events with the same key (by default the shift and date) replace each
+    other, so a shift that is opened and covered again before anyone was
+    told yields a single notification. If all keys differ, the oldest is
+    dropped.
+
+GroupAnnouncer tells the group about every change, DirectNotifier tells
+the members of a group in private when a shift is opened; both send
+through an Outbox.
+
+With several processes (see rabbot.supervisor) the events happen in the
+workers. A BridgeServer in the process that sends notifications accepts
+events as JSON lines on a Unix socket, and a BridgeClient in every worker
+forwards its Bus to it.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from rabbot.api.signals import ShiftEvent, shift_mutated
+
+LOGGER = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+MERGE = 'merge'
+
+
+def shift_key(event: ShiftEvent) -> tuple:
+    """Default MERGE key: the shift and date an event is about."""
+    return (event.shift_id, event.shift_date)
+
+
+class Subscription(object):
+
+    """Bounded buffer of events for one consumer."""
+
+    def __init__(self, maxsize: int=100, policy: str=DROP_OLDEST,
+                 key=shift_key):
+        if policy not in (DROP_OLDEST, DROP_NEWEST, MERGE):
+            raise ValueError("Unknown policy {!r}".format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self._key = key
+        self._events = OrderedDict() if policy == MERGE else deque()
+        self._ready = asyncio.Event()
+        self.received = 0
+        self.dropped = 0
+        self.merged = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, event) -> None:
+        """Buffer an event; call on the event loop."""
+        self.received += 1
+        if self.policy == MERGE:
+            key = self._key(event)
+            if key in self._events:
+                self.merged += 1
+                del self._events[key]
+            elif len(self._events) >= self.maxsize:
+                self.dropped += 1
+                self._events.popitem(last=False)
+            self._events[key] = event
+        elif len(self._events) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            self._events.popleft()
+            self._events.append(event)
+        else:
+            self._events.append(event)
+        self._ready.set()
+
+    async def get(self):
+        """Wait for and return the next event."""
+        while not self._events:
+            self._ready.clear()
+            await self._ready.wait()
+        if self.policy == MERGE:
+            return self._events.popitem(last=False)[1]
+        return self._events.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class Bus(object):
+
+    """Deliver published events to every subscription, on one event loop."""
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._subscriptions = []
+        self._thread = None
+        self.lost = 0
+
+    def start(self) -> None:
+        """Receive shift_mutated on the running event loop."""
+        self._loop = self._loop or asyncio.get_running_loop()
+        self._thread = threading.get_ident()
+        shift_mutated.connect(self.publish)
+
+    def close(self) -> None:
+        """Stop receiving shift_mutated."""
+        shift_mutated.disconnect(self.publish)
+
+    def subscribe(self, maxsize: int=100, policy: str=DROP_OLDEST,
+                  key=shift_key) -> Subscription:
+        """Return a new Subscription to all events published from now."""
+        subscription = Subscription(maxsize, policy, key)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop buffering events for subscription."""
+        self._subscriptions.remove(subscription)
+
+    def publish(self, event) -> None:
+        """Deliver event to every subscription; callable from any thread.
+
+        Events published after the event loop closed are dropped.
+        """
+        if threading.get_ident() == self._thread:
+            self._deliver(event)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, event)
+        except RuntimeError:
+            # The loop is closed; nobody is left to read the event.
+            self.lost += 1
+            LOGGER.warning("Event loop closed, dropping %r", event)
+
+    def _deliver(self, event) -> None:
+        for subscription in self._subscriptions:
+            subscription.put(event)
+
+    def prometheus(self, prefix: str='rabbot_bus') -> str:
+        """Render the subscriptions' counts in the Prometheus text format."""
+        lines = ['{}_subscriptions {}'.format(prefix, len(self._subscriptions)),
+                 '{}_lost_total {}'.format(prefix, self.lost)]
+        for name in ('received', 'dropped', 'merged'):
+            lines.append('{}_{}_total {}'.format(prefix, name, sum(
+                getattr(subscription, name)
+                for subscription in self._subscriptions)))
+        lines.append('{}_buffered {}'.format(
+            prefix, sum(len(subscription)
+                        for subscription in self._subscriptions)))
+        return '\n'.join(lines) + '\n'
+
+
+def describe(event: ShiftEvent) -> str:
+    """One line about an event, for the group."""
+    day = event.shift_date.strftime('%A %B %d')
+    if event.kind == 'opened':
+        return "{} on {} is open. Who can cover it?".format(
+            event.shift_name, day)
+    return "{} on {} is covered.".format(event.shift_name, day)
+
+
+class GroupAnnouncer(object):
+
+    """Post every shift change to its group, merging rapid changes."""
+
+    def __init__(self, bus: Bus, outbox, maxsize: int=1000):
+        self._outbox = outbox
+        self.subscription = bus.subscribe(maxsize, MERGE)
+
+    async def run(self) -> None:
+        """Announce events until cancelled."""
+        async for event in self.subscription:
+            self._outbox.send_message(event.telegram_group_id,
+                                      describe(event))
+
+
+class DirectNotifier(object):
+
+    """Tell the members of a group in private that a shift was opened.
+
+    members(telegram_group_id) returns their telegram_user_ids; it is
+    called on a thread, so it may query the database, for instance
+    through rabbot.api.ScheduleCache.
+    """
+
+    def __init__(self, bus: Bus, outbox, members, maxsize: int=1000):
+        self._outbox = outbox
+        self._members = members
+        self.subscription = bus.subscribe(maxsize, DROP_OLDEST)
+
+    async def run(self) -> None:
+        """Notify until cancelled."""
+        loop = asyncio.get_running_loop()
+        async for event in self.subscription:
+            if event.kind != 'opened':
+                continue
+            members = await loop.run_in_executor(
+                None, self._members, event.telegram_group_id)
+            for member in members:
+                if member != event.mutator:
+                    self._outbox.send_message(member, describe(event))
+
+
+def to_json(event: ShiftEvent) -> str:
+    """Encode an event as one line of JSON."""
+    fields = event._asdict()
+    for name in ('shift_date', 'recorded_at'):
+        if fields[name] is not None:
+            fields[name] = fields[name].isoformat()
+    return json.dumps(fields) + '\n'
+
+
+def from_json(line: str) -> ShiftEvent:
+    """Decode a line written by to_json."""
+    fields = json.loads(line)
+    for name in ('shift_date', 'recorded_at'):
+        if fields[name] is not None:
+            fields[name] = datetime.fromisoformat(fields[name])
+    return ShiftEvent(**fields)
+
+
+class BridgeServer(object):
+
+    """Publish events that BridgeClients send over a Unix socket."""
+
+    def __init__(self, bus: Bus, path: str):
+        self._bus = bus
+        self._path = path
+        self._server = None
+
+    async def start(self) -> None:
+        """Listen on the socket."""
+        self._server = await asyncio.start_unix_server(
+            self._serve, path=self._path)
+
+    async def stop(self) -> None:
+        """Stop listening."""
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    self._bus.publish(from_json(line.decode()))
+                except (ValueError, TypeError):
+                    LOGGER.warning("Ignoring bad bridge line %r", line)
+        finally:
+            writer.close()
+
+
+class BridgeClient(object):
+
+    """Forward the events of a local Bus to a BridgeServer."""
+
+    def __init__(self, bus: Bus, path: str, maxsize: int=1000):
+        self._path = path
+        self.subscription = bus.subscribe(maxsize, DROP_OLDEST)
+
+    async def run(self) -> None:
+        """Forward events until cancelled."""
+        _, writer = await asyncio.open_unix_connection(self._path)
+        try:
+            async for event in self.subscription:
+                writer.write(to_json(event).encode())
+                await writer.drain()
+        finally:
+            writer.close()
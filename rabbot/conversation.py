@@ -0,0 +1,193 @@
+"""Per-(chat, user) conversation state for multi-step Telegram dialogs.
+
+The dialogs sketched in telegram_logic.py ("@rabbot June 15", pick a
+shift, post it) need to remember where each user is. A dialog's state is
+kept as a small record: the state name and a JSON object of what was
+collected so far. Records live in an LRU in memory and are written
+through to the conversations table, so memory stays bounded however many
+dialogs are half-finished and a restart loses nothing. Users who are not
+in a dialog have no row at all, and dialogs left idle for too long are
+expired.
+
+The state machine itself is a single shared `transitions.Machine`; a
+record is attached to it only while a trigger is being fired.
+"""
+import json
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from transitions import Machine, MachineError
+
+from rabbot.models import Conversation, utcnow
+
+IDLE = 'idle'
+STATES = [IDLE, 'choosing_shift', 'confirming']
+TRANSITIONS = [
+    # Jim types "@rabbot June 15" and gets the shifts of that day.
+    {'trigger': 'ask_date', 'source': IDLE, 'dest': 'choosing_shift'},
+    # Jim clicks one of them.
+    {'trigger': 'choose_shift', 'source': 'choosing_shift',
+     'dest': 'confirming'},
+    # Jim posts "Jim is looking for someone to cover shift X".
+    {'trigger': 'confirm', 'source': 'confirming', 'dest': IDLE},
+    {'trigger': 'cancel', 'source': '*', 'dest': IDLE},
+]
+
+
+class ConversationRecord(object):
+
+    """Where one user is in a dialog in one chat."""
+
+    __slots__ = ('chat_id', 'user_id', 'state', 'data', 'updated_at')
+
+    def __init__(self, chat_id, user_id, state=IDLE, data=None,
+                 updated_at=None):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+
+    @property
+    def key(self) -> tuple:
+        """(chat_id, user_id)."""
+        return (self.chat_id, self.user_id)
+
+
+class _Dialog(object):
+    """Model attached to the shared machine while firing one trigger."""
+
+    def __init__(self, state):
+        self.state = state
+
+
+MACHINE = Machine(
+    model=[], states=STATES, transitions=TRANSITIONS, initial=IDLE,
+    auto_transitions=False)
+_MACHINE_LOCK = threading.Lock()
+
+
+def next_state(state: str, trigger: str) -> str:
+    """Return the state `trigger` leads to from `state`.
+
+    Raises MachineError if the trigger is not allowed in that state.
+    """
+    dialog = _Dialog(state)
+    with _MACHINE_LOCK:
+        MACHINE.add_model(dialog, initial=state)
+        try:
+            getattr(dialog, trigger)()
+        except AttributeError:
+            raise MachineError("Unknown trigger {}".format(trigger))
+        finally:
+            MACHINE.remove_model(dialog)
+    return dialog.state
+
+
+class ConversationStore(object):
+
+    """LRU of ConversationRecords, written through to the database."""
+
+    def __init__(self, session_factory, capacity: int=10000,
+                 idle_timeout: timedelta=timedelta(hours=1),
+                 clock=utcnow):
+        self._session_factory = session_factory
+        self._capacity = capacity
+        self._idle_timeout = idle_timeout
+        self._clock = clock
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def _expired(self, record: ConversationRecord) -> bool:
+        return (record.updated_at is not None and
+                record.updated_at < self._clock() - self._idle_timeout)
+
+    def _cache(self, record: ConversationRecord) -> None:
+        with self._lock:
+            self._records[record.key] = record
+            self._records.move_to_end(record.key)
+            while len(self._records) > self._capacity:
+                self._records.popitem(last=False)
+
+    def get(self, chat_id, user_id) -> ConversationRecord:
+        """Return the user's record; a fresh idle one if there is none."""
+        with self._lock:
+            record = self._records.get((chat_id, user_id))
+        if record is None:
+            session = self._session_factory()
+            try:
+                row = session.get(Conversation, (chat_id, user_id))
+                if row is not None:
+                    record = ConversationRecord(
+                        chat_id, user_id, row.state, json.loads(row.data),
+                        row.updated_at)
+            finally:
+                session.close()
+        if record is None or self._expired(record):
+            record = ConversationRecord(chat_id, user_id)
+        self._cache(record)
+        return record
+
+    def save(self, record: ConversationRecord) -> None:
+        """Write the record to the database; idle records are deleted.
+
+        The record is stamped and cached only once the write commits.
+        """
+        updated_at = self._clock()
+        session = self._session_factory()
+        try:
+            row = session.get(Conversation, record.key)
+            if record.state == IDLE:
+                if row is not None:
+                    session.delete(row)
+            else:
+                if row is None:
+                    row = Conversation(
+                        telegram_chat_id=record.chat_id,
+                        telegram_user_id=record.user_id)
+                    session.add(row)
+                row.state = record.state
+                row.data = json.dumps(record.data, separators=(',', ':'))
+                row.updated_at = updated_at
+            session.commit()
+        finally:
+            session.close()
+        record.updated_at = updated_at
+        self._cache(record)
+
+    def fire(self, chat_id, user_id, trigger: str, **data) -> ConversationRecord:
+        """Apply trigger to the user's dialog, merge data in and save.
+
+        Going back to idle forgets the collected data. Raises MachineError
+        if the trigger is not allowed in the current state.
+        """
+        current = self.get(chat_id, user_id)
+        state = next_state(current.state, trigger)
+        # A new record, so the cached one stays as it is if save() fails.
+        record = ConversationRecord(
+            chat_id, user_id, state,
+            {} if state == IDLE else dict(current.data, **data),
+            current.updated_at)
+        self.save(record)
+        return record
+
+    def expire(self) -> int:
+        """Delete dialogs idle for longer than idle_timeout; return count."""
+        cutoff = self._clock() - self._idle_timeout
+        with self._lock:
+            for key in [key for key, record in self._records.items()
+                        if self._expired(record)]:
+                del self._records[key]
+        session = self._session_factory()
+        try:
+            count = session.query(Conversation).\
+                filter(Conversation.updated_at < cutoff).\
+                delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+        return count
@@ -0,0 +1,168 @@
+"""Engines for running rabbot against a real database.
+
+make_engine configures pooling for the kind of database behind the URL:
+
+* PostgreSQL (and other servers) get a QueuePool of `pool_size`
+  connections with pre-ping, so dead connections are replaced.
+* File-backed SQLite gets WAL mode, synchronous=NORMAL and a busy
+  timeout, so readers do not block the writer and a writer waits for
+  another instead of failing at once.
+* In-memory SQLite keeps SQLAlchemy's default pool.
+
+SQLite always gets foreign key enforcement. Every engine carries a
+PoolStats as `engine.pool_stats` with checkout counts, how long callers
+waited for a connection and how long connections were held.
+"""
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def enable_sqlite_foreign_keys(engine) -> None:
+    """Make SQLite enforce foreign keys, and so ON DELETE CASCADE."""
+    if engine.dialect.name == 'sqlite':
+        # pylint: disable=unused-argument
+        @event.listens_for(engine, 'connect')
+        def _foreign_keys_on(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA foreign_keys=ON')
+            cursor.close()
+
+
+class PoolStats(object):
+
+    """Connection pool counters, safe to update from several threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checked_out = 0
+        self.connects = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.held_seconds = 0.0
+        self.max_held_seconds = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        """A caller waited `seconds` for a pooled connection."""
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def record_checkout(self) -> None:
+        """A connection left the pool."""
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+
+    def record_checkin(self, held: float) -> None:
+        """A connection came back after being used for `held` seconds."""
+        with self._lock:
+            self.checked_out -= 1
+            self.held_seconds += held
+            self.max_held_seconds = max(self.max_held_seconds, held)
+
+    def record_connect(self) -> None:
+        """The pool opened a new database connection."""
+        with self._lock:
+            self.connects += 1
+
+    def prometheus(self, prefix: str='rabbot_db_pool') -> str:
+        """Render the counters in the Prometheus text format."""
+        with self._lock:
+            values = [
+                ('checkouts_total', self.checkouts),
+                ('checked_out', self.checked_out),
+                ('connects_total', self.connects),
+                ('wait_seconds_total', self.wait_seconds),
+                ('wait_seconds_max', self.max_wait_seconds),
+                ('held_seconds_total', self.held_seconds),
+                ('held_seconds_max', self.max_held_seconds),
+            ]
+        return ''.join('{}_{} {}\n'.format(prefix, name, value)
+                       for name, value in values)
+
+
+class TimedQueuePool(QueuePool):
+
+    """QueuePool that reports how long each checkout waited."""
+
+    stats = None
+    _depth = threading.local()
+
+    def _do_get(self):
+        # QueuePool._do_get can call itself; time only the outer call.
+        depth = getattr(self._depth, 'value', 0)
+        self._depth.value = depth + 1
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self._depth.value = depth
+            if depth == 0 and self.stats is not None:
+                self.stats.record_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def _is_sqlite_file(url) -> bool:
+    return url.get_backend_name() == 'sqlite' and \
+        url.database not in (None, '', ':memory:') and \
+        not url.database.startswith('file::memory:')
+
+
+def make_engine(url: str='sqlite:///:memory:', echo: bool=False,
+                pool_size: int=5, max_overflow: int=10,
+                pool_timeout: float=30, busy_timeout: int=5000):
+    """Create an engine for url; see the module docstring."""
+    url = make_url(url)
+    options = {'echo': echo}
+    sqlite = url.get_backend_name() == 'sqlite'
+    if not sqlite:
+        options.update(
+            poolclass=TimedQueuePool, pool_size=pool_size,
+            max_overflow=max_overflow, pool_timeout=pool_timeout,
+            pool_pre_ping=True)
+    elif _is_sqlite_file(url):
+        options.update(
+            poolclass=TimedQueuePool, pool_size=pool_size,
+            max_overflow=max_overflow, pool_timeout=pool_timeout,
+            connect_args={'timeout': busy_timeout / 1000,
+                          'check_same_thread': False})
+    engine = create_engine(url, **options)
+    stats = PoolStats()
+    engine.pool_stats = stats
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.stats = stats
+    enable_sqlite_foreign_keys(engine)
+
+    # pylint: disable=unused-argument
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        stats.record_connect()
+        if not _is_sqlite_file(url):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout={:d}'.format(busy_timeout))
+        cursor.close()
+
+    @event.listens_for(engine, 'checkout')
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checked_out_at'] = time.perf_counter()
+        stats.record_checkout()
+
+    @event.listens_for(engine, 'checkin')
+    def _on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop('checked_out_at', None)
+        if started is not None:
+            stats.record_checkin(time.perf_counter() - started)
+
+    return engine
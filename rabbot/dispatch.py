@@ -0,0 +1,102 @@
+"""Dispatch Telegram updates to a bounded pool of workers.
+
+Updates from different chats are handled concurrently; updates from the
+same chat are handled one at a time, in the order they were submitted.
+The handler is a plain blocking function (it talks to the database
+through rabbot.api) and runs on a thread pool, off the event loop.
+"""
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+
+def chat_key(update: dict):
+    """Return the ID whose updates must be handled in order."""
+    for kind in ('message', 'edited_message', 'channel_post',
+                 'edited_channel_post'):
+        if kind in update:
+            return update[kind]['chat']['id']
+    if 'callback_query' in update:
+        query = update['callback_query']
+        if 'message' in query:
+            return query['message']['chat']['id']
+        return query['from']['id']
+    for kind in ('inline_query', 'chosen_inline_result'):
+        if kind in update:
+            return update[kind]['from']['id']
+    return update.get('update_id')
+
+
+class Dispatcher(object):
+
+    """Run `handler(update)` for submitted updates, in order per chat."""
+
+    def __init__(self, handler, workers: int=8, max_pending: int=1000,
+                 executor=None):
+        self._handler = handler
+        self._workers = workers
+        self._slots = asyncio.Semaphore(max_pending)
+        self._executor = executor or ThreadPoolExecutor(workers)
+        # Chats with unhandled updates, in the order they became ready.
+        self._ready = asyncio.Queue()
+        self._pending = {}
+        self._tasks = []
+        self.handled = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of submitted updates that have not been handled yet."""
+        return sum(len(updates) for updates in self._pending.values())
+
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop."""
+        self._tasks = [asyncio.ensure_future(self._work())
+                       for _ in range(self._workers)]
+
+    async def submit(self, update: dict) -> None:
+        """Queue an update, waiting while max_pending updates are queued."""
+        await self._slots.acquire()
+        key = chat_key(update)
+        if key in self._pending:
+            self._pending[key].append(update)
+        else:
+            self._pending[key] = deque([update])
+            self._ready.put_nowait(key)
+
+    async def join(self) -> None:
+        """Wait until every submitted update has been handled."""
+        await self._ready.join()
+
+    async def stop(self) -> None:
+        """Handle what is queued, then stop the workers."""
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            key = await self._ready.get()
+            updates = self._pending[key]
+            # This worker owns the chat until its queue is empty, so no
+            # other worker can overtake an earlier update of the chat.
+            while updates:
+                update = updates[0]
+                try:
+                    await loop.run_in_executor(
+                        self._executor, self._handler, update)
+                    self.handled += 1
+                # pylint: disable=broad-except
+                except Exception:
+                    self.failed += 1
+                    LOGGER.exception("Handler failed for update %r", update)
+                updates.popleft()
+                self._slots.release()
+            del self._pending[key]
+            self._ready.task_done()
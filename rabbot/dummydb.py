@@ -1,36 +1,213 @@
-"""Empty database context manager to simplify testing."""
-from sqlalchemy import create_engine
+"""Empty database context manager to simplify testing.
+
+The schema is created once per process, in an in-memory template database.
+DummyDB sessions share one connection to a copy of it and every with-block
+runs in a transaction that is rolled back at the end, so each block starts
+from empty tables; integer ids start at 1 again. A block opened while
+another one is still active (nested, or on another thread) gets a private
+copy instead. Nothing is shared between processes, so tests can run in
+parallel.
+
+The transaction and SAVEPOINT statements that isolate a block go straight
+to the sqlite3 connection, so statement listeners (QueryCounter,
+rabbot.api.instrument) see what they would see on a regular database.
+"""
+import sqlite3
+import threading
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
+from rabbot.database import enable_sqlite_foreign_keys
 # pylint: disable=wildcard-import,unused-wildcard-import
 from rabbot.models import *
 
+_TEMPLATE = None
+_TRANSACTION_CONTROL = ('BEGIN', 'SAVEPOINT', 'RELEASE', 'ROLLBACK')
+_SHARED_ENGINE = None
+# Held while a DummyDB uses the shared engine.
+_SHARED_LOCK = threading.Lock()
+
+
+def _template():
+    """Return the in-memory database holding the empty schema."""
+    # pylint: disable=global-statement
+    global _TEMPLATE
+    if _TEMPLATE is None:
+        engine = create_engine(
+            'sqlite://', poolclass=StaticPool,
+            creator=lambda: sqlite3.connect(':memory:',
+                                            check_same_thread=False))
+        BASE.metadata.create_all(engine)
+        _TEMPLATE = engine.raw_connection().driver_connection
+    return _TEMPLATE
+
+
+def _copy_of_template():
+    """Connect to a new in-memory database with the schema, see backup()."""
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    _template().backup(connection)
+    return connection
+
+
+def make_test_engine(debug=False):
+    """Return an engine on a private in-memory copy of the empty schema.
+
+    BEGIN is emitted on every SQLAlchemy transaction, not left to the
+    sqlite3 module, so SAVEPOINTs nest inside the transaction that
+    isolates a test.
+    """
+    engine = create_engine('sqlite://', echo=debug, poolclass=StaticPool,
+                           creator=_copy_of_template)
+    enable_sqlite_foreign_keys(engine)
+
+    # pylint: disable=unused-argument
+    @event.listens_for(engine, 'connect')
+    def _no_implicit_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _begin(connection):
+        _driver(connection).execute('BEGIN')
+
+    dialect = engine.dialect
+    dialect.do_savepoint = lambda connection, name: \
+        _driver(connection).execute('SAVEPOINT "{}"'.format(name))
+    dialect.do_release_savepoint = lambda connection, name: \
+        _driver(connection).execute('RELEASE SAVEPOINT "{}"'.format(name))
+    dialect.do_rollback_to_savepoint = lambda connection, name: \
+        _driver(connection).execute('ROLLBACK TO SAVEPOINT "{}"'.format(name))
+    return engine
+
+
+def _driver(connection) -> sqlite3.Connection:
+    return connection.connection.driver_connection
+
+
+def _shared_engine():
+    # pylint: disable=global-statement
+    global _SHARED_ENGINE
+    if _SHARED_ENGINE is None:
+        _SHARED_ENGINE = make_test_engine()
+    return _SHARED_ENGINE
+
+
+def group_database(shifts=(), users=(), members=None, engine=None,
+                   user_name=str) -> sessionmaker:
+    """Return a session factory for a database with Telegram group 1.
+
+    users are the telegram_user_ids of users to create, with the same
+    user_id and named user_name(telegram_user_id); members are those that
+    belong to the group's schedule, by default all of them. shifts are
+    (name, ordering) pairs, which recur daily. The engine defaults to
+    make_test_engine(); pass one for a database that several threads use
+    at once.
+    """
+    engine = engine or make_test_engine()
+    BASE.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    created = {telegram_user_id: User(
+        user_id=telegram_user_id, telegram_user_id=telegram_user_id,
+        name=user_name(telegram_user_id)) for telegram_user_id in users}
+    schedule = Schedule(telegram_group_id=1, users=[
+        created[telegram_user_id] for telegram_user_id in
+        (users if members is None else members)])
+    session.add_all(list(created.values()) + [schedule] + [
+        Shift(schedule=schedule, name=name, ordering=ordering)
+        for name, ordering in shifts])
+    session.commit()
+    session.close()
+    return factory
+
+
 # pylint: disable=too-few-public-methods,missing-docstring
 class DummyDB(object):
 
-    """Provide a temporary, totally empty, database in RAM."""
+    """Provide a temporary, totally empty, database in RAM.
+
+    With debug=True the statements are echoed; such a DummyDB gets its own
+    engine so the shared one stays quiet.
+    """
 
     def __init__(self, debug=False):
-        """Create database, BASE metadata and sessionfactory."""
-        # Normally Session is not a valid name, but sessionmaker is
-        # a generator, so it will actually house a class definition.
-        # pylint: disable=invalid-name
-        self._Session = sessionmaker()
-        self._engine = create_engine('sqlite:///:memory:', echo=debug)
-        self._Session.configure(bind=self._engine)
-        BASE.metadata.create_all(self._engine)
+        """Prepare; the schema already exists."""
+        self._debug = debug
+        self._engine = None
+        self._shared = False
+        self._connection = None
+        self._transaction = None
         self._session = None
 
     def __enter__(self):
-        """Return a fresh session."""
-        self._session = self._Session()
+        """Return a fresh session inside a transaction of its own."""
+        # The shared engine has one connection; another block using it
+        # would BEGIN inside our transaction.
+        self._shared = not self._debug and _SHARED_LOCK.acquire(blocking=False)
+        self._engine = _shared_engine() if self._shared else \
+            make_test_engine(self._debug)
+        self._connection = self._engine.connect()
+        self._transaction = self._connection.begin()
+        # Session.commit() releases a SAVEPOINT, the transaction stays open.
+        self._session = sessionmaker(
+            bind=self._connection,
+            join_transaction_mode='create_savepoint')()
         return self._session
 
     def __exit__(self, e_type, e_value, traceback):
-        """Commit or rollback and cleanup."""
-        if e_type is not None:
-            # Exception occured
-            self._session.rollback()
-        else:
-            self._session.commit()
-        self._session.close()
+        """Commit or rollback the session, then undo everything."""
+        try:
+            if e_type is not None:
+                # Exception occured
+                self._session.rollback()
+            else:
+                self._session.commit()
+        finally:
+            self._session.close()
+            self._transaction.rollback()
+            self._connection.close()
+            if self._shared:
+                _SHARED_LOCK.release()
+            else:
+                self._engine.dispose()
+
+
+class QueryCounter(object):
+
+    """Count SQL statements and loaded objects of a session in a with-block.
+
+    Transaction control (BEGIN, SAVEPOINT, RELEASE, ROLLBACK) is not counted.
+    """
+
+    def __init__(self, session):
+        """Prepare to listen on the session and the engine it is bound to."""
+        self._session = session
+        self._engine = session.get_bind()
+        self.statements = []
+        self.loaded = 0
+
+    @property
+    def count(self):
+        """Number of statements executed so far."""
+        return len(self.statements)
+
+    # pylint: disable=unused-argument,too-many-arguments
+    def _on_execute(self, conn, cursor, statement, parameters, context,
+                    executemany):
+        if not statement.startswith(_TRANSACTION_CONTROL):
+            self.statements.append(statement)
+
+    def _on_load(self, session, instance):
+        self.loaded += 1
+
+    def __enter__(self):
+        """Start counting."""
+        event.listen(self._engine, 'before_cursor_execute', self._on_execute)
+        event.listen(self._session, 'loaded_as_persistent', self._on_load)
+        return self
+
+    def __exit__(self, e_type, e_value, traceback):
+        """Stop counting."""
+        event.remove(self._engine, 'before_cursor_execute', self._on_execute)
+        event.remove(self._session, 'loaded_as_persistent', self._on_load)
@@ -0,0 +1,273 @@
+"""Answer inline queries ("@rabbot June 15", "@rabbot open") quickly.
+
+Telegram sends an inline query on every keystroke, so answering must not
+cost a database query each time. Per schedule, shift names are kept in a
+sorted array that is searched by prefix with bisect; every word of a name
+is a key, so "eve" finds "Sunday evening". Date phrases for the coming
+days ("june 15", "15 jun", "tomorrow", "friday") are kept in one shared
+sorted array. Answers are cached per (schedule, query text).
+
+The schedules each Telegram user belongs to are cached as well, so a
+warm answer costs no query at all.
+
+The index of a schedule is dropped when its shifts change, through the
+rabbot.api.signals.shifts_changed signal; the users' schedules when
+members are added or a schedule is deleted (members_changed,
+schedule_deleted).
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+
+from rabbot.api.signals import members_changed, schedule_deleted, \
+    shifts_changed
+from rabbot.models import Shift, User, association_table
+
+MONTHS = ('january', 'february', 'march', 'april', 'may', 'june', 'july',
+          'august', 'september', 'october', 'november', 'december')
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+            'saturday', 'sunday')
+KEYWORDS = ('open', 'mutations')
+
+# kind is 'keyword', 'date' or 'shift'; value is the keyword, a date or a
+# shift_id.
+Suggestion = namedtuple('Suggestion', 'kind text value')
+
+
+class PrefixIndex(object):
+
+    """Sorted array of (key, suggestion), searched by key prefix."""
+
+    def __init__(self, entries):
+        self._entries = sorted(entries, key=lambda entry: entry[0])
+        self._keys = [key for key, _ in self._entries]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def search(self, prefix: str, limit: int, deadline: float=None):
+        """Yield up to `limit` distinct suggestions whose key starts with prefix.
+
+        Stops early once time.monotonic() passes deadline.
+        """
+        seen = set()
+        position = bisect_left(self._keys, prefix)
+        while position < len(self._keys) and len(seen) < limit:
+            key, suggestion = self._entries[position]
+            if not key.startswith(prefix):
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            if suggestion not in seen:
+                seen.add(suggestion)
+                yield suggestion
+            position += 1
+
+
+def shift_entries(shifts):
+    """Index entries for (shift_id, name) pairs: one per word of the name."""
+    for shift_id, name in shifts:
+        suggestion = Suggestion('shift', name, shift_id)
+        words = name.lower().split()
+        for start in range(len(words)):
+            yield ' '.join(words[start:]), suggestion
+
+
+def date_entries(today: date, horizon: int):
+    """Index entries for the dates from today up to horizon days ahead."""
+    for offset in range(horizon):
+        day = today + timedelta(days=offset)
+        month = MONTHS[day.month - 1]
+        suggestion = Suggestion('date', '{} {}'.format(
+            month.capitalize(), day.day), day)
+        for key in ('{} {}'.format(month, day.day),
+                    '{} {}'.format(month[:3], day.day),
+                    '{} {}'.format(day.day, month),
+                    '{} {}'.format(day.day, month[:3])):
+            yield key, suggestion
+        if offset < 7:
+            yield WEEKDAYS[day.weekday()], suggestion
+        if offset == 0:
+            yield 'today', suggestion
+        elif offset == 1:
+            yield 'tomorrow', suggestion
+
+
+class InlineIndex(object):
+
+    """Prefix indexes and answer cache for inline queries."""
+
+    def __init__(self, session_factory, max_results: int=50,
+                 budget: float=0.05, cache_size: int=10000,
+                 horizon: int=60, today=date.today):
+        self._session_factory = session_factory
+        self._max_results = max_results
+        self._budget = budget
+        self._cache_size = cache_size
+        self._horizon = horizon
+        self._today = today
+        self._keywords = PrefixIndex(
+            (keyword, Suggestion('keyword', keyword, keyword))
+            for keyword in KEYWORDS)
+        self._dates = None
+        self._dates_built_for = None
+        self._shifts = {}
+        # telegram_user_id -> schedule IDs, least recently used first.
+        self._schedules = OrderedDict()
+        self._answers = OrderedDict()
+        # Bumped on every invalidation, so a build or answer that raced
+        # with one is not stored; see rabbot.api.cache.
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        shifts_changed.connect(self.invalidate)
+        members_changed.connect(self.invalidate_members)
+        schedule_deleted.connect(self.invalidate_members)
+
+    def close(self) -> None:
+        """Stop listening for shift and membership changes."""
+        shifts_changed.disconnect(self.invalidate)
+        members_changed.disconnect(self.invalidate_members)
+        schedule_deleted.disconnect(self.invalidate_members)
+
+    def invalidate(self, schedule_id) -> None:
+        """Forget the shift index and cached answers of a schedule."""
+        with self._lock:
+            self._generation += 1
+            self._shifts.pop(schedule_id, None)
+            for key in [key for key in self._answers
+                        if key[0] == schedule_id]:
+                del self._answers[key]
+
+    def invalidate_members(self, schedule_id) -> None:
+        """Forget which schedules users belong to.
+
+        The signals do not say which user joined, so this forgets all.
+        """
+        with self._lock:
+            self._generation += 1
+            self._schedules.clear()
+
+    def schedules_of(self, telegram_user_id) -> tuple:
+        """Return the IDs of the schedules a Telegram user belongs to."""
+        with self._lock:
+            schedule_ids = self._schedules.get(telegram_user_id)
+            if schedule_ids is not None:
+                self._schedules.move_to_end(telegram_user_id)
+                return schedule_ids
+            generation = self._generation
+        session = self._session_factory()
+        try:
+            schedule_ids = tuple(schedule_id for schedule_id, in session.query(
+                association_table.c.schedule_id).
+                join(User, User.user_id == association_table.c.user_id).
+                filter(User.telegram_user_id == telegram_user_id).
+                order_by(association_table.c.schedule_id))
+        finally:
+            session.close()
+        with self._lock:
+            if generation == self._generation:
+                self._schedules[telegram_user_id] = schedule_ids
+                if len(self._schedules) > self._cache_size:
+                    self._schedules.popitem(last=False)
+        return schedule_ids
+
+    def _date_index(self) -> PrefixIndex:
+        today = self._today()
+        if self._dates_built_for != today:
+            self._dates = PrefixIndex(date_entries(today, self._horizon))
+            self._dates_built_for = today
+            with self._lock:
+                self._answers.clear()
+        return self._dates
+
+    def _shift_index(self, schedule_id, generation: int) -> PrefixIndex:
+        with self._lock:
+            index = self._shifts.get(schedule_id)
+        if index is not None:
+            return index
+        session = self._session_factory()
+        try:
+            rows = session.query(Shift.shift_id, Shift.name).\
+                filter(Shift.schedule_id == schedule_id).\
+                filter(Shift.name.isnot(None)).all()
+        finally:
+            session.close()
+        index = PrefixIndex(shift_entries(rows))
+        with self._lock:
+            if generation == self._generation:
+                self._shifts[schedule_id] = index
+        return index
+
+    def answer(self, schedule_id, query: str) -> list:
+        """Return suggestions for the query text of an inline query."""
+        prefix = ' '.join(query.lower().split())
+        dates = self._date_index()
+        key = (schedule_id, prefix)
+        with self._lock:
+            if key in self._answers:
+                self.hits += 1
+                self._answers.move_to_end(key)
+                return self._answers[key]
+            self.misses += 1
+            generation = self._generation
+        # The budget is for searching; building an index is a one-off.
+        shifts = self._shift_index(schedule_id, generation)
+        deadline = time.monotonic() + self._budget
+        suggestions = []
+        for index in (self._keywords, dates, shifts):
+            suggestions.extend(index.search(
+                prefix, self._max_results - len(suggestions), deadline))
+        if time.monotonic() > deadline:
+            # Out of time: the answer may be incomplete, don't cache it.
+            return suggestions
+        with self._lock:
+            if generation != self._generation:
+                return suggestions
+            self._answers[key] = suggestions
+            if len(self._answers) > self._cache_size:
+                self._answers.popitem(last=False)
+        return suggestions
+
+
+def to_inline_results(suggestions) -> list:
+    """Convert suggestions to InlineQueryResultArticle dicts.
+
+    Telegram rejects answers with duplicate result ids, so only the first
+    suggestion with a given id is kept.
+    """
+    results = []
+    seen = set()
+    for number, suggestion in enumerate(suggestions):
+        value = suggestion.value
+        if isinstance(value, date):
+            value = value.isoformat()
+        result_id = '{}:{}'.format(suggestion.kind, value)[:64] or str(number)
+        if result_id in seen:
+            continue
+        seen.add(result_id)
+        results.append({
+            'type': 'article',
+            'id': result_id,
+            'title': suggestion.text,
+            'input_message_content': {'message_text': suggestion.text},
+        })
+    return results
+
+
+def answer_inline_query(index: InlineIndex, inline_query: dict,
+                        max_results: int=50) -> dict:
+    """Return answerInlineQuery parameters for a Telegram inline query.
+
+    Inline queries carry no chat, so suggestions come from every schedule
+    the querying user belongs to. Dates and keywords are suggested for
+    each of them, but answered once.
+    """
+    suggestions = []
+    for schedule_id in index.schedules_of(inline_query['from']['id']):
+        suggestions.extend(index.answer(schedule_id, inline_query['query']))
+    return {'inline_query_id': inline_query['id'],
+            'results': to_inline_results(suggestions)[:max_results]}
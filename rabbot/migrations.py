@@ -0,0 +1,92 @@
+"""Bring existing databases up to date with the models.
+
+`BASE.metadata.create_all` only creates tables that do not exist yet, so a
+database created by an older version of rabbot never receives columns and
+indexes that were added to the models later. `upgrade` fills that gap.
+
+Usage:
+
+    python -m rabbot.migrations sqlite:///path/to/rabbot.db
+"""
+import sys
+
+from sqlalchemy import inspect, select, func, text
+
+from rabbot.database import make_engine
+from rabbot.models import BASE
+
+
+class MigrationError(Exception):
+    """The database cannot be upgraded without manual intervention."""
+
+
+def _duplicates(connection, index) -> int:
+    """Count groups of rows that would violate a unique index."""
+    columns = list(index.columns)
+    groups = select(*columns).\
+        where(*[column.isnot(None) for column in columns]).\
+        group_by(*columns).\
+        having(func.count() > 1).\
+        subquery()
+    return connection.execute(
+        select(func.count()).select_from(groups)).scalar()
+
+
+def _add_column(connection, column) -> None:
+    """Add a nullable column to an existing table."""
+    if not column.nullable:
+        raise MigrationError(
+            "Cannot add NOT NULL column {} to existing rows".format(column))
+    connection.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+        column.table.name, column.name,
+        column.type.compile(dialect=connection.dialect))))
+
+
+def upgrade(engine) -> list:
+    """Create missing tables, columns and indexes; return what was created.
+
+    Created columns are listed as 'table.column', indexes by name. Unique
+    indexes are only created when the existing rows satisfy them; otherwise
+    MigrationError is raised and nothing is changed for that index.
+    """
+    BASE.metadata.create_all(engine)
+    created = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in BASE.metadata.sorted_tables:
+            columns = {
+                column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    _add_column(connection, column)
+                    created.append('{}.{}'.format(table.name, column.name))
+            existing = {
+                index['name'] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name in existing:
+                    continue
+                if index.unique:
+                    count = _duplicates(connection, index)
+                    if count:
+                        raise MigrationError(
+                            "Cannot create unique index {}: {} groups of "
+                            "duplicate rows in {}".format(
+                                index.name, count, table.name))
+                index.create(connection)
+                created.append(index.name)
+    return created
+
+
+def main(argv=None):
+    """Upgrade the database given on the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: python -m rabbot.migrations DATABASE_URL")
+        return 2
+    for name in upgrade(make_engine(argv[0])):
+        print("created {}".format(name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
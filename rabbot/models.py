@@ -1,13 +1,22 @@
 """Database models."""
-from sqlalchemy.schema import Table
+from datetime import datetime, timezone
+
+from sqlalchemy.schema import Table, Index
 from sqlalchemy import ForeignKey, Column, Integer, DateTime, String
-from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
+from rabbot.database import make_engine
+
 SESSION = sessionmaker()
 BASE = declarative_base()
 
+
+def utcnow() -> datetime:
+    """The current time in UTC, naive like the DateTime columns hold it."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 # This is a context manager, it does not need any public methods.
 # pylint: disable=too-few-public-methods
 class SessionScope(object):
@@ -20,11 +29,15 @@ class SessionScope(object):
         return self._session
     def __exit__(self, e_type, e_value, trace):
         """Commit or roll back, then do cleanup."""
-        if e_type is not None:
-            # Exception occured
-            self._session.rollback()
-        else:
-            self._session.commit()
+        try:
+            if e_type is not None:
+                # Exception occured
+                self._session.rollback()
+            else:
+                self._session.commit()
+        finally:
+            # Also when commit or rollback fail, so the connection always
+            # goes back to the pool.
             self._session.close()
 
 
@@ -33,14 +46,21 @@ class SessionScope(object):
 association_table = Table(
     'association',
     BASE.metadata,
-    Column('schedule_id', Integer, ForeignKey('schedules.schedule_id')),
-    Column('user_id', Integer, ForeignKey('users.user_id')))
+    Column('schedule_id', Integer,
+           ForeignKey('schedules.schedule_id', ondelete='CASCADE')),
+    Column('user_id', Integer,
+           ForeignKey('users.user_id', ondelete='CASCADE')),
+    # A user is a member of a schedule at most once; the unique index
+    # doubles as the lookup index for "members of schedule X".
+    Index('ix_association_schedule_user', 'schedule_id', 'user_id',
+          unique=True),
+    Index('ix_association_user_id', 'user_id'))
 
 class User(BASE):
     """Usertable."""
     __tablename__ = 'users'
     user_id = Column(Integer, primary_key=True)
-    telegram_user_id = Column(Integer)
+    telegram_user_id = Column(Integer, index=True, unique=True)
     name = Column(String)
     schedules = relationship(
         "Schedule",
@@ -51,20 +71,30 @@ class Shift(BASE):
     """Shift definitions."""
     __tablename__ = 'shifts'
     shift_id = Column(Integer, primary_key=True)
-    schedule_id = Column(Integer, ForeignKey('schedules.schedule_id'))
+    schedule_id = Column(
+        Integer, ForeignKey('schedules.schedule_id', ondelete='CASCADE'))
     schedule = relationship("Schedule", back_populates="shifts")
     name = Column(String)
     ordering = Column(Integer)
-    mutations = relationship("Mutation", back_populates="shift")
+    # See rabbot.recurrence; None recurs daily.
+    recurrence = Column(String)
+    mutations = relationship(
+        "Mutation", back_populates="shift", passive_deletes=True)
+    __table_args__ = (
+        # get_shift_by_name looks shifts up by (schedule_id, name).
+        Index('ix_shifts_schedule_name', 'schedule_id', 'name', unique=True),
+    )
 
 class Mutation(BASE):
     """Mutations to the regular schedule."""
     __tablename__ = 'mutations'
     mutation_id = Column(Integer, primary_key=True)
-    schedule_id = Column(Integer, ForeignKey('schedules.schedule_id'))
+    schedule_id = Column(
+        Integer, ForeignKey('schedules.schedule_id', ondelete='CASCADE'))
     schedule = relationship("Schedule", back_populates="mutations")
     shift_date = Column(DateTime)
-    shift_id = Column(Integer, ForeignKey('shifts.shift_id'))
+    shift_id = Column(
+        Integer, ForeignKey('shifts.shift_id', ondelete='CASCADE'))
     shift = relationship("Shift", back_populates="mutations")
     mutator_id = Column(Integer, ForeignKey('users.user_id'))
     mutator = relationship(
@@ -76,28 +106,139 @@ class Mutation(BASE):
         "User",
         # back_populates="mutations",
         foreign_keys=[new_user_id])
+    __table_args__ = (
+        Index('ix_mutations_schedule_date', 'schedule_id', 'shift_date'),
+        Index('ix_mutations_shift_date', 'shift_id', 'shift_date'),
+    )
+
+class ArchivedMutation(BASE):
+    """Mutation superseded by a later one for the same shift and date.
+
+    Moved here from mutations by rabbot.api.archive once its date is past,
+    so the mutations table only holds the final word per shift and date.
+    """
+    __tablename__ = 'mutations_archive'
+    mutation_id = Column(Integer, primary_key=True, autoincrement=False)
+    schedule_id = Column(
+        Integer, ForeignKey('schedules.schedule_id', ondelete='CASCADE'))
+    shift_date = Column(DateTime)
+    shift_id = Column(
+        Integer, ForeignKey('shifts.shift_id', ondelete='CASCADE'))
+    mutator_id = Column(Integer, ForeignKey('users.user_id'))
+    new_user_id = Column(Integer, ForeignKey('users.user_id'))
+    archived_at = Column(DateTime)
+    __table_args__ = (
+        Index('ix_mutations_archive_shift_date', 'shift_id', 'shift_date'),
+    )
+
+class MutationEvent(BASE):
+    """Append-only log entry: a mutation as it was made, and when.
+
+    sequence only ever grows, also across deletes. shift_id is not a
+    foreign key: the log keeps what happened even if the shift is gone.
+    See rabbot.api.events.
+    """
+    __tablename__ = 'mutation_events'
+    sequence = Column(Integer, primary_key=True)
+    schedule_id = Column(
+        Integer, ForeignKey('schedules.schedule_id', ondelete='CASCADE'))
+    shift_id = Column(Integer)
+    shift_date = Column(DateTime)
+    mutation_id = Column(Integer)
+    mutator_id = Column(Integer)
+    new_user_id = Column(Integer)
+    recorded_at = Column(DateTime, nullable=False)
+    __table_args__ = (
+        Index('ix_mutation_events_schedule_sequence',
+              'schedule_id', 'sequence'),
+        {'sqlite_autoincrement': True},
+    )
+
+class RosterSnapshot(BASE):
+    """Covers of every mutated shift and date of a schedule, as JSON.
+
+    Reflects the mutation events up to and including `sequence`.
+    """
+    __tablename__ = 'roster_snapshots'
+    snapshot_id = Column(Integer, primary_key=True)
+    schedule_id = Column(
+        Integer, ForeignKey('schedules.schedule_id', ondelete='CASCADE'))
+    sequence = Column(Integer, nullable=False)
+    taken_at = Column(DateTime, nullable=False)
+    data = Column(String, nullable=False)
+    __table_args__ = (
+        Index('ix_roster_snapshots_schedule_sequence',
+              'schedule_id', 'sequence'),
+    )
 
 class Schedule(BASE):
     """Schedule for users and mutations to belong to."""
     __tablename__ = 'schedules'
     schedule_id = Column(Integer, primary_key=True)
-    telegram_group_id = Column(Integer)
+    telegram_group_id = Column(Integer, index=True, unique=True)
     admin_id = Column(Integer, ForeignKey('users.user_id'))
     admin = relationship(
         "User",
         # back_populates="schedules",
         foreign_keys=[admin_id])
-    mutations = relationship("Mutation", back_populates="schedule")
+    mutations = relationship(
+        "Mutation", back_populates="schedule", passive_deletes=True)
     shifts = relationship(
         "Shift",
         back_populates="schedule",
-        order_by="asc(Shift.ordering)")
+        order_by="asc(Shift.ordering)",
+        passive_deletes=True)
     users = relationship(
         "User",
         secondary=association_table,
-        back_populates="schedules")
+        back_populates="schedules",
+        passive_deletes=True)
+
+class RosterEntry(BASE):
+    """Current cover per shift and date, derived from the latest mutation.
+
+    Maintained by rabbot.api.add_mutation; rabbot.api.roster can rebuild
+    it from the mutations table.
+    """
+    __tablename__ = 'roster'
+    schedule_id = Column(
+        Integer, ForeignKey('schedules.schedule_id', ondelete='CASCADE'),
+        primary_key=True)
+    shift_date = Column(DateTime, primary_key=True)
+    shift_id = Column(
+        Integer, ForeignKey('shifts.shift_id', ondelete='CASCADE'),
+        primary_key=True)
+    shift = relationship("Shift")
+    mutation_id = Column(
+        Integer, ForeignKey('mutations.mutation_id', ondelete='CASCADE'))
+    mutation = relationship("Mutation")
+    new_user_id = Column(Integer, ForeignKey('users.user_id'))
+    new_user = relationship("User")
+    __table_args__ = (
+        # "My shifts" looks up by user first.
+        Index('ix_roster_user_date', 'new_user_id', 'shift_date'),
+    )
+
+class Conversation(BASE):
+    """Unfinished Telegram dialog of one user in one chat.
+
+    See rabbot.conversation; users without a row are not in a dialog.
+    """
+    __tablename__ = 'conversations'
+    telegram_chat_id = Column(Integer, primary_key=True)
+    telegram_user_id = Column(Integer, primary_key=True)
+    state = Column(String, nullable=False)
+    # Small JSON object with whatever the dialog collected so far.
+    data = Column(String, nullable=False, default='{}')
+    updated_at = Column(DateTime, nullable=False, index=True)
+
+def init_db(url='sqlite:///:memory:', **engine_options):
+    """Bind SESSION to a new engine for url and create missing tables.
 
-def init_db():
-    engine = create_engine('sqlite:///:memory:', echo=True)
+    engine_options are passed on to rabbot.database.make_engine. Returns
+    the engine; its pool_stats show how busy the connection pool is.
+    """
+    engine = make_engine(url, **engine_options)
     SESSION.configure(bind=engine)
     BASE.metadata.create_all(engine)
+    return engine
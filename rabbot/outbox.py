@@ -0,0 +1,284 @@
+"""Rate-limited, coalescing queue for outgoing Telegram messages.
+
+Telegram limits how fast a bot may send: roughly one message per second
+per chat and thirty per second overall. Calls queued on the Outbox are
+started by one background task that waits for a token from both the
+chat's bucket and the global bucket before every call. Calls of different
+chats are in flight at the same time, so a slow answer for one chat does
+not hold up the others; calls of one chat are sent one after the other,
+in order. When Telegram answers 429 anyway, only that chat waits for the
+Retry-After period. Several edits of the same message that are still
+waiting are coalesced into the last one. All calls go through one BotAPI,
+and so through one HTTP connection pool.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from rabbot.bot_api import BotAPIError
+
+LOGGER = logging.getLogger(__name__)
+
+EDIT_METHODS = frozenset([
+    'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'])
+
+
+class TokenBucket(object):
+
+    """Allow `rate` events per second, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float=1.0, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available; 0 if one is available now."""
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        """Consume a token; call only when delay() is 0."""
+        self._refill()
+        self._tokens -= 1
+
+
+class OutboxMetrics(object):
+
+    """Counters and latencies of an Outbox."""
+
+    def __init__(self, keep: int=10000):
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.retried = 0
+        # Seconds from queueing to Telegram's answer, most recent last;
+        # only the last `keep`.
+        self.latencies = deque(maxlen=keep)
+
+    def record_latency(self, seconds: float) -> None:
+        """Remember a send latency."""
+        self.latencies.append(seconds)
+
+
+class _Call(object):
+
+    __slots__ = ('method', 'params', 'future', 'queued')
+
+    def __init__(self, method, params, future, queued):
+        self.method = method
+        self.params = params
+        self.future = future
+        self.queued = queued
+
+
+class Outbox(object):
+
+    """Send Bot API calls in order, within per-chat and global limits."""
+
+    def __init__(self, bot_api, global_rate: float=30.0,
+                 chat_rate: float=1.0, chat_burst: float=3.0,
+                 clock=time.monotonic):
+        self._bot_api = bot_api
+        self._global = TokenBucket(global_rate, global_rate, clock)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._clock = clock
+        self._chats = {}
+        # Queued calls by key; edits of one message share a key.
+        self._queue = OrderedDict()
+        self._sequence = 0
+        # Chats with a call in flight, and delivery tasks.
+        self._busy = set()
+        self._in_flight = set()
+        # chat_id -> clock() before which Telegram asked us not to send.
+        self._retry_at = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.metrics = OutboxMetrics()
+
+    @property
+    def depth(self) -> int:
+        """Number of calls waiting to be sent."""
+        return len(self._queue)
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        if chat_id not in self._chats:
+            self._chats[chat_id] = TokenBucket(
+                self._chat_rate, self._chat_burst, self._clock)
+        return self._chats[chat_id]
+
+    def send(self, method: str, **params) -> asyncio.Future:
+        """Queue a Bot API call; the future resolves to its result.
+
+        If an edit of the same message is still queued, it is replaced by
+        this one and resolves with this one's result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if method in EDIT_METHODS and 'message_id' in params:
+            key = (method, params.get('chat_id'), params['message_id'])
+            previous = self._queue.get(key)
+            if previous is not None:
+                self.metrics.coalesced += 1
+                # Chain so both callers learn the outcome of the last edit.
+                future.add_done_callback(
+                    lambda done, old=previous.future: _copy_outcome(done, old))
+                previous.params = params
+                previous.future = future
+                return future
+        else:
+            self._sequence += 1
+            key = self._sequence
+        self._queue[key] = _Call(method, params, future, self._clock())
+        self._wakeup.set()
+        return future
+
+    def send_message(self, chat_id, text: str, **params) -> asyncio.Future:
+        """Queue sendMessage."""
+        return self.send('sendMessage', chat_id=chat_id, text=text, **params)
+
+    def edit_message_text(self, chat_id, message_id, text: str,
+                          **params) -> asyncio.Future:
+        """Queue editMessageText; pending edits of the message coalesce."""
+        return self.send('editMessageText', chat_id=chat_id,
+                         message_id=message_id, text=text, **params)
+
+    def start(self) -> None:
+        """Start sending on the running event loop."""
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """Send what is queued, then stop; a no-op if never started."""
+        if self._task is None:
+            return
+        while self._queue or self._in_flight:
+            await asyncio.sleep(0.01)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def _next_ready(self):
+        """Return (key, delay) of the first call whose chat may send soonest.
+
+        Calls of one chat are sent in order; a chat that has to wait, or
+        still has a call in flight, does not hold up other chats. None if
+        every queued call waits for a call in flight.
+        """
+        best = None
+        seen_chats = set()
+        now = self._clock()
+        for key, call in self._queue.items():
+            chat_id = call.params.get('chat_id')
+            if chat_id in seen_chats or chat_id in self._busy:
+                continue
+            seen_chats.add(chat_id)
+            delay = max(self._bucket(chat_id).delay(),
+                        self._retry_at.get(chat_id, now) - now)
+            if best is None or delay < best[1]:
+                best = (key, delay)
+                if delay == 0:
+                    break
+        return best
+
+    async def _run(self) -> None:
+        while True:
+            ready = self._next_ready()
+            if ready is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            key, delay = ready
+            delay = max(delay, self._global.delay())
+            if delay > 0:
+                # Also wake up for new calls, which may be ready sooner.
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            call = self._queue.pop(key)
+            chat_id = call.params.get('chat_id')
+            self._retry_at.pop(chat_id, None)
+            self._bucket(chat_id).take()
+            self._global.take()
+            self._busy.add(chat_id)
+            task = asyncio.ensure_future(self._deliver(key, call))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _deliver(self, key, call) -> None:
+        chat_id = call.params.get('chat_id')
+        try:
+            result = await self._bot_api.call(call.method, **call.params)
+        except BotAPIError as error:
+            retry_after = error.parameters.get('retry_after')
+            if error.error_code == 429 and retry_after:
+                # Telegram says we are too fast for this chat after all:
+                # queue the call again in front, and hold the chat back.
+                self.metrics.retried += 1
+                newer = self._queue.get(key)
+                if newer is None:
+                    self._queue[key] = call
+                else:
+                    # A later edit of the message was queued meanwhile;
+                    # send that one and let both callers learn its outcome.
+                    self.metrics.coalesced += 1
+                    newer.future.add_done_callback(
+                        lambda done, old=call.future: _copy_outcome(done, old))
+                self._queue.move_to_end(key, last=False)
+                self._retry_at[chat_id] = self._clock() + retry_after
+                return
+            self.metrics.failed += 1
+            call.future.set_exception(error)
+        # pylint: disable=broad-except
+        except Exception as error:
+            self.metrics.failed += 1
+            call.future.set_exception(error)
+        else:
+            self.metrics.sent += 1
+            self.metrics.record_latency(self._clock() - call.queued)
+            call.future.set_result(result)
+        finally:
+            self._busy.discard(chat_id)
+            self._wakeup.set()
+
+    def prometheus(self, prefix: str='rabbot_outbox') -> str:
+        """Render the metrics in the Prometheus text format."""
+        latencies = sorted(self.metrics.latencies)
+        lines = [
+            '{}_queue_depth {}'.format(prefix, self.depth),
+            '{}_sent_total {}'.format(prefix, self.metrics.sent),
+            '{}_failed_total {}'.format(prefix, self.metrics.failed),
+            '{}_coalesced_total {}'.format(prefix, self.metrics.coalesced),
+            '{}_retried_total {}'.format(prefix, self.metrics.retried),
+        ]
+        for quantile in (0.5, 0.99):
+            value = latencies[int(quantile * (len(latencies) - 1))] \
+                if latencies else 0
+            lines.append('{}_send_latency_seconds{{quantile="{}"}} {}'.format(
+                prefix, quantile, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _copy_outcome(source: asyncio.Future, target: asyncio.Future) -> None:
+    """Resolve target like source, unless it was resolved already."""
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
@@ -0,0 +1,29 @@
+"""Fetch updates by long polling and feed them to a Dispatcher."""
+import asyncio
+import logging
+
+import aiohttp
+
+from rabbot.bot_api import BotAPIError
+
+LOGGER = logging.getLogger(__name__)
+
+
+async def poll(bot_api, dispatcher, timeout: int=30, retry_delay: float=1.0,
+               stop: asyncio.Event=None) -> None:
+    """Submit every update to dispatcher until `stop` is set.
+
+    Submitting waits while the dispatcher is full, so a slow handler slows
+    down polling instead of piling up updates in memory.
+    """
+    offset = None
+    while stop is None or not stop.is_set():
+        try:
+            updates = await bot_api.get_updates(offset, timeout)
+        except (aiohttp.ClientError, BotAPIError) as error:
+            LOGGER.warning("getUpdates failed: %s", error)
+            await asyncio.sleep(retry_delay)
+            continue
+        for update in updates:
+            await dispatcher.submit(update)
+            offset = update['update_id'] + 1
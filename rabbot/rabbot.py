@@ -1,20 +1,99 @@
+import argparse
+import asyncio
 from pprint import pprint as pprint
-import telepot
 
+from rabbot.api import instrument
+from rabbot.bot_api import BotAPI
+from rabbot.dispatch import Dispatcher
+from rabbot.models import init_db
+from rabbot.polling import poll
+from rabbot.replay import Recording
+from rabbot.supervisor import Supervisor
+from rabbot.webhook import WebhookReceiver
 
-with open('token.txt') as tokenfile:
-    token = tokenfile.readline().strip()
 
+def handle(msg):
+    pprint(msg)
 
-bot = telepot.Bot(token)
 
+async def run_polling(bot_api, dispatcher):
+    await bot_api.call('deleteWebhook')
+    await poll(bot_api, dispatcher)
+
+
+async def run_webhook(bot_api, dispatcher, url, host, port, secret_token):
+    receiver = WebhookReceiver(dispatcher, secret_token=secret_token)
+    await receiver.start(host, port)
+    params = {'url': url}
+    if secret_token is not None:
+        params['secret_token'] = secret_token
+    await bot_api.call('setWebhook', **params)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await receiver.stop()
+
+
+async def log_stats(interval):
+    while True:
+        await asyncio.sleep(interval)
+        instrument.log_summary()
+
+
+async def run(token, args):
+    init_db(args.database, pool_size=args.pool_size)
+    if args.stats_interval:
+        instrument.enable(slow_threshold=args.slow_call)
+        asyncio.ensure_future(log_stats(args.stats_interval))
+    bot_api = BotAPI(token)
+    handler = handle
+    if args.record:
+        handler = Recording(handle, args.record)
+    if args.workers > 1:
+        dispatcher = Supervisor(handler, workers=args.workers,
+                                database_url=args.database)
+    else:
+        dispatcher = Dispatcher(handler)
+    dispatcher.start()
+    try:
+        if args.webhook_url:
+            await run_webhook(bot_api, dispatcher, args.webhook_url,
+                              args.host, args.port, args.secret_token)
+        else:
+            await run_polling(bot_api, dispatcher)
+    finally:
+        await dispatcher.stop()
+        await bot_api.close()
 
-def handle(msg):
-    pprint(msg)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the rabbot bot.")
+    parser.add_argument('--database', default='sqlite:///rabbot.db',
+                        help="SQLAlchemy database URL")
+    parser.add_argument('--pool-size', type=int, default=5,
+                        help="database connections to keep open")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes; updates are sharded by chat")
+    parser.add_argument('--record', metavar='FILE',
+                        help="append every update to FILE, see rabbot.replay")
+    parser.add_argument('--stats-interval', type=float,
+                        help="log API call statistics every this many seconds")
+    parser.add_argument('--slow-call', type=float, default=0.5,
+                        help="log API calls slower than this many seconds")
+    parser.add_argument(
+        '--webhook-url',
+        help="receive updates on this public URL instead of long polling")
+    parser.add_argument('--host', default='0.0.0.0',
+                        help="address the webhook server listens on")
+    parser.add_argument('--port', type=int, default=8443,
+                        help="port the webhook server listens on")
+    parser.add_argument('--secret-token',
+                        help="secret Telegram must send with every update")
+    return parser.parse_args(argv)
 
-bot.message_loop(handle)
 
-# What to do, what to do?
-#
-# * user says '@Bot open'
+if __name__ == '__main__':
+    ARGS = parse_args()
+    with open('token.txt') as tokenfile:
+        token = tokenfile.readline().strip()
+    asyncio.run(run(token, ARGS))
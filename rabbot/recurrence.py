@@ -0,0 +1,81 @@
+"""Recurrence rules for shifts, expanded lazily.
+
+A rule is either 'daily' or a comma separated list of weekday
+abbreviations, such as 'mon,wed,fri'. Shifts without a rule recur daily.
+
+Everything here works on iterators: expanding a rule over a window of any
+width, and merging the occurrences with a stream of mutations, holds only
+the current day in memory.
+"""
+from datetime import datetime, time, timedelta
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAILY = 'daily'
+
+
+def parse_rule(rule) -> frozenset:
+    """Return the weekday numbers (Monday is 0) a rule recurs on.
+
+    Raises ValueError for rules that cannot be parsed.
+    """
+    if rule is None or rule == DAILY:
+        return frozenset(range(7))
+    if not isinstance(rule, str):
+        raise ValueError("Recurrence rule must be a string")
+    days = [day.strip().lower() for day in rule.split(',')]
+    unknown = [day for day in days if day not in WEEKDAYS]
+    if unknown or not days:
+        raise ValueError("Unknown weekdays in recurrence rule: {}".format(
+            ', '.join(unknown)))
+    return frozenset(WEEKDAYS.index(day) for day in days)
+
+
+def days(start: datetime, end: datetime):
+    """Yield the midnights of every day in [start, end)."""
+    day = datetime.combine(start.date(), time())
+    if day < start:
+        day += timedelta(days=1)
+    while day < end:
+        yield day
+        day += timedelta(days=1)
+
+
+def _order(shift) -> tuple:
+    """Sort key for shifts within one day."""
+    return (shift.ordering or 0, shift.shift_id)
+
+
+def occurrences(shifts, start: datetime, end: datetime):
+    """Yield (day, shift) for every occurrence of shifts in [start, end).
+
+    Occurrences come in order of day, then shift ordering.
+    """
+    rules = [(shift, parse_rule(shift.recurrence))
+             for shift in sorted(shifts, key=_order)]
+    for day in days(start, end):
+        weekday = day.weekday()
+        for shift, weekdays in rules:
+            if weekday in weekdays:
+                yield day, shift
+
+
+def with_mutations(occurrence_stream, mutations):
+    """Yield (day, shift, mutation) for every occurrence.
+
+    `mutations` must be sorted by shift date, shift ordering and mutation
+    ID, in that order, like the occurrences, and their shift dates must be
+    midnights, as rabbot.api.add_mutation stores them. Mutation is the
+    latest mutation of that shift on that day, or None. Mutations for days
+    on which their shift does not recur are skipped.
+    """
+    mutations = iter(mutations)
+    pending = next(mutations, None)
+    for day, shift in occurrence_stream:
+        key = (day, _order(shift))
+        latest = None
+        while pending is not None and \
+                (pending.shift_date, _order(pending.shift)) <= key:
+            if (pending.shift_date, _order(pending.shift)) == key:
+                latest = pending
+            pending = next(mutations, None)
+        yield day, shift, latest
@@ -0,0 +1,406 @@
+"""Record Telegram updates and replay them through the whole bot.
+
+Load-testing against Telegram itself is not an option, so updates are
+recorded to a JSON Lines file (one raw update dict per line) and replayed
+against a local StubBotAPI: the stub serves them to rabbot.polling, the
+Dispatcher hands them to a handler that works through rabbot.api on a real
+database, and replies go back to the stub with sendMessage.
+
+    python -m rabbot.replay generate updates.jsonl --updates 10000
+    python -m rabbot.replay run updates.jsonl sqlite:///rabbot.db --rate 200
+
+`rabbot.py --record FILE` records what the live bot receives. `generate`
+writes synthetic updates for a database filled by benchmarks/generators.py,
+where telegram IDs equal row IDs. `run` replays at a fixed rate, or as fast
+as possible without --rate, and reports updates per second, a latency
+histogram per stage and the peak resident set size:
+
+queue
+    From offering the update to the stub until a handler starts on it.
+handler
+    The handler: parsing, rabbot.api calls and the commit.
+db
+    Time spent executing SQL statements, per update.
+reply
+    The sendMessage round trip to the stub.
+total
+    From offering the update until its reply was answered.
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from rabbot import api
+from rabbot.bot_api import BotAPI
+from rabbot.dispatch import Dispatcher
+from rabbot.models import SESSION, init_db
+from rabbot.polling import poll
+from rabbot.stub_bot_api import StubBotAPI
+
+STAGES = ['queue', 'handler', 'db', 'reply', 'total']
+
+
+class Recording(object):
+
+    """Handler that appends every update to a JSONL file, then handles it.
+
+    Each update is one write to a file opened for appending, so worker
+    threads and processes can share the file. Picklable if the handler
+    is, for rabbot.supervisor.
+    """
+
+    def __init__(self, handler, path: str):
+        self._handler = handler
+        self._path = path
+
+    def __call__(self, update):
+        line = json.dumps(update, sort_keys=True) + '\n'
+        with open(self._path, 'a') as record_file:
+            record_file.write(line)
+        return self._handler(update)
+
+
+def load(path: str) -> list:
+    """Read the updates of a JSONL file."""
+    with open(path) as update_file:
+        return [json.loads(line) for line in update_file if line.strip()]
+
+
+def generate(count: int, groups: int=10, members: int=20, shifts: int=5,
+             start: datetime=datetime(2016, 1, 1), days: int=365,
+             seed: int=1):
+    """Yield synthetic command updates for a generated database.
+
+    Matches benchmarks/generators.py: group g has telegram_group_id g,
+    members (g-1)*members+1 and up, and shifts numbered from
+    (g-1)*shifts+1.
+    """
+    rng = random.Random(seed)
+    for update_id in range(1, count + 1):
+        group = rng.randint(1, groups)
+        user = (group - 1) * members + rng.randint(1, members)
+        day = (start + timedelta(days=rng.randrange(days))).date()
+        shift = (group - 1) * shifts + rng.randint(1, shifts)
+        command = rng.choices([
+            '/week {}'.format(day), '/open {}'.format(day), '/shifts',
+            '/cover {} {}'.format(shift, day),
+            '/drop {} {}'.format(shift, day)],
+            weights=[40, 20, 15, 15, 10])[0]
+        yield {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'text': command,
+            'chat': {'id': group, 'type': 'group'},
+            'from': {'id': user, 'is_bot': False, 'first_name': str(user)}}}
+
+
+class CommandHandler(object):
+
+    """Answer a few roster commands through rabbot.api.
+
+    Calling it with an update returns the text to reply, or None. With a
+    rabbot.api.ScheduleCache, commands that only read take the group's
+    schedule from it.
+    """
+
+    def __init__(self, session_factory=SESSION, cache=None):
+        self._session_factory = session_factory
+        self._cache = cache
+
+    def __call__(self, update: dict):
+        message = update.get('message') or {}
+        words = message.get('text', '').split()
+        if not words or not words[0].startswith('/'):
+            return None
+        command = getattr(self, '_' + words[0][1:].split('@')[0], None)
+        if command is None:
+            return None
+        session = self._session_factory()
+        try:
+            reply = command(
+                api.RequestContext(session, self._cache),
+                message['chat']['id'], message['from']['id'], words[1:])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return reply
+
+    @staticmethod
+    def _week(context, group, user, args):
+        start = _day(args, 0)
+        result = api.iter_shifts(context, group, start,
+                                 start + timedelta(days=7))
+        if not result.success:
+            return _errors(result)
+        lines = []
+        for day, shift, mutation in result.value:
+            if mutation is None:
+                cover = 'as planned'
+            elif mutation.new_user is None:
+                cover = 'open'
+            else:
+                cover = mutation.new_user.name or 'someone'
+            lines.append('{} {}: {}'.format(day.date(), shift.name, cover))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _open(context, group, user, args):
+        start = _day(args, 0)
+        result = api.list_open_shifts(context, group, start,
+                                      start + timedelta(days=7))
+        if not result.success:
+            return _errors(result)
+        return '\n'.join('{} {}'.format(entry.shift_date.date(),
+                                        entry.shift.name)
+                         for entry in result.value) or 'No open shifts.'
+
+    @staticmethod
+    def _shifts(context, group, user, args):
+        result = api.list_shifts(context, group)
+        if not result.success:
+            return _errors(result)
+        return '\n'.join(shift.name for shift in result.value)
+
+    @staticmethod
+    def _cover(context, group, user, args, new_user=True):
+        try:
+            shift_id = int(args[0])
+        except (IndexError, ValueError):
+            return 'Which shift?'
+        result = api.add_mutation(context, group, user, shift_id,
+                                  _day(args, 1),
+                                  user if new_user else None)
+        return result.message if result.success else _errors(result)
+
+    @classmethod
+    def _drop(cls, context, group, user, args):
+        return cls._cover(context, group, user, args, new_user=False)
+
+
+def _day(args, index: int) -> datetime:
+    try:
+        return datetime.strptime(args[index], '%Y-%m-%d')
+    except (IndexError, ValueError):
+        return datetime.combine(datetime.today(), datetime.min.time())
+
+
+def _errors(result) -> str:
+    return '\n'.join(str(error) for error in result.errors)
+
+
+class Histogram(object):
+
+    """Latencies in power-of-two millisecond buckets."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, seconds: float) -> None:
+        """Record one latency."""
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """Latency in seconds below which `fraction` of the samples are."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def buckets(self) -> list:
+        """[(upper bound in ms, count)] for the non-empty buckets."""
+        counts = {}
+        for seconds in self.samples:
+            bound = 0.125
+            while bound < seconds * 1e3:
+                bound *= 2
+            counts[bound] = counts.get(bound, 0) + 1
+        return sorted(counts.items())
+
+    def render(self, width: int=40) -> str:
+        """Text histogram, one line per bucket."""
+        buckets = self.buckets()
+        most = max((count for _, count in buckets), default=1)
+        return ''.join('  <={:>9.3f}ms {:>7} {}\n'.format(
+            bound, count, '#' * max(1, count * width // most))
+                       for bound, count in buckets)
+
+
+class Report(object):
+
+    """Throughput, per-stage latencies and peak RSS of one replay."""
+
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.updates = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.peak_rss_kb = 0
+
+    @property
+    def rate(self) -> float:
+        """Updates handled per second."""
+        return self.updates / self.seconds if self.seconds else 0.0
+
+    def render(self) -> str:
+        """The report as text."""
+        lines = ["{} updates in {:.2f}s: {:.1f} updates/s, {} failed, "
+                 "peak RSS {:.1f} MiB".format(
+                     self.updates, self.seconds, self.rate, self.failed,
+                     self.peak_rss_kb / 1024)]
+        for stage in STAGES:
+            histogram = self.stages[stage]
+            lines.append("{}: p50 {:.3f}ms p95 {:.3f}ms p99 {:.3f}ms".format(
+                stage, histogram.percentile(0.5) * 1e3,
+                histogram.percentile(0.95) * 1e3,
+                histogram.percentile(0.99) * 1e3))
+            lines.append(histogram.render().rstrip('\n'))
+        return '\n'.join(lines) + '\n'
+
+
+class _StatementTimer(object):
+
+    """Add up the time of SQL statements per thread."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._local = threading.local()
+
+    # pylint: disable=unused-argument,too-many-arguments
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self._local.started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self._local.seconds = getattr(self._local, 'seconds', 0.0) + \
+            time.perf_counter() - self._local.started
+
+    def take(self) -> float:
+        """Statement time on this thread since the last take()."""
+        seconds = getattr(self._local, 'seconds', 0.0)
+        self._local.seconds = 0.0
+        return seconds
+
+    def __enter__(self):
+        event.listen(self._engine, 'before_cursor_execute', self._before)
+        event.listen(self._engine, 'after_cursor_execute', self._after)
+        return self
+
+    def __exit__(self, e_type, e_value, traceback):
+        event.remove(self._engine, 'before_cursor_execute', self._before)
+        event.remove(self._engine, 'after_cursor_execute', self._after)
+
+
+async def replay(updates: list, handler, engine, rate: float=None,
+                 workers: int=8) -> Report:
+    """Replay updates through a stub Bot API, polling and the Dispatcher.
+
+    handler(update) returns the text to send back, or None. Updates are
+    offered to the stub `rate` per second, or all at once.
+    """
+    loop = asyncio.get_running_loop()
+    report = Report()
+    offered = {}
+    done = asyncio.Event()
+    remaining = [len(updates)]
+    stub = StubBotAPI()
+    bot_api = BotAPI('replay', await stub.start())
+
+    def finished():
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    def timed(update):
+        started = time.perf_counter()
+        report.stages['queue'].add(started - offered[update['update_id']])
+        timer.take()
+        try:
+            text = handler(update)
+        except Exception:
+            report.failed += 1
+            raise
+        finally:
+            report.stages['handler'].add(time.perf_counter() - started)
+            report.stages['db'].add(timer.take())
+            loop.call_soon_threadsafe(finished)
+        if text:
+            replied = time.perf_counter()
+            asyncio.run_coroutine_threadsafe(bot_api.call(
+                'sendMessage', chat_id=update['message']['chat']['id'],
+                text=text), loop).result()
+            report.stages['reply'].add(time.perf_counter() - replied)
+        report.stages['total'].add(
+            time.perf_counter() - offered[update['update_id']])
+
+    with _StatementTimer(engine) as timer:
+        dispatcher = Dispatcher(timed, workers=workers)
+        dispatcher.start()
+        stop = asyncio.Event()
+        poller = asyncio.ensure_future(poll(bot_api, dispatcher, timeout=1,
+                                            stop=stop))
+        started = time.perf_counter()
+        for number, update in enumerate(updates):
+            if rate:
+                delay = started + number / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            offered[update['update_id']] = time.perf_counter()
+            stub.add_updates([update])
+        if updates:
+            await done.wait()
+        await dispatcher.join()
+        report.seconds = time.perf_counter() - started
+        stop.set()
+        await poller
+        await dispatcher.stop()
+    await bot_api.close()
+    await stub.stop()
+    report.updates = len(updates)
+    report.peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+def main(argv=None):
+    """Generate or replay updates, see the module documentation."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser(
+        'generate', help="write synthetic updates")
+    generate_parser.add_argument('file')
+    generate_parser.add_argument('--updates', type=int, default=10000)
+    generate_parser.add_argument('--groups', type=int, default=10)
+    generate_parser.add_argument('--members', type=int, default=20)
+    generate_parser.add_argument('--shifts', type=int, default=5)
+    run_parser = commands.add_parser('run', help="replay updates")
+    run_parser.add_argument('file')
+    run_parser.add_argument('database', help="SQLAlchemy database URL")
+    run_parser.add_argument('--rate', type=float,
+                            help="updates per second; default: flat out")
+    run_parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        with open(args.file, 'w') as update_file:
+            for update in generate(args.updates, args.groups, args.members,
+                                   args.shifts):
+                update_file.write(json.dumps(update) + '\n')
+        return 0
+    engine = init_db(args.database, pool_size=args.workers)
+    handler = CommandHandler(cache=api.ScheduleCache(SESSION))
+    report = asyncio.run(replay(load(args.file), handler, engine,
+                                args.rate, args.workers))
+    print(report.render(), end='')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
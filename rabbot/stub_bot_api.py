@@ -0,0 +1,86 @@
+"""Local stand-in for the Telegram Bot API, for tests and benchmarks.
+
+Serves getUpdates from an in-memory list and answers every other method
+with a plausible result, or with a queued error, recording each call it
+receives.
+"""
+import asyncio
+import itertools
+
+from aiohttp import web
+
+
+class StubBotAPI(object):
+
+    """aiohttp server speaking just enough of the Bot API."""
+
+    def __init__(self, updates=(), latency: float=0.0):
+        self.updates = list(updates)
+        self.latency = latency
+        self.calls = []
+        # (error_code, description, parameters) answers to give, in order,
+        # to the next calls other than getUpdates.
+        self.errors = []
+        self.url = None
+        self._arrived = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    def add_updates(self, updates) -> None:
+        """Make updates available to getUpdates."""
+        self.updates.extend(updates)
+        self._arrived.set()
+
+    def calls_to(self, method: str) -> list:
+        """Parameters of every received call of `method`."""
+        return [params for name, params in self.calls if name == method]
+
+    async def start(self, host: str='127.0.0.1', port: int=0) -> str:
+        """Start serving; return the base URL to give to BotAPI."""
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = 'http://{}:{}'.format(host, port)
+        return self.url
+
+    async def stop(self) -> None:
+        """Stop serving."""
+        await self._runner.cleanup()
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = await request.json() if request.can_read_body else {}
+        self.calls.append((method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == 'getUpdates':
+            result = await self._get_updates(params)
+        elif self.errors:
+            error_code, description, parameters = self.errors.pop(0)
+            return web.json_response({
+                'ok': False, 'error_code': error_code,
+                'description': description, 'parameters': parameters},
+                status=error_code)
+        else:
+            result = {'message_id': next(self._message_ids),
+                      'chat': {'id': params.get('chat_id')},
+                      'text': params.get('text')}
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, params):
+        offset = params.get('offset', 0)
+        limit = params.get('limit', 100)
+        self.updates = [update for update in self.updates
+                        if update['update_id'] >= offset]
+        if not self.updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(
+                    self._arrived.wait(), params.get('timeout', 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
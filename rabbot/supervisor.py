@@ -0,0 +1,254 @@
+"""Spread Telegram updates over worker processes, sharded by chat.
+
+One process is bound by the GIL however many threads its Dispatcher
+has. A Supervisor runs `workers` processes, each with a Dispatcher of its
+own, and sends every update to the process chosen by a hash of its chat
+(see rabbot.dispatch.chat_key). All updates of a chat go to the same
+process, so they are still handled in order, and whatever a process
+caches about a group stays useful. The processes share the database:
+SQLite in WAL mode (see rabbot.database) or a server database.
+
+A Supervisor is a drop-in replacement for a Dispatcher in rabbot.polling
+and rabbot.webhook. Worker processes that die are restarted on the same
+shard; updates waiting in the shard's queue are kept, the others the
+Supervisor submitted to the shard but the process did not finish are
+counted as lost. resize() changes the
+number of processes once all queues are empty, so no chat's updates are
+ever handled by two processes at once.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import zlib
+
+from rabbot.dispatch import Dispatcher, chat_key
+from rabbot.models import init_db
+
+LOGGER = logging.getLogger(__name__)
+
+
+def shard_of(update: dict, shards: int) -> int:
+    """Return the shard of an update; the same in every process."""
+    return zlib.crc32(str(chat_key(update)).encode()) % shards
+
+
+class _ShardHandler(object):
+
+    """Call the handler in a worker process and keep the shard's counts."""
+
+    def __init__(self, handler, shard):
+        self._handler = handler
+        self._shard = shard
+
+    def __call__(self, update):
+        try:
+            self._handler(update)
+        except Exception:
+            _increment(self._shard.failed)
+            raise
+        else:
+            _increment(self._shard.handled)
+        finally:
+            self._shard.queue.task_done()
+
+
+def _increment(value, amount: int=1) -> None:
+    with value.get_lock():
+        value.value += amount
+
+
+def _work(shard, handler, database_url, threads: int) -> None:
+    """Main function of a worker process."""
+    if database_url is not None:
+        init_db(database_url)
+    asyncio.run(_serve(shard, handler, threads))
+
+
+def _take(shard):
+    """Get the next update and count it as taken, on the same thread."""
+    update = shard.queue.get()
+    if update is not None:
+        _increment(shard.taken)
+    return update
+
+
+async def _serve(shard, handler, threads: int) -> None:
+    loop = asyncio.get_running_loop()
+    dispatcher = Dispatcher(_ShardHandler(handler, shard), workers=threads)
+    dispatcher.start()
+    while True:
+        update = await loop.run_in_executor(None, _take, shard)
+        if update is None:
+            shard.queue.task_done()
+            break
+        await dispatcher.submit(update)
+    await dispatcher.stop()
+
+
+class _Shard(object):
+
+    """Queue and counters of one shard, shared with its worker process."""
+
+    def __init__(self, context, max_pending: int):
+        self.queue = context.JoinableQueue(max_pending)
+        self.taken = context.Value('l', 0)
+        self.handled = context.Value('l', 0)
+        self.failed = context.Value('l', 0)
+        # Kept by the Supervisor only: updates put on the queue, and those
+        # given up on because a worker died with them.
+        self.submitted = 0
+        self.lost = 0
+
+    def in_flight(self) -> int:
+        """Updates taken by the worker that it did not finish."""
+        return self.taken.value - self.handled.value - self.failed.value
+
+    def unfinished(self) -> int:
+        """Updates submitted that are neither finished, lost nor queued.
+
+        Once the worker is dead this counts what it took, including an
+        update it got from the queue but died before counting as taken.
+        """
+        try:
+            queued = self.queue.qsize()
+        except NotImplementedError:
+            # No sem_getvalue() (macOS); fall back to the worker's count.
+            return self.in_flight()
+        return (self.submitted - self.handled.value - self.failed.value -
+                self.lost - queued)
+
+
+class Supervisor(object):
+
+    """Run `handler(update)` in worker processes, in order per chat.
+
+    handler must be picklable: a function defined at module level.
+    """
+
+    def __init__(self, handler, workers: int=None, database_url: str=None,
+                 threads: int=8, max_pending: int=1000,
+                 check_interval: float=1.0, start_method: str='spawn'):
+        self._handler = handler
+        self._workers = workers or os.cpu_count()
+        self._database_url = database_url
+        self._threads = threads
+        self._max_pending = max_pending
+        self._check_interval = check_interval
+        self._context = multiprocessing.get_context(start_method)
+        self._shards = []
+        self._processes = []
+        self._watcher = None
+        # Set while workers exit on purpose, so check() leaves them be.
+        self._stopping = False
+        self.restarts = 0
+        self.lost = 0
+        # Counts of shards that were resized away.
+        self._retired = [0, 0]
+
+    @property
+    def workers(self) -> int:
+        """Number of worker processes."""
+        return len(self._processes)
+
+    @property
+    def handled(self) -> int:
+        """Updates handled without an exception, by all workers."""
+        return self._retired[0] + sum(
+            shard.handled.value for shard in self._shards)
+
+    @property
+    def failed(self) -> int:
+        """Updates whose handler raised, by all workers."""
+        return self._retired[1] + sum(
+            shard.failed.value for shard in self._shards)
+
+    def _spawn(self, shard):
+        process = self._context.Process(
+            target=_work, daemon=True,
+            args=(shard, self._handler, self._database_url, self._threads))
+        process.start()
+        return process
+
+    def start(self) -> None:
+        """Start the worker processes and watch over them."""
+        self._shards = [_Shard(self._context, self._max_pending)
+                        for _ in range(self._workers)]
+        self._processes = [self._spawn(shard) for shard in self._shards]
+        if self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    async def submit(self, update: dict) -> None:
+        """Queue an update, waiting while its shard's queue is full."""
+        shard = self._shards[shard_of(update, len(self._shards))]
+        try:
+            shard.queue.put_nowait(update)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(
+                None, shard.queue.put, update)
+        shard.submitted += 1
+
+    async def join(self) -> None:
+        """Wait until every submitted update has been handled."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(None, shard.queue.join)
+            for shard in self._shards])
+
+    async def _stop_processes(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._stopping = True
+        for shard in self._shards:
+            shard.queue.put(None)
+        await asyncio.gather(*[
+            loop.run_in_executor(None, process.join)
+            for process in self._processes])
+        self._stopping = False
+        self._retired[0] += sum(shard.handled.value for shard in self._shards)
+        self._retired[1] += sum(shard.failed.value for shard in self._shards)
+        self._shards = []
+        self._processes = []
+
+    async def stop(self) -> None:
+        """Handle what is queued, then stop the worker processes."""
+        await self.join()
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        await self._stop_processes()
+
+    async def resize(self, workers: int) -> None:
+        """Drain all shards, then continue with a different process count."""
+        await self.join()
+        await self._stop_processes()
+        self._workers = workers
+        self.start()
+
+    def check(self) -> int:
+        """Restart dead worker processes; return how many were restarted."""
+        restarted = 0
+        for number, process in enumerate(self._processes):
+            if self._stopping or process.is_alive():
+                continue
+            shard = self._shards[number]
+            # The dead worker will never finish these; don't let join()
+            # wait for them.
+            lost = shard.unfinished()
+            for _ in range(lost):
+                shard.queue.task_done()
+            shard.taken.value = shard.handled.value + shard.failed.value
+            shard.lost += lost
+            self.lost += lost
+            LOGGER.warning("Worker %d exited with %s, %d updates lost; "
+                           "restarting", number, process.exitcode, lost)
+            self._processes[number] = self._spawn(shard)
+            self.restarts += 1
+            restarted += 1
+        return restarted
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self._check_interval)
+            self.check()
@@ -1,3 +1,5 @@
+# Dialog state per (chat, user) is kept by rabbot.conversation.
+#
 # Jim types @rabbot June 15
 # Rabbot gives Jim a list of shifts on that day.
 # Jim clicks one
@@ -0,0 +1,198 @@
+"""Tests for the shift event bus and its subscribers."""
+# pylint: disable=missing-docstring
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from nose.tools import assert_equals, assert_in, assert_less, assert_true
+from rabbot import api
+from rabbot.api.signals import ShiftEvent, shifts_changed
+from rabbot.bus import (
+    DROP_NEWEST, DROP_OLDEST, MERGE, BridgeClient, BridgeServer, Bus,
+    DirectNotifier, GroupAnnouncer, Subscription, from_json, to_json)
+from rabbot.dummydb import group_database
+
+DAY = datetime(2016, 3, 7)
+
+
+def _event(shift_id=1, kind='opened', group=1, mutator=1):
+    return ShiftEvent(kind, group, shift_id, 'Evening', DAY, mutator,
+                      None if kind == 'opened' else 2, shift_id, DAY)
+
+
+def _drain(subscription):
+    async def drain():
+        return [await subscription.get() for _ in range(len(subscription))]
+    return asyncio.run(drain())
+
+
+def _fill(policy):
+    subscription = Subscription(maxsize=2, policy=policy)
+    for shift_id in (1, 2, 3):
+        subscription.put(_event(shift_id))
+    return subscription
+
+
+def test_drop_oldest():
+    subscription = _fill(DROP_OLDEST)
+    assert_equals([e.shift_id for e in _drain(subscription)], [2, 3])
+    assert_equals(subscription.dropped, 1)
+
+
+def test_drop_newest():
+    subscription = _fill(DROP_NEWEST)
+    assert_equals([e.shift_id for e in _drain(subscription)], [1, 2])
+    assert_equals(subscription.dropped, 1)
+
+
+def test_merge_keeps_latest_event_per_shift():
+    subscription = Subscription(maxsize=2, policy=MERGE)
+    subscription.put(_event(1))
+    subscription.put(_event(2))
+    subscription.put(_event(1, 'covered'))
+    assert_equals([(e.shift_id, e.kind) for e in _drain(subscription)],
+                  [(2, 'opened'), (1, 'covered')])
+    assert_equals((subscription.merged, subscription.dropped), (1, 0))
+
+
+def _fixture():
+    """Session factory of group 1 with members 1, 2 and 3 and a shift."""
+    factory = group_database([('Evening', 0)], users=(1, 2, 3))
+    session = factory()
+    shift_id = api.get_shift_by_name(session, 1, 'Evening').value.shift_id
+    session.close()
+    return factory, shift_id
+
+
+def test_committed_mutation_reaches_subscriber_quickly():
+    factory, shift_id = _fixture()
+
+    def mutate(commit):
+        session = factory()
+        api.add_mutation(session, 1, 1, shift_id, DAY)
+        committed = time.monotonic()
+        if commit:
+            session.commit()
+        else:
+            session.rollback()
+        session.close()
+        return committed
+
+    async def scenario():
+        bus = Bus()
+        bus.start()
+        subscription = bus.subscribe()
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, mutate, False)
+            committed = await loop.run_in_executor(None, mutate, True)
+            event = await subscription.get()
+            return time.monotonic() - committed, event, len(subscription)
+        finally:
+            bus.close()
+
+    latency, event, left = asyncio.run(scenario())
+    assert_less(latency, 0.05)
+    assert_equals((event.kind, event.telegram_group_id, event.shift_name,
+                   event.mutator, event.new_user), ('opened', 1, 'Evening', 1,
+                                                    None))
+    assert_equals(left, 0)
+
+
+def test_commit_survives_closed_loop():
+    factory, shift_id = _fixture()
+
+    async def start():
+        bus = Bus()
+        bus.start()
+        return bus
+
+    bus = asyncio.run(start())
+    failures = []
+
+    def failing(*args):
+        failures.append(args)
+        raise ValueError('receiver failure')
+
+    shifts_changed.connect(failing)
+    try:
+        def mutate():
+            session = factory()
+            api.add_mutation(session, 1, 1, shift_id, DAY)
+            api.add_shift(session, 1, 'Morning', 1)
+            session.commit()
+            session.close()
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(mutate).result()
+    finally:
+        shifts_changed.disconnect(failing)
+        bus.close()
+    assert_equals(bus.lost, 1)
+    assert_equals(len(failures), 1)
+    session = factory()
+    assert_equals(len(api.list_shifts(session, 1).value), 2)
+    session.close()
+
+
+class _Outbox(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+def test_announcer_and_notifier():
+    async def scenario():
+        bus = Bus()
+        bus.start()
+        outbox = _Outbox()
+        subscribers = [GroupAnnouncer(bus, outbox),
+                       DirectNotifier(bus, outbox, lambda group: [1, 2, 3])]
+        tasks = [asyncio.ensure_future(s.run()) for s in subscribers]
+        bus.publish(_event(1, 'covered', group=-5))
+        bus.publish(_event(2, group=-5, mutator=2))
+        await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        bus.close()
+        return outbox.sent, bus.prometheus()
+
+    sent, metrics = asyncio.run(scenario())
+    assert_equals(sorted(chat for chat, _ in sent), [-5, -5, 1, 3])
+    assert_in((-5, 'Evening on Monday March 07 is covered.'), sent)
+    assert_in('rabbot_bus_received_total 4\n', metrics)
+
+
+def test_json_round_trip():
+    event = _event()
+    assert_equals(from_json(to_json(event)), event)
+
+
+def test_bridge_forwards_events():
+    async def scenario(path):
+        central, local = Bus(), Bus()
+        central.start()
+        local.start()
+        subscription = central.subscribe()
+        server = BridgeServer(central, path)
+        await server.start()
+        client = asyncio.ensure_future(BridgeClient(local, path).run())
+        try:
+            local.publish(_event(7))
+            return await asyncio.wait_for(subscription.get(), 1)
+        finally:
+            client.cancel()
+            await asyncio.gather(client, return_exceptions=True)
+            await server.stop()
+            central.close()
+            local.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        event = asyncio.run(scenario(os.path.join(directory, 'bus')))
+    assert_true(event == _event(7))
@@ -0,0 +1,94 @@
+"""Tests for conversation state."""
+# pylint: disable=missing-docstring
+from datetime import datetime, timedelta
+
+from nose.tools import assert_equals, assert_raises
+from transitions import MachineError
+
+from rabbot.conversation import ConversationStore, next_state, IDLE
+from rabbot.dummydb import group_database
+from rabbot.models import Conversation
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = datetime(2016, 6, 15, 12)
+
+    def __call__(self):
+        return self.now
+
+
+def _session_factory():
+    return group_database()
+
+
+def test_next_state():
+    assert_equals(next_state(IDLE, 'ask_date'), 'choosing_shift')
+    assert_equals(next_state('confirming', 'cancel'), IDLE)
+    assert_raises(MachineError, next_state, IDLE, 'confirm')
+    assert_raises(MachineError, next_state, IDLE, 'no_such_trigger')
+
+
+def test_dialog_survives_restart():
+    factory = _session_factory()
+    store = ConversationStore(factory)
+    store.fire(1, 2, 'ask_date', date='2016-06-15')
+    store.fire(1, 2, 'choose_shift', shift_id=3)
+    # A new store has an empty LRU and reads from the database.
+    record = ConversationStore(factory).get(1, 2)
+    assert_equals(record.state, 'confirming')
+    assert_equals(record.data, {'date': '2016-06-15', 'shift_id': 3})
+
+
+def test_idle_dialogs_have_no_row():
+    factory = _session_factory()
+    store = ConversationStore(factory)
+    store.fire(1, 2, 'ask_date')
+    store.fire(1, 2, 'cancel')
+    assert_equals(factory().query(Conversation).count(), 0)
+    assert_equals(store.get(1, 2).data, {})
+
+
+def test_lru_is_bounded():
+    store = ConversationStore(_session_factory(), capacity=10)
+    for user_id in range(100):
+        store.fire(1, user_id, 'ask_date')
+    assert_equals(len(store), 10)
+    assert_equals(store.get(1, 0).state, 'choosing_shift')
+
+
+def _fail():
+    raise IOError('disk full')
+
+
+def test_failed_write_keeps_cached_state():
+    factory = _session_factory()
+    store = ConversationStore(factory)
+    store.fire(1, 2, 'ask_date', date='2016-06-15')
+
+    def failing_factory():
+        session = factory()
+        session.commit = _fail
+        return session
+
+    store._session_factory = failing_factory  # pylint: disable=protected-access
+    assert_raises(IOError, store.fire, 1, 2, 'choose_shift', shift_id=3)
+    record = store.get(1, 2)
+    assert_equals(record.state, 'choosing_shift')
+    assert_equals(record.data, {'date': '2016-06-15'})
+
+
+def test_idle_dialogs_expire():
+    clock = FakeClock()
+    factory = _session_factory()
+    store = ConversationStore(
+        factory, idle_timeout=timedelta(minutes=30), clock=clock)
+    store.fire(1, 2, 'ask_date')
+    store.fire(1, 3, 'ask_date')
+    clock.now += timedelta(minutes=20)
+    store.fire(1, 3, 'choose_shift')
+    clock.now += timedelta(minutes=20)
+    assert_equals(store.get(1, 2).state, IDLE)
+    assert_equals(store.expire(), 1)
+    assert_equals(store.get(1, 3).state, 'confirming')
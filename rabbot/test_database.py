@@ -0,0 +1,58 @@
+"""Tests for engine configuration and session handling."""
+# pylint: disable=missing-docstring
+import os
+import tempfile
+
+from nose.tools import assert_equals, assert_raises, assert_true
+from sqlalchemy import text
+
+from rabbot import models
+from rabbot.database import make_engine, TimedQueuePool
+
+
+def _pragma(engine, name):
+    with engine.connect() as connection:
+        return connection.execute(text('PRAGMA ' + name)).scalar()
+
+
+def test_sqlite_file_settings():
+    path = os.path.join(tempfile.mkdtemp(), 'rabbot.db')
+    engine = make_engine('sqlite:///' + path, busy_timeout=1234)
+    assert_true(isinstance(engine.pool, TimedQueuePool))
+    assert_equals(_pragma(engine, 'journal_mode'), 'wal')
+    # NORMAL is 1.
+    assert_equals(_pragma(engine, 'synchronous'), 1)
+    assert_equals(_pragma(engine, 'busy_timeout'), 1234)
+    assert_equals(_pragma(engine, 'foreign_keys'), 1)
+    assert_equals(engine.echo, False)
+
+
+def test_pool_stats():
+    path = os.path.join(tempfile.mkdtemp(), 'rabbot.db')
+    engine = make_engine('sqlite:///' + path)
+    for _ in range(3):
+        _pragma(engine, 'foreign_keys')
+    stats = engine.pool_stats
+    assert_equals(stats.checkouts, 3)
+    assert_equals(stats.checked_out, 0)
+    assert_equals(stats.connects, 1)
+    assert_true(stats.wait_seconds > 0)
+    assert_true('rabbot_db_pool_checkouts_total 3\n' in stats.prometheus())
+
+
+def test_memory_database_keeps_default_pool():
+    engine = make_engine()
+    assert_equals(_pragma(engine, 'foreign_keys'), 1)
+    assert_true(not isinstance(engine.pool, TimedQueuePool))
+
+
+def test_session_scope_closes_after_rollback():
+    engine = models.init_db()
+    with assert_raises(ValueError):
+        with models.SessionScope() as session:
+            session.add(models.User(telegram_user_id=1))
+            session.flush()
+            raise ValueError()
+    assert_equals(engine.pool_stats.checked_out, 0)
+    with models.SessionScope() as session:
+        assert_equals(session.query(models.User).count(), 0)
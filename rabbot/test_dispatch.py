@@ -0,0 +1,119 @@
+"""Tests for the update dispatcher and long polling."""
+# pylint: disable=missing-docstring
+import asyncio
+import threading
+import time
+
+from nose.tools import assert_equals, assert_true
+
+from rabbot.bot_api import BotAPI
+from rabbot.dispatch import Dispatcher, chat_key
+from rabbot.polling import poll
+from rabbot.stub_bot_api import StubBotAPI
+
+
+def _update(update_id, chat_id):
+    return {'update_id': update_id,
+            'message': {'chat': {'id': chat_id}, 'text': str(update_id)}}
+
+
+def test_chat_key():
+    assert_equals(chat_key(_update(1, 42)), 42)
+    assert_equals(chat_key({'update_id': 1, 'inline_query': {
+        'from': {'id': 7}}}), 7)
+    assert_equals(chat_key({'update_id': 3}), 3)
+
+
+def test_updates_of_one_chat_stay_in_order():
+    handled = []
+
+    def handler(update):
+        # Later updates are faster; only ordering keeps them in line.
+        time.sleep(0.01 / update['update_id'])
+        handled.append(update['update_id'])
+
+    async def run():
+        dispatcher = Dispatcher(handler, workers=4)
+        dispatcher.start()
+        for update_id in range(1, 11):
+            await dispatcher.submit(_update(update_id, 1))
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert_equals(handled, list(range(1, 11)))
+
+
+def test_chats_are_handled_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+
+    async def run():
+        # Each handler waits for the other two; serial handling would
+        # break the barrier.
+        dispatcher = Dispatcher(lambda update: barrier.wait(), workers=3)
+        dispatcher.start()
+        for chat_id in range(3):
+            await dispatcher.submit(_update(chat_id, chat_id))
+        await dispatcher.stop()
+        return dispatcher
+
+    assert_equals(asyncio.run(run()).handled, 3)
+
+
+def test_submit_waits_when_full():
+    release = threading.Event()
+
+    async def run():
+        dispatcher = Dispatcher(
+            lambda update: release.wait(5), workers=1, max_pending=2)
+        dispatcher.start()
+        await dispatcher.submit(_update(1, 1))
+        await dispatcher.submit(_update(2, 1))
+        third = asyncio.ensure_future(dispatcher.submit(_update(3, 1)))
+        await asyncio.sleep(0.05)
+        blocked = not third.done()
+        release.set()
+        await third
+        await dispatcher.stop()
+        return blocked
+
+    assert_true(asyncio.run(run()))
+
+
+def test_handler_errors_are_counted():
+    def handler(update):
+        raise ValueError(update['update_id'])
+
+    async def run():
+        dispatcher = Dispatcher(handler)
+        dispatcher.start()
+        await dispatcher.submit(_update(1, 1))
+        await dispatcher.stop()
+        return dispatcher
+
+    assert_equals(asyncio.run(run()).failed, 1)
+
+
+def test_poll_against_stub_server():
+    handled = []
+
+    async def run():
+        stub = StubBotAPI([_update(i, i % 3) for i in range(1, 21)])
+        bot_api = BotAPI('token', await stub.start())
+        dispatcher = Dispatcher(lambda update: handled.append(update))
+        dispatcher.start()
+        stop = asyncio.Event()
+        polling = asyncio.ensure_future(
+            poll(bot_api, dispatcher, timeout=0, stop=stop))
+        while len(handled) < 20:
+            await asyncio.sleep(0.01)
+        stop.set()
+        await polling
+        await dispatcher.stop()
+        await bot_api.close()
+        await stub.stop()
+        return stub
+
+    stub = asyncio.run(run())
+    assert_equals(len(handled), 20)
+    # The second poll acknowledges the first batch.
+    assert_equals(stub.calls_to('getUpdates')[1]['offset'], 21)
@@ -0,0 +1,70 @@
+"""Tests for the shared test database."""
+# pylint: disable=missing-docstring
+from nose.tools import assert_equals
+from sqlalchemy import func, select
+
+from rabbot.dummydb import DummyDB, QueryCounter
+from rabbot.models import Schedule, User
+
+
+def test_every_block_starts_empty():
+    for _ in range(2):
+        with DummyDB() as session:
+            assert_equals(session.scalar(select(func.count(User.user_id))), 0)
+            user = User(telegram_user_id=1)
+            session.add(user)
+            session.commit()
+            # Ids start at 1 again after the rollback of the last block.
+            assert_equals(user.user_id, 1)
+
+
+def test_rollback_keeps_earlier_commits():
+    with DummyDB() as session:
+        session.add(User(telegram_user_id=1))
+        session.commit()
+        session.add(User(telegram_user_id=2))
+        session.rollback()
+        assert_equals(session.scalars(select(User.telegram_user_id)).all(),
+                      [1])
+
+
+def test_debug_database_is_private():
+    with DummyDB() as session:
+        session.add(Schedule(telegram_group_id=1))
+        with DummyDB(debug=True) as private:
+            assert_equals(private.scalar(
+                select(func.count(Schedule.schedule_id))), 0)
+
+
+def test_transaction_control_is_not_counted():
+    with DummyDB() as session:
+        session.commit()
+        with QueryCounter(session) as counter:
+            session.get(User, 1)
+        assert_equals(counter.count, 1)
+
+
+def test_nested_blocks_are_isolated():
+    with DummyDB() as outer:
+        outer.add(User(telegram_user_id=1))
+        outer.commit()
+        with DummyDB() as inner:
+            assert_equals(inner.scalar(select(func.count(User.user_id))), 0)
+            inner.add(User(telegram_user_id=2))
+            inner.commit()
+        assert_equals(outer.scalars(select(User.telegram_user_id)).all(), [1])
+    # The shared database is free again.
+    with DummyDB() as session:
+        assert_equals(session.scalar(select(func.count(User.user_id))), 0)
+
+
+def test_savepoints_are_not_statements():
+    with DummyDB() as session:
+        with QueryCounter(session) as counter:
+            session.add(User(telegram_user_id=1))
+            session.commit()
+            session.add(User(telegram_user_id=2))
+            session.flush()
+            session.rollback()
+        assert_equals([statement.split()[0] for statement in
+                       counter.statements], ['INSERT', 'INSERT'])
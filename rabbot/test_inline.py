@@ -0,0 +1,137 @@
+"""Tests for inline query answering."""
+# pylint: disable=missing-docstring
+from datetime import date
+
+from nose.tools import assert_equals, assert_in
+
+from rabbot import api
+from rabbot.dummydb import QueryCounter, group_database
+from rabbot.inline import (
+    InlineIndex, PrefixIndex, Suggestion, shift_entries, answer_inline_query)
+from rabbot.models import Schedule, User
+
+
+def _texts(suggestions, kind):
+    return [suggestion.text for suggestion in suggestions
+            if suggestion.kind == kind]
+
+
+def test_prefix_index_matches_every_word():
+    index = PrefixIndex(shift_entries([(1, 'Sunday evening'), (2, 'Morning')]))
+    assert_equals([s.value for s in index.search('eve', 10)], [1])
+    assert_equals([s.value for s in index.search('', 10)], [1, 2])
+    assert_equals(list(index.search('x', 10)), [])
+
+
+def _fixture():
+    """Session factory, schedule ID and index of a schedule with 2 shifts."""
+    factory = group_database([('Sunday evening', 1), ('Morning', 0)])
+    session = factory()
+    schedule_id = api.get_schedule(session, 1).value.schedule_id
+    session.close()
+    # 2016-06-13 is a Monday.
+    index = InlineIndex(factory, today=lambda: date(2016, 6, 13))
+    return factory, schedule_id, index
+
+
+def test_dates_shifts_and_keywords():
+    _, schedule_id, index = _fixture()
+    try:
+        answer = index.answer(schedule_id, 'June 15')
+        assert_equals(answer, [Suggestion('date', 'June 15', date(2016, 6, 15))])
+        answer = index.answer(schedule_id, 'mo')
+        assert_equals(_texts(answer, 'shift'), ['Morning'])
+        assert_equals(_texts(answer, 'date'), ['June 13'])
+        assert_in('open', _texts(index.answer(schedule_id, 'op'), 'keyword'))
+    finally:
+        index.close()
+
+
+def test_answers_are_cached():
+    _, schedule_id, index = _fixture()
+    try:
+        index.answer(schedule_id, 'eve')
+        index.answer(schedule_id, 'Eve ')
+        assert_equals((index.hits, index.misses), (1, 1))
+    finally:
+        index.close()
+
+
+def test_shift_changes_invalidate():
+    factory, schedule_id, index = _fixture()
+    try:
+        assert_equals(index.answer(schedule_id, 'night'), [])
+        session = factory()
+        api.add_shift(session, 1, 'Night', 2)
+        # Nothing changes until the shift is committed.
+        assert_equals(index.answer(schedule_id, 'night'), [])
+        session.commit()
+        session.close()
+        assert_equals(
+            _texts(index.answer(schedule_id, 'night'), 'shift'), ['Night'])
+    finally:
+        index.close()
+
+
+def test_answer_inline_query():
+    factory, _, index = _fixture()
+    try:
+        session = factory()
+        session.add(User(telegram_user_id=7))
+        session.commit()
+        query = {'id': 'q', 'from': {'id': 7}, 'query': 'sun'}
+        assert_equals(answer_inline_query(index, query)['results'], [])
+        api.add_user_to_schedule(session, 7, 1)
+        session.commit()
+        session.close()
+        answer = answer_inline_query(index, query)
+        assert_equals(answer['inline_query_id'], 'q')
+        assert_equals([result['title'] for result in answer['results']],
+                      ['June 19', 'Sunday evening'])
+        # Warm: no query per keystroke.
+        with QueryCounter(factory()) as counter:
+            answer_inline_query(index, dict(query, query='sunday'))
+            answer_inline_query(index, dict(query, query='sunday'))
+        assert_equals(counter.count, 0)
+    finally:
+        index.close()
+
+
+def test_answer_inline_query_dedupes_across_schedules():
+    factory, _, index = _fixture()
+    try:
+        session = factory()
+        session.add_all([User(telegram_user_id=7),
+                         Schedule(telegram_group_id=2)])
+        session.commit()
+        api.add_shift(session, 2, 'Sunday night', 0)
+        api.add_user_to_schedule(session, 7, 1)
+        api.add_user_to_schedule(session, 7, 2)
+        session.commit()
+        session.close()
+        answer = answer_inline_query(
+            index, {'id': 'q', 'from': {'id': 7}, 'query': 'sun'})
+        ids = [result['id'] for result in answer['results']]
+        assert_equals(len(ids), len(set(ids)))
+        assert_equals(sorted(result['title'] for result in answer['results']),
+                      ['June 19', 'Sunday evening', 'Sunday night'])
+    finally:
+        index.close()
+
+
+def test_index_built_before_invalidation_is_not_kept():
+    factory, schedule_id, index = _fixture()
+
+    def invalidating_factory():
+        # A shift change commits while the index is being built.
+        index.invalidate(schedule_id)
+        return factory()
+
+    index._session_factory = invalidating_factory  # pylint: disable=protected-access
+    try:
+        index.answer(schedule_id, 'eve')
+        index._session_factory = factory  # pylint: disable=protected-access
+        index.answer(schedule_id, 'eve')
+        assert_equals((index.hits, index.misses), (0, 2))
+    finally:
+        index.close()
@@ -0,0 +1,43 @@
+"""Tests for upgrading existing databases."""
+# pylint: disable=missing-docstring
+from nose.tools import assert_equals, assert_in, assert_raises
+from sqlalchemy import create_engine, inspect, text
+
+from rabbot.migrations import upgrade, MigrationError
+from rabbot.models import BASE
+
+
+def _old_database():
+    """Return an engine for a database whose tables have no indexes."""
+    engine = create_engine('sqlite:///:memory:')
+    BASE.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for table in BASE.metadata.sorted_tables:
+            for index in inspect(connection).get_indexes(table.name):
+                connection.execute(text('DROP INDEX {}'.format(index['name'])))
+    return engine
+
+
+def test_upgrade_creates_missing_indexes():
+    engine = _old_database()
+    created = upgrade(engine)
+    assert_in('ix_schedules_telegram_group_id', created)
+    assert_in('ix_mutations_shift_date', created)
+    assert_equals(upgrade(engine), [])
+
+
+def test_upgrade_refuses_duplicates():
+    engine = _old_database()
+    with engine.begin() as connection:
+        connection.execute(text(
+            'INSERT INTO users (telegram_user_id) VALUES (1), (1)'))
+    assert_raises(MigrationError, upgrade, engine)
+
+
+def test_upgrade_adds_missing_columns():
+    engine = _old_database()
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE shifts DROP COLUMN recurrence'))
+    assert_in('shifts.recurrence', upgrade(engine))
+    columns = [column['name'] for column in inspect(engine).get_columns('shifts')]
+    assert_in('recurrence', columns)
@@ -1,5 +1,6 @@
 """Empty database context manager to simplify testing."""
-from nose.tools import assert_equals
+from nose.tools import assert_equals, assert_raises
+from sqlalchemy.exc import IntegrityError
 
 from rabbot.models import User, Schedule, Shift, Mutation
 from rabbot.dummydb import DummyDB
@@ -19,3 +20,23 @@ def test_some_random_models():
         session.add_all([user, schedule, shift, mutation])
         session.flush()
         assert_equals(schedule.shifts[0].name, "first shift")
+
+
+def test_telegram_user_id_is_unique():
+    with assert_raises(IntegrityError):
+        with DummyDB() as session:
+            session.add_all([User(telegram_user_id=1), User(telegram_user_id=1)])
+            session.flush()
+
+
+def test_shift_names_are_unique_per_schedule():
+    with DummyDB() as session:
+        schedule = Schedule(telegram_group_id=1)
+        other_schedule = Schedule(telegram_group_id=2)
+        session.add_all([
+            Shift(schedule=schedule, name="shift"),
+            Shift(schedule=other_schedule, name="shift")])
+        session.flush()
+        with assert_raises(IntegrityError):
+            with session.begin_nested():
+                session.add(Shift(schedule=schedule, name="shift"))
@@ -0,0 +1,164 @@
+"""Tests for the outgoing message queue, against a local stub server."""
+# pylint: disable=missing-docstring
+import asyncio
+import time
+
+from nose.tools import assert_equals, assert_in, assert_true
+
+from rabbot.bot_api import BotAPI
+from rabbot.outbox import Outbox, OutboxMetrics, TokenBucket
+from rabbot.stub_bot_api import StubBotAPI
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+    bucket.take()
+    bucket.take()
+    assert_equals(bucket.delay(), 0.5)
+    clock.now = 0.5
+    assert_equals(bucket.delay(), 0)
+
+
+def _run(scenario, latency: float=0.0, **outbox_params):
+    """Run scenario(outbox, stub) with an Outbox and stub server."""
+    async def run():
+        stub = StubBotAPI(latency=latency)
+        bot_api = BotAPI('token', await stub.start())
+        outbox = Outbox(bot_api, **outbox_params)
+        try:
+            return await scenario(outbox, stub)
+        finally:
+            await outbox.stop()
+            await bot_api.close()
+            await stub.stop()
+    return asyncio.run(run())
+
+
+def test_per_chat_rate_limit():
+    async def scenario(outbox, stub):
+        outbox.start()
+        started = time.monotonic()
+        await asyncio.gather(*[outbox.send_message(1, str(i))
+                               for i in range(3)])
+        one_chat = time.monotonic() - started
+        started = time.monotonic()
+        await asyncio.gather(*[outbox.send_message(chat_id, 'hi')
+                               for chat_id in range(10, 13)])
+        three_chats = time.monotonic() - started
+        texts = [params['text'] for params in stub.calls_to('sendMessage')]
+        return one_chat, three_chats, texts
+
+    one_chat, three_chats, texts = _run(
+        scenario, chat_rate=10, chat_burst=1)
+    assert_true(one_chat >= 0.18)
+    assert_true(three_chats < 0.1)
+    assert_equals(texts[:3], ['0', '1', '2'])
+
+
+def test_edits_of_one_message_are_coalesced():
+    async def scenario(outbox, stub):
+        edits = [outbox.edit_message_text(1, 5, 'v{}'.format(i))
+                 for i in range(3)]
+        outbox.start()
+        results = await asyncio.gather(*edits)
+        return results, stub.calls_to('editMessageText'), outbox
+
+    results, calls, outbox = _run(scenario)
+    assert_equals([params['text'] for params in calls], ['v2'])
+    assert_equals(len(set(result['message_id'] for result in results)), 1)
+    assert_equals(outbox.metrics.coalesced, 2)
+
+
+def test_retries_after_429():
+    async def scenario(outbox, stub):
+        stub.errors.append(
+            (429, 'Too Many Requests', {'retry_after': 0.01}))
+        outbox.start()
+        result = await outbox.send_message(1, 'hi')
+        return result, outbox
+
+    result, outbox = _run(scenario)
+    assert_equals(result['text'], 'hi')
+    assert_equals(outbox.metrics.retried, 1)
+    assert_equals(outbox.metrics.sent, 1)
+
+
+def test_429_keeps_newer_edit():
+    async def scenario(outbox, stub):
+        stub.errors.append(
+            (429, 'Too Many Requests', {'retry_after': 0.01}))
+        outbox.start()
+        first = outbox.edit_message_text(1, 5, 'A')
+        await asyncio.sleep(0.05)
+        # A is in flight and about to be refused; B waits in the queue.
+        second = outbox.edit_message_text(1, 5, 'B')
+        results = await asyncio.wait_for(asyncio.gather(first, second), 5)
+        return results, stub.calls_to('editMessageText')
+
+    results, calls = _run(scenario, latency=0.1)
+    assert_equals([params['text'] for params in calls][-1:], ['B'])
+    assert_equals([result['text'] for result in results], ['B', 'B'])
+
+
+def test_chats_are_sent_concurrently():
+    async def scenario(outbox, stub):
+        outbox.start()
+        started = time.monotonic()
+        await asyncio.gather(*[outbox.send_message(chat_id, 'hi')
+                               for chat_id in range(10)])
+        return time.monotonic() - started
+
+    # One at a time, this takes a second.
+    assert_true(_run(scenario, latency=0.1) < 0.5)
+
+
+def test_retry_after_holds_back_only_its_chat():
+    async def scenario(outbox, stub):
+        stub.errors.append((429, 'Too Many Requests', {'retry_after': 1}))
+        outbox.start()
+        throttled = outbox.send_message(1, 'throttled')
+        started = time.monotonic()
+        await outbox.send_message(2, 'other')
+        other = time.monotonic() - started
+        await throttled
+        return other, time.monotonic() - started
+
+    other, throttled = _run(scenario)
+    assert_true(other < 0.5)
+    assert_true(throttled >= 0.9)
+
+
+def test_stop_without_start():
+    async def scenario(outbox, stub):
+        return outbox
+
+    outbox = _run(scenario)
+    assert_equals(outbox.depth, 0)
+
+
+def test_latencies_are_bounded():
+    metrics = OutboxMetrics(keep=3)
+    for seconds in range(5):
+        metrics.record_latency(seconds)
+    assert_equals(list(metrics.latencies), [2, 3, 4])
+
+
+def test_prometheus_metrics():
+    async def scenario(outbox, stub):
+        outbox.start()
+        await outbox.send_message(1, 'hi')
+        return outbox.prometheus()
+
+    text = _run(scenario)
+    assert_in('rabbot_outbox_queue_depth 0\n', text)
+    assert_in('rabbot_outbox_sent_total 1\n', text)
@@ -0,0 +1,72 @@
+"""Tests for recurrence rules and their expansion."""
+# pylint: disable=missing-docstring, invalid-name
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+from nose.tools import assert_equals, assert_raises
+
+from rabbot import recurrence
+
+FakeShift = namedtuple('FakeShift', 'shift_id ordering recurrence')
+FakeMutation = namedtuple('FakeMutation', 'shift_date shift mutation_id')
+
+MORNING = FakeShift(1, 1, None)
+EVENING = FakeShift(2, 2, 'mon,wed')
+
+
+class Test_parse_rule():
+
+    def test_daily(self):
+        assert_equals(recurrence.parse_rule('daily'), frozenset(range(7)))
+        assert_equals(recurrence.parse_rule(None), frozenset(range(7)))
+
+    def test_weekdays(self):
+        assert_equals(recurrence.parse_rule('Mon, fri'), frozenset([0, 4]))
+
+    def test_unknown_weekday(self):
+        assert_raises(ValueError, recurrence.parse_rule, 'mon,funday')
+
+    def test_non_str(self):
+        assert_raises(ValueError, recurrence.parse_rule, 1)
+
+
+def test_days_start_at_the_next_midnight():
+    days = list(recurrence.days(
+        datetime(2016, 6, 1, 12), datetime(2016, 6, 4)))
+    assert_equals(days, [datetime(2016, 6, 2), datetime(2016, 6, 3)])
+
+
+def test_occurrences_follow_rules_and_ordering():
+    # 2016-06-13 is a Monday.
+    found = list(recurrence.occurrences(
+        [EVENING, MORNING], datetime(2016, 6, 13), datetime(2016, 6, 15)))
+    assert_equals(found, [
+        (datetime(2016, 6, 13), MORNING),
+        (datetime(2016, 6, 13), EVENING),
+        (datetime(2016, 6, 14), MORNING)])
+
+
+def test_occurrences_are_lazy():
+    # Expanding ten thousand years would not fit in memory as a list.
+    found = islice(recurrence.occurrences(
+        [MORNING], datetime(2000, 1, 1), datetime(9999, 1, 1)), 2)
+    assert_equals(len(list(found)), 2)
+
+
+def test_with_mutations_picks_latest_per_occurrence():
+    monday, tuesday = datetime(2016, 6, 13), datetime(2016, 6, 14)
+    mutations = [
+        FakeMutation(monday, EVENING, 1),
+        FakeMutation(monday, EVENING, 2),
+        # Evening does not recur on Tuesday; this one is skipped.
+        FakeMutation(tuesday, EVENING, 3),
+    ]
+    found = list(recurrence.with_mutations(
+        recurrence.occurrences([MORNING, EVENING], monday,
+                               datetime(2016, 6, 15)),
+        mutations))
+    assert_equals(found, [
+        (monday, MORNING, None),
+        (monday, EVENING, mutations[1]),
+        (tuesday, MORNING, None)])
@@ -0,0 +1,128 @@
+"""Tests for recording and replaying updates."""
+# pylint: disable=missing-docstring
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+
+from nose.tools import assert_equals, assert_in, assert_true
+
+from rabbot import api
+from rabbot.database import make_engine
+from rabbot.dummydb import group_database
+from rabbot.models import Mutation
+from rabbot.replay import (
+    CommandHandler, Histogram, Recording, STAGES, generate, load, replay)
+
+
+def _with_database(test):
+    """Run test(engine, factory) on group 1 with users 1, 2 and 2 shifts."""
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            # Handlers run on worker threads: a file, not one shared
+            # connection.
+            engine = make_engine(
+                'sqlite:///' + os.path.join(directory, 'replay.db'))
+            try:
+                test(engine, group_database(
+                    [('shift 0', 0), ('shift 1', 1)], users=(1, 2),
+                    engine=engine, user_name='user {}'.format))
+            finally:
+                engine.dispose()
+    run.__name__ = test.__name__
+    return run
+
+
+def _message(update_id, text, user=1):
+    return {'update_id': update_id, 'message': {
+        'text': text, 'chat': {'id': 1}, 'from': {'id': user}}}
+
+
+def test_record_and_load():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'updates.jsonl')
+        handled = []
+        handler = Recording(handled.append, path)
+        updates = [_message(1, '/week'), _message(2, 'hello')]
+        for update in updates:
+            handler(update)
+        assert_equals(handled, updates)
+        assert_equals(load(path), updates)
+
+
+def test_generate_is_deterministic():
+    updates = list(generate(20, groups=2))
+    assert_equals(updates, list(generate(20, groups=2)))
+    assert_equals([update['update_id'] for update in updates],
+                  list(range(1, 21)))
+    assert_true(all(update['message']['text'].startswith('/')
+                    for update in updates))
+
+
+def _check_command_handler(handler):
+    assert_equals(handler(_message(1, '/shifts')), 'shift 0\nshift 1')
+    assert_equals(handler(_message(2, '/drop 2 2016-06-06')),
+                  'Mutation added')
+    assert_equals(handler(_message(3, '/open 2016-06-06')),
+                  '2016-06-06 shift 1')
+    assert_equals(handler(_message(4, '/cover 2 2016-06-06', user=2)),
+                  'Mutation added')
+    assert_in('2016-06-06 shift 1: user 2',
+              handler(_message(5, '/week 2016-06-06')))
+    assert_equals(handler(_message(6, 'no command')), None)
+    assert_equals(handler(_message(7, '/cover 9 2016-06-06')),
+                  'No shifts with ID 9')
+
+
+@_with_database
+def test_command_handler(engine, factory):
+    _check_command_handler(CommandHandler(factory))
+
+
+@_with_database
+def test_command_handler_with_cache(engine, factory):
+    cache = api.ScheduleCache(factory)
+    try:
+        _check_command_handler(CommandHandler(factory, cache))
+        assert_true(cache.hits > 0)
+    finally:
+        cache.close()
+
+
+def test_histogram():
+    histogram = Histogram()
+    for milliseconds in (0.1, 0.2, 0.3, 5):
+        histogram.add(milliseconds / 1e3)
+    assert_equals(histogram.buckets(), [(0.125, 1), (0.25, 1), (0.5, 1),
+                                        (8.0, 1)])
+    assert_equals(histogram.percentile(0.5), 0.3 / 1e3)
+
+
+@_with_database
+def test_replay_through_stub(engine, factory):
+    updates = [_message(number, '/cover {} 2016-06-{:02}'.format(
+        1 + number % 2, 1 + number)) for number in range(1, 21)]
+    updates.append(_message(21, '/week 2016-06-01'))
+    report = asyncio.run(replay(updates, CommandHandler(factory), engine,
+                                workers=4))
+    assert_equals(report.updates, 21)
+    assert_equals(report.failed, 0)
+    assert_true(report.rate > 0)
+    assert_true(report.peak_rss_kb > 0)
+    for stage in STAGES:
+        assert_equals(len(report.stages[stage].samples), 21)
+    assert_in('updates/s', report.render())
+    session = factory()
+    assert_equals(session.query(Mutation).count(), 20)
+    session.close()
+
+
+@_with_database
+def test_replay_at_a_rate(engine, factory):
+    updates = [_message(number, '/shifts') for number in range(1, 6)]
+    started = datetime.now()
+    report = asyncio.run(replay(updates, CommandHandler(factory), engine,
+                                rate=50))
+    # 5 updates at 50/s are offered over at least 80ms.
+    assert_true((datetime.now() - started).total_seconds() >= 0.08)
+    assert_equals(report.updates, 5)
@@ -0,0 +1,150 @@
+"""Tests for the multi-process supervisor."""
+# pylint: disable=missing-docstring,protected-access
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from nose.tools import assert_equals, assert_true
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, select
+
+from rabbot.supervisor import Supervisor, _Shard, shard_of
+
+HANDLED = Table(
+    'handled', MetaData(),
+    Column('row_id', Integer, primary_key=True),
+    Column('chat_id', Integer),
+    Column('update_id', Integer),
+    Column('pid', Integer))
+
+
+def _update(update_id, chat_id):
+    return {'update_id': update_id,
+            'message': {'chat': {'id': chat_id}, 'text': str(update_id)}}
+
+
+def record(update):
+    """Handler: remember which process handled the update, in order."""
+    if update['message']['text'] == 'crash':
+        os._exit(1)  # pylint: disable=protected-access
+    engine = create_engine(os.environ['RABBOT_TEST_DATABASE'])
+    with engine.begin() as connection:
+        connection.execute(HANDLED.insert().values(
+            chat_id=update['message']['chat']['id'],
+            update_id=update['update_id'], pid=os.getpid()))
+    engine.dispose()
+
+
+def _database():
+    url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'handled.db')
+    engine = create_engine(url)
+    HANDLED.metadata.create_all(engine)
+    # The spawned workers inherit the environment.
+    os.environ['RABBOT_TEST_DATABASE'] = url
+    return engine
+
+
+def _handled(engine):
+    with engine.connect() as connection:
+        return connection.execute(select(
+            HANDLED.c.chat_id, HANDLED.c.update_id, HANDLED.c.pid).
+            order_by(HANDLED.c.row_id)).all()
+
+
+def test_shard_of_is_stable():
+    assert_equals(shard_of(_update(1, 42), 4), shard_of(_update(2, 42), 4))
+    assert_equals(len({shard_of(_update(1, chat), 4)
+                       for chat in range(100)}), 4)
+
+
+def test_chats_stay_in_order_and_on_one_process():
+    engine = _database()
+
+    async def run():
+        supervisor = Supervisor(record, workers=2, threads=4)
+        supervisor.start()
+        for update_id in range(1, 81):
+            await supervisor.submit(_update(update_id, update_id % 8))
+        await supervisor.stop()
+        return supervisor.handled
+
+    assert_equals(asyncio.run(run()), 80)
+    rows = _handled(engine)
+    for chat in range(8):
+        chat_rows = [row for row in rows if row.chat_id == chat]
+        assert_equals([row.update_id for row in chat_rows],
+                      list(range(chat or 8, 81, 8)))
+        assert_equals(len({row.pid for row in chat_rows}), 1)
+    assert_equals(len({row.pid for row in rows}), 2)
+
+
+def test_dead_workers_are_restarted():
+    engine = _database()
+
+    async def run():
+        supervisor = Supervisor(record, workers=1, check_interval=0.05)
+        supervisor.start()
+        crash = _update(1, 1)
+        crash['message']['text'] = 'crash'
+        await supervisor.submit(crash)
+        for update_id in range(2, 6):
+            await supervisor.submit(_update(update_id, 1))
+        await supervisor.stop()
+        return supervisor
+
+    supervisor = asyncio.run(run())
+    assert_equals(supervisor.restarts, 1)
+    # What the worker had taken is lost, the rest waited in the queue.
+    assert_true(supervisor.lost >= 1)
+    assert_equals(supervisor.handled + supervisor.lost, 5)
+    assert_equals([row.update_id for row in _handled(engine)],
+                  [2, 3, 4, 5][supervisor.lost - 1:])
+
+
+def test_resize_after_draining():
+    engine = _database()
+
+    async def run():
+        supervisor = Supervisor(record, workers=1)
+        supervisor.start()
+        await supervisor.submit(_update(1, 1))
+        await supervisor.resize(3)
+        assert_equals(supervisor.workers, 3)
+        for update_id in range(2, 11):
+            await supervisor.submit(_update(update_id, update_id))
+        await supervisor.stop()
+        return supervisor.handled
+
+    assert_equals(asyncio.run(run()), 10)
+    assert_equals(len(_handled(engine)), 10)
+
+
+class _DeadProcess(object):
+
+    exitcode = -9
+
+    def is_alive(self):
+        return False
+
+
+def test_update_got_but_not_counted_is_lost():
+    supervisor = Supervisor(record, workers=1)
+    shard = _Shard(multiprocessing.get_context('spawn'), 10)
+    for update_id in (1, 2, 3):
+        shard.queue.put(_update(update_id, 1))
+        shard.submitted += 1
+    # The worker dies between queue.get() and counting the update as taken.
+    shard.queue.get()
+    supervisor._shards = [shard]
+    supervisor._processes = [_DeadProcess()]
+    supervisor._spawn = lambda shard: _DeadProcess()
+    assert_equals(supervisor.check(), 1)
+    assert_equals(supervisor.lost, 1)
+    for _ in range(2):
+        shard.queue.get()
+        shard.queue.task_done()
+    joining = threading.Thread(target=shard.queue.join, daemon=True)
+    joining.start()
+    joining.join(5)
+    assert_true(not joining.is_alive())
@@ -0,0 +1,61 @@
+"""Tests for streaming export and import."""
+# pylint: disable=missing-docstring
+import io
+import os
+import tempfile
+from datetime import datetime
+
+from nose.tools import assert_equals
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from rabbot import api, transfer
+from rabbot.models import BASE, Mutation, RosterEntry, Schedule, Shift, User
+
+
+def _roster_database(url):
+    engine = create_engine(url)
+    BASE.metadata.create_all(engine)
+    return engine
+
+
+def test_round_trip_through_files():
+    with tempfile.TemporaryDirectory() as directory:
+        source_url = 'sqlite:///' + os.path.join(directory, 'source.db')
+        target_url = 'sqlite:///' + os.path.join(directory, 'target.db')
+        with Session(_roster_database(source_url)) as session:
+            user = User(telegram_user_id=1, name="Oskar")
+            schedule = Schedule(telegram_group_id=1, admin=user, users=[user])
+            shift = Shift(schedule=schedule, name="shift, with comma",
+                          ordering=1)
+            session.add_all([user, schedule, shift])
+            session.commit()
+            api.add_mutation(session, 1, 1, shift.shift_id,
+                             datetime(2016, 6, 15), 1)
+            session.commit()
+        target = _roster_database(target_url)
+        for kind, fmt in [('users', 'csv'), ('schedules', 'jsonl'),
+                          ('members', 'csv'), ('shifts', 'csv'),
+                          ('mutations', 'jsonl')]:
+            path = os.path.join(directory, '{}.{}'.format(kind, fmt))
+            transfer.main(['export', source_url, kind, path, '--format', fmt])
+            transfer.main(['import', target_url, kind, path, '--format', fmt])
+        with Session(target) as session:
+            assert_equals(session.get(Shift, 1).name, "shift, with comma")
+            assert_equals(session.get(Mutation, 1).shift_date,
+                          datetime(2016, 6, 15))
+            assert_equals(session.get(Schedule, 1).users[0].name, "Oskar")
+            assert_equals(session.scalar(
+                select(func.count()).select_from(RosterEntry)), 1)
+
+
+def test_csv_parsing():
+    table = transfer.KINDS['mutations']
+    stream = io.StringIO(
+        'mutation_id,schedule_id,shift_date,shift_id,mutator_id,new_user_id\n'
+        '1,2,2016-06-15T00:00:00,3,4,\n')
+    rows = list(transfer.read_rows(stream, table))
+    assert_equals(rows, [{
+        'mutation_id': 1, 'schedule_id': 2,
+        'shift_date': datetime(2016, 6, 15), 'shift_id': 3, 'mutator_id': 4,
+        'new_user_id': None}])
@@ -0,0 +1,84 @@
+"""Tests for webhook ingestion, by POSTing updates to localhost."""
+# pylint: disable=missing-docstring
+import asyncio
+import threading
+
+import aiohttp
+from nose.tools import assert_equals
+
+from rabbot.dispatch import Dispatcher
+from rabbot.webhook import WebhookReceiver
+
+
+def _update(update_id, chat_id=1):
+    return {'update_id': update_id,
+            'message': {'chat': {'id': chat_id}, 'text': str(update_id)}}
+
+
+async def _post_all(url, updates, headers=None):
+    async with aiohttp.ClientSession() as session:
+        statuses = []
+        for update in updates:
+            async with session.post(
+                    url + '/webhook', json=update, headers=headers) as reply:
+                statuses.append(reply.status)
+        return statuses
+
+
+def test_updates_reach_the_handler_once():
+    handled = []
+
+    async def run():
+        dispatcher = Dispatcher(lambda update: handled.append(update))
+        dispatcher.start()
+        receiver = WebhookReceiver(dispatcher)
+        url = await receiver.start(port=0)
+        statuses = await _post_all(
+            url, [_update(1), _update(2), _update(1)])
+        await receiver.stop()
+        await dispatcher.stop()
+        return statuses, receiver
+
+    statuses, receiver = asyncio.run(run())
+    assert_equals(statuses, [200, 200, 200])
+    assert_equals([update['update_id'] for update in handled], [1, 2])
+    assert_equals(receiver.duplicates, 1)
+
+
+def test_full_queue_answers_429():
+    release = threading.Event()
+
+    async def run():
+        dispatcher = Dispatcher(
+            lambda update: release.wait(5), workers=1, max_pending=1)
+        dispatcher.start()
+        receiver = WebhookReceiver(dispatcher, max_queue=1)
+        url = await receiver.start(port=0)
+        # One update is being handled, one waits for the dispatcher and
+        # one waits in the receiver's queue; the fourth does not fit.
+        statuses = []
+        for update_id in range(1, 5):
+            statuses += await _post_all(url, [_update(update_id)])
+            await asyncio.sleep(0.02)
+        release.set()
+        await receiver.stop()
+        await dispatcher.stop()
+        return statuses
+
+    assert_equals(asyncio.run(run()), [200, 200, 200, 429])
+
+
+def test_secret_token_is_checked():
+    async def run():
+        dispatcher = Dispatcher(lambda update: None)
+        dispatcher.start()
+        receiver = WebhookReceiver(dispatcher, secret_token='s3cret')
+        url = await receiver.start(port=0)
+        statuses = await _post_all(url, [_update(1)])
+        statuses += await _post_all(
+            url, [_update(2)], {'X-Telegram-Bot-Api-Secret-Token': 's3cret'})
+        await receiver.stop()
+        await dispatcher.stop()
+        return statuses
+
+    assert_equals(asyncio.run(run()), [403, 200])
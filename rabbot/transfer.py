@@ -0,0 +1,147 @@
+"""Stream users, schedules, shifts and mutations to and from files.
+
+    python -m rabbot.transfer export DATABASE_URL KIND [--format FORMAT] [FILE]
+    python -m rabbot.transfer import DATABASE_URL KIND [--format FORMAT] [FILE]
+
+KIND is one of users, schedules, members, shifts or mutations; FORMAT is
+csv (the default) or jsonl. FILE defaults to standard output or input.
+Rows keep their IDs, so import the kinds in the order above. Rows are
+streamed in batches in both directions: memory use does not depend on the
+size of the roster. Importing mutations rebuilds the roster table.
+"""
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import DateTime, Integer, insert, select
+from sqlalchemy.orm import Session
+
+from rabbot.database import make_engine
+from rabbot.api.roster import rebuild_roster
+from rabbot.models import association_table, Mutation, Schedule, Shift, User
+
+KINDS = {
+    'users': User.__table__,
+    'schedules': Schedule.__table__,
+    'members': association_table,
+    'shifts': Shift.__table__,
+    'mutations': Mutation.__table__,
+}
+BATCH = 1000
+
+
+def export_rows(connection, table):
+    """Yield every row of table as a dict, fetching BATCH rows at a time."""
+    order = list(table.primary_key.columns) or list(table.columns)
+    result = connection.execution_options(yield_per=BATCH).execute(
+        select(table).order_by(*order))
+    for row in result.mappings():
+        yield dict(row)
+
+
+def _to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def write_rows(rows, stream, table, fmt: str='csv') -> int:
+    """Write rows to stream; return how many were written."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        columns = [column.name for column in table.columns]
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_to_text(row[column]) for column in columns])
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(
+                {key: _to_text(value) if isinstance(value, datetime)
+                 else value for key, value in row.items()}) + '\n')
+            count += 1
+    return count
+
+
+def _parse(column, value):
+    """Convert a value read from a file to the column's Python type."""
+    if value is None or value == '':
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Integer):
+        return int(value)
+    return value
+
+
+def read_rows(stream, table, fmt: str='csv'):
+    """Yield rows of table read from stream, converted to column types."""
+    if fmt == 'csv':
+        records = csv.DictReader(stream)
+    else:
+        records = (json.loads(line) for line in stream if line.strip())
+    for record in records:
+        yield {column.name: _parse(column, record.get(column.name))
+               for column in table.columns if column.name in record}
+
+
+def import_rows(connection, table, rows) -> int:
+    """Insert rows in batches of BATCH; return how many were inserted."""
+    count = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH))
+        if not batch:
+            return count
+        connection.execute(insert(table), batch)
+        count += len(batch)
+
+
+def main(argv=None):
+    """Run the export or import described by the command line."""
+    parser = argparse.ArgumentParser(
+        prog='python -m rabbot.transfer',
+        description="Export or import rabbot data as CSV or JSON Lines.")
+    parser.add_argument('direction', choices=['export', 'import'])
+    parser.add_argument('database_url')
+    parser.add_argument('kind', choices=sorted(KINDS))
+    parser.add_argument('file', nargs='?')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    args = parser.parse_args(argv)
+    table = KINDS[args.kind]
+    engine = make_engine(args.database_url)
+    if args.direction == 'export':
+        stream = open(args.file, 'w', newline='') if args.file else sys.stdout
+        try:
+            with engine.connect() as connection:
+                count = write_rows(
+                    export_rows(connection, table), stream, table, args.format)
+        finally:
+            if args.file:
+                stream.close()
+    else:
+        stream = open(args.file, newline='') if args.file else sys.stdin
+        try:
+            with Session(engine) as session:
+                count = import_rows(
+                    session.connection(), table,
+                    read_rows(stream, table, args.format))
+                if table is Mutation.__table__:
+                    rebuild_roster(session)
+                session.commit()
+        finally:
+            if args.file:
+                stream.close()
+    print("{}ed {} {}".format(args.direction, count, args.kind),
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""Receive Telegram updates through a webhook instead of long polling.
+
+Telegram POSTs every update to the webhook URL. The receiver answers as
+soon as the update is queued; a background task moves queued updates to
+the Dispatcher. When the queue is full the receiver answers 429, which
+makes Telegram retry the update later, and updates it has already
+accepted are recognised by update_id and not queued twice.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiohttp import web
+
+LOGGER = logging.getLogger(__name__)
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookReceiver(object):
+
+    """aiohttp endpoint feeding a Dispatcher."""
+
+    def __init__(self, dispatcher, path: str='/webhook',
+                 max_queue: int=1000, remembered: int=10000,
+                 secret_token: str=None, retry_after: int=1):
+        self._dispatcher = dispatcher
+        self._queue = asyncio.Queue(max_queue)
+        self._seen = OrderedDict()
+        self._remembered = remembered
+        self._secret_token = secret_token
+        self._retry_after = retry_after
+        self._forwarder = None
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post(path, self.receive)
+        self.app.on_startup.append(self._start_forwarding)
+        self.app.on_cleanup.append(self._stop_forwarding)
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    @property
+    def queued(self) -> int:
+        """Updates accepted but not yet handed to the dispatcher."""
+        return self._queue.qsize()
+
+    async def receive(self, request):
+        """Queue the posted update and acknowledge it."""
+        if (self._secret_token is not None and
+                request.headers.get(SECRET_HEADER) != self._secret_token):
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+            update_id = update['update_id']
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        if update_id in self._seen:
+            self.duplicates += 1
+            return web.Response()
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(
+                status=429, headers={'Retry-After': str(self._retry_after)})
+        self._remember(update_id)
+        self.accepted += 1
+        return web.Response()
+
+    def _remember(self, update_id) -> None:
+        self._seen[update_id] = None
+        if len(self._seen) > self._remembered:
+            self._seen.popitem(last=False)
+
+    async def _forward(self) -> None:
+        while True:
+            update = await self._queue.get()
+            await self._dispatcher.submit(update)
+            self._queue.task_done()
+
+    async def _start_forwarding(self, app) -> None:
+        # pylint: disable=unused-argument
+        self._forwarder = asyncio.ensure_future(self._forward())
+
+    async def _stop_forwarding(self, app) -> None:
+        # pylint: disable=unused-argument
+        await self._queue.join()
+        self._forwarder.cancel()
+        await asyncio.gather(self._forwarder, return_exceptions=True)
+
+    async def start(self, host: str='127.0.0.1', port: int=8443) -> str:
+        """Serve the endpoint; return its base URL."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return 'http://{}:{}'.format(host, self._runner.addresses[0][1])
+
+    async def stop(self) -> None:
+        """Hand every queued update to the dispatcher and stop serving."""
+        await self._runner.cleanup()